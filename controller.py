@@ -1,15 +1,21 @@
 """Main Application Controller"""
 
+import os
 from PySide2.QtGui import QGuiApplication
 from PySide2.QtCore import Qt, QTimer
-from PySide2.QtWidgets import QFileDialog, QStyle
+from PySide2.QtWidgets import QFileDialog, QMessageBox, QProgressDialog, QStyle
 
 from ui.main_window import MainWindow
 from ui.dialogs.currency_dialog import CurrencyDialog
 from ui.dialogs.source_dialog import SourceDialog
+from ui.dialogs.balance_dialog import BalanceDialog, BalanceWorker
 from ui.windows.simulation_window import SimulationWindow
-from gmc.components import Component, Source, Currency
+from ui.instrumentation import CanvasProfiler
+from gmc.balancing import RateBalancer
+from gmc.components import Component, Group, Source, Currency
 from gmc.flow_model import FlowModel
+from gmc.journal import ChangeJournal
+from gmc.layout import LayoutEngine
 
 
 class Controller():
@@ -17,29 +23,44 @@ class Controller():
 
     def __init__(self, main_window: MainWindow):
         self._window = None
+        self.journal = None
+        self.filename = None
+        self.autosave = False
+        self.__balance_worker = None
         self.__connect_source = None
         self.__connect_target = None
 
         self.model = FlowModel()
+        self.layout_engine = LayoutEngine()
         self.model.connect(main_window.canvas.draw_flow_model)
 
         main_window.menu.add_currency.connect(self.add_currency_event)
         main_window.menu.add_source.connect(self.add_source_event)
         main_window.menu.save_model.connect(self.save_model)
         main_window.menu.load_model.connect(self.load_model)
+        main_window.menu.toggle_autosave.connect(self.toggle_autosave)
+        main_window.menu.arrange_model.connect(self.arrange_model)
+        main_window.menu.balance_model.connect(self.balance_model)
         main_window.start_simulation.connect(self.open_simulation_window)
+        main_window.undo.connect(self.undo)
+        main_window.redo.connect(self.redo)
+        main_window.toggle_profiler.connect(self.toggle_profiler)
 
         self.canvas = main_window.canvas
         self.canvas.connect_selection(self.cavas_selection)
         self.canvas.connect_drag(self.model.move_component_position)
+        self.canvas.connect_group_toggle(self.toggle_group)
 
         self.item = main_window.item
         self.item.add_input.connect(self.add_input_event)
         self.item.add_connection.connect(self.add_connection_event)
         self.item.deleted.connect(self.delete_component)
         self.item.updated.connect(self.delete_connection)
+        self.item.value_changed.connect(self.model.set_value)
 
         main_window.canvas.draw_flow_model(self.model)
+        if os.environ.get('GMC_CANVAS_LOG'):
+            self.toggle_profiler()
 
     def add_currency_event(self):
         """Resolve add currency event"""
@@ -92,25 +113,129 @@ class Controller():
 
     def cavas_selection(self, component: Component):
         """Resolve canvas selection event"""
+        self.model.history.seal()
         if not self.__connect_source is None:
             self.__complete_connection_event(component)
         elif not self.__connect_target is None:
             self.__complete_input_event(component)
         self.item.set_item(component)
 
+    def toggle_group(self, group: Group):
+        """Resolve collapse or expand group event"""
+        self.model.history.seal()
+        self.model.set_value(group, 'collapsed', not group.collapsed)
+        self.item.set_item(self.canvas.selected_object)
+
     def save_model(self):
         """Resolve save model event"""
         filename = QFileDialog.getSaveFileName(caption = 'Save Model Graph', dir = 'model.yaml', filter = 'YAML (*.yaml);;All Files (*.*)')
         if len(filename[0]) > 0:
-            self.model.save_to_file(filename[0])
+            self.__close_journal()
+            self.filename = filename[0]
+            if self.autosave:
+                self.journal = ChangeJournal(self.model, self.filename)
+            else:
+                self.model.save_to_file(self.filename)
+                ChangeJournal.discard(self.filename)
 
     def load_model(self):
         """Resolve load model event"""
         filename = QFileDialog.getOpenFileName(caption = 'Load Model Graph', filter = 'YAML (*.yaml);;All Files (*.*)')
         if len(filename[0]) > 0:
-            self.model.load_from_file(filename[0])
+            self.__close_journal()
+            self.filename = filename[0]
+            ChangeJournal.recover(self.model, self.filename)
             self.model.normalize_positions()
+            self.model.history.clear()
             self.canvas.translate_center(-self.canvas.center())
+            if self.autosave:
+                self.journal = ChangeJournal(self.model, self.filename)
+
+    def toggle_autosave(self, enabled: bool):
+        """Resolve autosave toggle event"""
+        self.autosave = enabled
+        self.__close_journal()
+        if enabled and self.filename is not None:
+            self.journal = ChangeJournal(self.model, self.filename)
+
+    def __close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def arrange_model(self):
+        """Resolve arrange model event"""
+        if self.model.num_components() == 0:
+            return
+        self.model.set_layout(self.layout_engine.arrange(self.model))
+        self.canvas.translate_center(-self.canvas.center())
+
+    def balance_model(self):
+        """Resolve balance model event"""
+        if self.model.num_components() == 0 or len(self.model.connections) == 0:
+            return
+        dialog = BalanceDialog()
+        if not dialog.exec_():
+            return
+        balancer = RateBalancer(self.model, dialog.goal_edit.value(), dialog.parameters(self.model),
+            tolerance=dialog.tolerance_edit.value() / 100, budget=dialog.budget_edit.value(), processes=None)
+        progress = QProgressDialog('Balancing rates...', 'Cancel', 0, balancer.budget)
+        progress.setWindowTitle('Balance Rates')
+        progress.setWindowModality(Qt.ApplicationModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        worker = BalanceWorker(balancer)
+        worker.progress.connect(lambda done, total: progress.setValue(done))
+        worker.finished.connect(lambda: self.__balance_finished(worker, progress))
+        progress.canceled.connect(worker.cancel)
+        progress.canceled.connect(lambda: progress.setLabelText('Cancelling...'))
+        self.__balance_worker = worker
+        worker.start()
+        progress.show()
+
+    def __balance_finished(self, worker: BalanceWorker, progress: QProgressDialog):
+        progress.close()
+        self.__balance_worker = None
+        result = worker.result
+        if result['status'] == 3:
+            return
+        if result['status'] == 1:
+            QMessageBox.warning(None, 'Balance Rates', result['message'])
+            return
+        with self.model.history.group():
+            worker.balancer.apply(self.model, result)
+        self.item.set_item(self.canvas.selected_object)
+        QMessageBox.information(None, 'Balance Rates',
+            f"{result['message']}\nSimulated Time: {result['time']:g} time steps ({result['evaluations']} simulations)")
+
+    def undo(self):
+        """Resolve undo event"""
+        if self.model.undo():
+            self.__refresh_selection()
+
+    def redo(self):
+        """Resolve redo event"""
+        if self.model.redo():
+            self.__refresh_selection()
+
+    def __refresh_selection(self):
+        if self.canvas.selected_object not in self.model.get_components():
+            self.canvas.selected_object = None
+        self.item.set_item(self.canvas.selected_object)
+
+    def toggle_profiler(self):
+        """Resolve toggle canvas profiler event"""
+        profiler = self.canvas.profiler
+        if profiler is None:
+            profiler = CanvasProfiler(os.environ.get('GMC_CANVAS_LOG') or CanvasProfiler.LOG_FILE)
+            self.model.connect_timing(profiler.record_notify)
+            self.canvas.set_profiler(profiler)
+            self.model.notify()
+        else:
+            self.model.disconnect_timing(profiler.record_notify)
+            self.canvas.set_profiler(None)
+            profiler.close()
 
     def open_simulation_window(self):
         """Resolve start simulation event"""
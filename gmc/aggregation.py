@@ -0,0 +1,130 @@
+"""GMC Group Aggregation
+
+Collapsing a group only changes how it is drawn. Optionally, groups that form a linear chain can also be solved
+as a single aggregate source: a chain of sources with one input and one output each, linked by currencies used
+only between them, converts its input into its output at a fixed ratio, so replacing it by one source leaves the
+linear program unchanged. Conversions are cached on the model and only computed again when the group or its
+parameters change.
+"""
+
+from __future__ import annotations
+
+from typing import List
+
+from gmc.components import Connection, Currency, Group, Position, Source
+from gmc.flow_model import FlowModel
+
+
+def group_parts(model: FlowModel, group: Group) -> tuple:
+    """Returns the sources of a group and its internal currencies
+    Internal currencies are group currencies without target values that are connected to group sources only.
+    """
+    members = model.group_members(group)
+    sources = [comp for comp in members if isinstance(comp, Source)]
+    source_ids = {source.id for source in sources}
+    targeted = {key for targets in model.stage_targets() for key, value in targets.items() if value > 0}
+    internal = [comp for comp in members if isinstance(comp, Currency) and comp.id not in targeted
+        and all(conn.target.id in source_ids for conn in comp.connections)
+        and all(conn.source.id in source_ids for conn in comp.inputs)]
+    return sources, internal
+
+
+def _group_key(sources: List[Source], internal: List[Currency]) -> int:
+    return hash((tuple((source.id, source.time_step) for source in sources),
+        tuple((conn.source.id, conn.target.id, conn.rate, conn.chance) for source in sources
+            for conn in source.inputs + source.connections),
+        tuple(currency.id for currency in internal)))
+
+
+def aggregate_group(model: FlowModel, group: Group) -> dict:
+    """Returns the equivalent conversion of a group per firing of its last source
+    The status is 0 on success; groups that are not linear chains or have scheduled parameters cannot be
+    aggregated.
+    """
+    sources, internal = group_parts(model, group)
+    key = _group_key(sources, internal)
+    cached = model.aggregate_cache.get(group.id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    result = _solve_chain(sources, internal)
+    model.aggregate_cache[group.id] = (key, result)
+    return result
+
+
+def _chain_order(sources: List[Source], internal: List[Currency]) -> List[Source]:
+    """Returns the sources of a linear chain from first to last, or None if they do not form one"""
+    internal_ids = {currency.id for currency in internal}
+    if len(internal) != len(sources) - 1:
+        return None
+    if any(len(source.inputs) > 1 or len(source.connections) != 1 for source in sources):
+        return None
+    if any(len(currency.inputs) != 1 or len(currency.connections) != 1 for currency in internal):
+        return None
+    first = [source for source in sources if not source.inputs or source.inputs[0].source.id not in internal_ids]
+    if len(first) != 1:
+        return None
+    chain = first
+    while chain[-1].connections[0].target.id in internal_ids:
+        chain.append(chain[-1].connections[0].target.connections[0].target)
+    return chain if len(chain) == len(sources) else None
+
+
+def _solve_chain(sources: List[Source], internal: List[Currency]) -> dict:
+    if len(sources) == 0:
+        return {'status': 1, 'message': 'Group has no sources.'}
+    if any(source.schedules or any(conn.schedules for conn in source.inputs + source.connections) for source in sources):
+        return {'status': 1, 'message': 'Group has scheduled parameters.'}
+    chain = _chain_order(sources, internal)
+    if chain is None:
+        return {'status': 1, 'message': 'Group is not a linear chain.'}
+    if any(source.connections[0].chance < 1 or source.connections[0].rate <= 0 for source in chain[:-1]):
+        return {'status': 1, 'message': 'Group has random or empty outputs inside the chain.'}
+    # fires of every source per fire of the last one
+    fires = [1.]
+    for prev, source in zip(reversed(chain[:-1]), reversed(chain[1:])):
+        fires.insert(0, fires[0] * source.inputs[0].rate / prev.connections[0].rate)
+    first, last = chain[0], chain[-1]
+    output = last.connections[0]
+    return {
+        'status': 0,
+        'message': 'Group aggregated.',
+        'sources': [source.id for source in chain],
+        'internal': [currency.id for currency in internal],
+        'time_step': max(source.time_step * count for source, count in zip(chain, fires)),
+        'inputs': {first.inputs[0].source.id: first.inputs[0].rate * fires[0]} if first.inputs else {},
+        'outputs': {output.target.id: output.rate},
+        'chance': output.chance
+    }
+
+
+def collapse_groups(model: FlowModel) -> FlowModel:
+    """Returns a copy of the model with every collapsed linear chain group replaced by its aggregate source
+    The aggregate source has the id and name of the group. Groups that cannot be aggregated or overlap an
+    earlier collapsed group stay expanded.
+    """
+    hidden = set()
+    aggregates = []
+    for group in model.groups:
+        if not group.collapsed:
+            continue
+        conversion = aggregate_group(model, group)
+        parts = set(conversion.get('sources', [])) | set(conversion.get('internal', []))
+        if conversion['status'] != 0 or parts & hidden:
+            continue
+        hidden |= parts
+        aggregates.append((group, conversion))
+    other = model.submodel([comp for comp in model.get_components() if comp.id not in hidden])
+    other.groups = []
+    lookup = {comp.id: comp for comp in other.get_components()}
+    positions = {comp.id: comp.pos for comp in model.get_components()}
+    for group, conversion in aggregates:
+        coords = [positions[key].coords() for key in conversion['sources']]
+        source = Source(group.name, Position(sum(x for x, _ in coords) / len(coords), sum(y for _, y in coords) / len(coords)),
+            time_step=conversion['time_step'])
+        source.id = group.id
+        other.sources.append(source)
+        for key, amount in conversion['inputs'].items():
+            other.connections.append(Connection(lookup[key], source, rate=amount))
+        for key, amount in conversion['outputs'].items():
+            other.connections.append(Connection(source, lookup[key], rate=amount, chance=conversion['chance']))
+    return other
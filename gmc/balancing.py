@@ -0,0 +1,236 @@
+"""GMC Rate Balancing"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+import numpy as np
+from scipy.optimize import minimize
+
+from gmc.components import Component, Source
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator, _part_flow, _part_throughput
+from gmc.reduction import prune_model
+
+
+class Tunable():
+    """Tunable Parameter Class
+
+    A connection rate or chance, given as 'source -> target', or a source time step that the balancer may change
+    within the bounds. Components are referenced by name or id; parallel connections between the same
+    components are told apart by their index, e.g. 'source -> target #1'.
+    """
+
+    def __init__(self, key: str, attribute: str, low: float, high: float):
+        if attribute not in ('rate', 'chance', 'time_step'):
+            raise ValueError(f"Attribute '{attribute}' cannot be tuned!")
+        if not 0 < low <= high:
+            raise ValueError(f"Invalid bounds for '{key}'!")
+        self.key = key
+        self.attribute = attribute
+        self.low = low
+        self.high = high
+
+    def locate(self, model: FlowModel) -> tuple:
+        """Returns the name of the model list holding the parameter and its index in that list
+        Raises a ValueError for unknown or ambiguous keys.
+        """
+        def find(key: str) -> Component:
+            matches = [comp for comp in model.get_components() if key == comp.id]
+            matches = matches or [comp for comp in model.get_components() if key == comp.name]
+            if len(matches) != 1:
+                raise ValueError(f"{'Unknown' if not matches else 'Ambiguous'} component '{key}'!")
+            return matches[0]
+        if self.attribute == 'time_step':
+            source = find(self.key.strip())
+            if not isinstance(source, Source):
+                raise ValueError(f"'{self.key}' is not a source!")
+            return 'sources', model.sources.index(source)
+        pair, _, index = self.key.partition('#')
+        src, tgt = (find(part.strip()) for part in pair.split('->', 1))
+        matches = [idx for idx, conn in enumerate(model.connections) if conn.source is src and conn.target is tgt]
+        if len(matches) == 0:
+            raise ValueError(f"Unknown connection '{self.key}'!")
+        if not index.strip() and len(matches) > 1:
+            raise ValueError(f"Ambiguous connection '{self.key}', give the index of the parallel connection!")
+        if index.strip() and not (index.strip().isdigit() and int(index) < len(matches)):
+            raise ValueError(f"Unknown connection '{self.key}'!")
+        return 'connections', matches[int(index) if index.strip() else 0]
+
+    def _target(self, model: FlowModel):
+        kind, index = self.locate(model)
+        return getattr(model, kind)[index]
+
+    def get(self, model: FlowModel) -> float:
+        """Returns the current value in the model"""
+        return getattr(self._target(model), self.attribute)
+
+    def set(self, model: FlowModel, value: float):
+        """Sets the value in the model"""
+        model.set_value(self._target(model), self.attribute, float(value))
+
+
+def surrogate_time(model: FlowModel) -> float:
+    """Returns the sum of the throughput times of all stages, the cheap estimate of the simulated time
+    Single stage models in which some source gets no flow are rejected by the simulator, so their time is
+    infinite as well.
+    """
+    pruned = prune_model(model)
+    stages = pruned.stage_targets()
+    if len(stages) == 1:
+        flow = _part_flow(pruned)
+        if flow['status'] != 0 or flow['steps'] <= 0 or np.any(np.asarray(flow['s']) <= 0):
+            return np.inf
+        return float(flow['steps'])
+    total = 0.
+    for targets in stages:
+        for currency in pruned.currencies:
+            currency.target_value = targets[currency.id]
+        result = _part_throughput(pruned)
+        if result['status'] != 0 or result['throughput'] <= 0:
+            return np.inf
+        total += 1. / result['throughput']
+    return total
+
+
+def simulated_time(model: FlowModel, replicas: int = 1, seed: int = None, max_steps: int = 1000000) -> float:
+    """Returns the mean simulated time to reach all targets"""
+    simulator = Simulator(model, reduce=True)
+    if simulator.status != 0:
+        return np.inf
+    times = []
+    for replica_seed in np.random.SeedSequence(seed).spawn(replicas):
+        simulator.reset(replica_seed)
+        simulator.run(max_steps=max_steps)
+        if simulator.stage() < simulator.num_stages():
+            return np.inf
+        times.append(simulator.step_num)
+    return float(np.mean(times))
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class RateBalancer():
+    """Rate Balancing Optimizer Class
+
+    Tunes parameters of a model such that all targets are reached after the goal time within a relative
+    tolerance, changing the parameters as little as possible. The search runs on the throughput time of the
+    linear program; the candidates are then simulated in parallel batches and the goal of the search is
+    corrected by the ratio of simulated to surrogate time until a candidate hits the goal or the simulation
+    budget is spent.
+    """
+
+    def __init__(self, model: FlowModel, goal: float, parameters: List[Tunable], tolerance: float = 0.05,
+                 budget: int = 32, batch_size: int = 4, replicas: int = 1, surrogate_budget: int = 2000,
+                 seed: int = None, processes: int = 1):
+        self.goal = goal
+        self.parameters = parameters
+        self.tolerance = tolerance
+        self.budget = budget
+        self.batch_size = batch_size
+        self.replicas = replicas
+        self.surrogate_budget = surrogate_budget
+        self.seed = seed
+        self.processes = processes
+        self._model = model.copy()
+        self._locations = [param.locate(self._model) for param in parameters]
+        self._low = np.log([param.low for param in parameters])
+        self._high = np.log([param.high for param in parameters])
+        initial = np.log([np.clip(self._value(self._model, idx), param.low, param.high) for idx, param in enumerate(parameters)])
+        self._initial = self._normalize(initial)
+        self._cancelled = False
+
+    def _normalize(self, values: np.ndarray) -> np.ndarray:
+        return (values - self._low) / np.maximum(self._high - self._low, 1e-12)
+
+    def _values(self, point: np.ndarray) -> np.ndarray:
+        return np.exp(self._low + np.clip(point, 0, 1) * (self._high - self._low))
+
+    def _value(self, model: FlowModel, idx: int) -> float:
+        kind, index = self._locations[idx]
+        return getattr(getattr(model, kind)[index], self.parameters[idx].attribute)
+
+    def candidate(self, point: np.ndarray) -> FlowModel:
+        """Returns a copy of the model with the parameter values of a normalized point"""
+        model = self._model.copy()
+        for (kind, index), param, value in zip(self._locations, self.parameters, self._values(point)):
+            setattr(getattr(model, kind)[index], param.attribute, float(value))
+        return model
+
+    def _search(self, goal: float, start: np.ndarray):
+        """Returns the point closest to the initial values whose surrogate time matches the goal"""
+        def objective(point):
+            if self._cancelled:
+                raise _Cancelled()
+            time = surrogate_time(self.candidate(point))
+            miss = np.log(time / goal) if np.isfinite(time) else 10.
+            return miss**2 + 1e-3 * np.sum((point - self._initial)**2)
+        # the simulated time only has to hit the goal within the tolerance, finer searches waste surrogate solves
+        xtol = min(1e-2, self.tolerance / 5)
+        result = minimize(objective, start, method='Powell', bounds=[(0, 1)] * len(start),
+            options={'maxfev': self.surrogate_budget, 'xtol': xtol, 'ftol': xtol**2})
+        return np.clip(result.x, 0, 1)
+
+    def cancel(self):
+        """Stops a running optimization, e.g. from another thread, at its next surrogate evaluation"""
+        self._cancelled = True
+
+    def optimize(self, progress: Callable = None) -> dict:
+        """Searches parameter values and returns the tuned model with its simulated time
+        The progress callback is called with the number of simulations done and the simulation budget after
+        every batch.
+        """
+        seeds = [self.seed] * self.batch_size
+        workers = self.processes or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        best = {'error': np.inf}
+        corrections = [1.]
+        evaluations = 0
+        point = self._initial
+        try:
+            while evaluations < self.budget:
+                correction = np.median(corrections)
+                spread = np.linspace(-self.tolerance, self.tolerance, self.batch_size) if self.batch_size > 1 else [0.]
+                goals = [self.goal * correction * (1 + delta) for delta in spread][:self.budget - evaluations]
+                points = [self._search(goal, point) for goal in goals]
+                models = [self.candidate(pt) for pt in points]
+                mapper = executor.map if executor is not None else map
+                times = list(mapper(simulated_time, models, [self.replicas] * len(models), seeds[:len(models)]))
+                evaluations += len(models)
+                if progress is not None:
+                    progress(evaluations, self.budget)
+                for pt, model, goal, time in zip(points, models, goals, times):
+                    if not np.isfinite(time):
+                        continue
+                    corrections.append(goal / time)
+                    error = abs(time / self.goal - 1)
+                    if error < best['error'] - 1e-12:
+                        best = {'error': error, 'point': pt, 'model': model, 'time': time, 'goal': goal}
+                if best['error'] <= self.tolerance:
+                    break
+                point = best.get('point', point)
+        except _Cancelled:
+            return {'status': 3, 'message': 'Balancing cancelled.', 'evaluations': evaluations}
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if 'model' not in best:
+            return {'status': 1, 'message': 'No candidate reached the targets.', 'evaluations': evaluations}
+        return {
+            'status': 0 if best['error'] <= self.tolerance else 2,
+            'message': 'Goal reached.' if best['error'] <= self.tolerance else 'Budget exhausted before reaching the goal.',
+            'model': best['model'],
+            'parameters': {f"{param.key} {param.attribute}": self._value(best['model'], idx) for idx, param in enumerate(self.parameters)},
+            'time': best['time'],
+            'surrogate_time': surrogate_time(best['model']),
+            'error': best['error'],
+            'evaluations': evaluations
+        }
+
+    def apply(self, model: FlowModel, result: dict):
+        """Copies the tuned parameter values of a result into a model"""
+        for idx, param in enumerate(self.parameters):
+            param.set(model, self._value(result['model'], idx))
@@ -0,0 +1,115 @@
+"""GMC Player Cohort Simulator"""
+
+from __future__ import annotations
+
+from typing import Callable
+import numpy as np
+
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+
+
+class CohortSimulator():
+    """Cohort Simulator Class
+
+    Simulates a population of players at once. Every player is a row of the storage matrix and follows the
+    optimal source rates of the model, slowed down by individual time scales (play frequency). Players only use
+    the sources enabled in their spend profile. Only the current state is kept, statistics over all players
+    are computed on demand.
+
+    Time scales and spend profiles are given per player either as a single array for all sources or as a
+    dictionary from source name or id to an array.
+    """
+
+    def __init__(self, model: FlowModel, players: int, time_scale=None, spend=None, seed: int = None):
+        simulator = Simulator(model, reduce=True)
+        self.status = simulator.status
+        self.step_num = 0
+        self.players = players
+        self._model = simulator.model()
+        self._rng = np.random.default_rng(seed)
+        sources, currencies = self._model.sources, self._model.currencies
+        self.currency_ids = [currency.id for currency in currencies]
+        self.currency_names = [currency.name for currency in currencies]
+        self._target_idx = np.array([idx for idx, currency in enumerate(currencies) if currency.target_value > 0], dtype=int)
+        self._targets = np.array([currencies[idx].target_value for idx in self._target_idx], dtype=float)
+
+        cid_lookup = {currency.id: idx for idx, currency in enumerate(currencies)}
+        inputs = [(sid, cid_lookup[conn.source.id], conn.rate) for sid, source in enumerate(sources) for conn in source.inputs]
+        outputs = [(sid, cid_lookup[conn.target.id], conn.rate, conn.chance) for sid, source in enumerate(sources)
+            for conn in source.connections]
+        self._inp_source = np.array([inp[0] for inp in inputs], dtype=int)
+        self._inp_currency = np.array([inp[1] for inp in inputs], dtype=int)
+        self._inp_rate = np.array([inp[2] for inp in inputs], dtype=float)
+        self._inp_indicator = np.zeros((len(inputs), len(sources)))
+        self._inp_indicator[np.arange(len(inputs)), self._inp_source] = 1.
+        self._consumption = np.zeros((len(sources), len(currencies)))
+        np.add.at(self._consumption, (self._inp_source, self._inp_currency), self._inp_rate)
+        self._out_source = np.array([out[0] for out in outputs], dtype=int)
+        self._out_rate = np.array([out[2] for out in outputs], dtype=float)
+        self._out_chance = np.array([out[3] for out in outputs], dtype=float)
+        self._out_indicator = np.zeros((len(outputs), len(currencies)))
+        self._out_indicator[np.arange(len(outputs)), [out[1] for out in outputs]] = 1.
+
+        base_time = np.array([prop['opt_time'] for prop in simulator.source_properties().values()], dtype=float)
+        self._opt_time = np.tile(base_time, (players, 1)) * self._per_source(time_scale, 1.)
+        self._enabled = self._per_source(spend, True).astype(bool)
+        self._steps = np.zeros((players, len(sources)))
+        self._storage = np.zeros((players, len(currencies)))
+        self._reached = np.full(players, -1, dtype=np.int64)
+
+    def _per_source(self, values, default):
+        """Broadcasts per player values to a players x sources matrix"""
+        matrix = np.full((self.players, len(self._model.sources)), default, dtype=float)
+        if values is None:
+            return matrix
+        if not isinstance(values, dict):
+            matrix[:] = np.asarray(values, dtype=float).reshape((self.players, -1))
+            return matrix
+        for sid, source in enumerate(self._model.sources):
+            for key in (source.id, source.name):
+                if key in values:
+                    matrix[:, sid] = values[key]
+        return matrix
+
+    def step(self):
+        """Performs one simulation time step for all players"""
+        self.step_num += 1
+        waiting = self._steps < 0
+        blocked = (self._storage[:, self._inp_currency] < self._inp_rate) @ self._inp_indicator > 0
+        fired = (~waiting & ~blocked & self._enabled).astype(float)
+        self._steps += 1 - fired * self._opt_time
+        produced = fired[:, self._out_source] * self._out_rate
+        if np.any(self._out_chance < 1):
+            produced *= self._rng.random(produced.shape) < self._out_chance
+        self._storage += produced @ self._out_indicator - fired @ self._consumption
+        done = (self._reached < 0) & np.all(self._storage[:, self._target_idx] >= self._targets, axis=1)
+        self._reached[done] = self.step_num
+
+    def run(self, max_steps: int, callback: Callable = None):
+        """Performs time steps until all players reached the targets or max_steps is reached
+        The callback is called with the cohort simulator after every time step.
+        """
+        while self.status == 0 and self.step_num < max_steps and np.any(self._reached < 0):
+            self.step()
+            if callback is not None:
+                callback(self)
+
+    def aggregates(self, quantiles=(0.1, 0.5, 0.9)):
+        """Returns mean and quantiles of the currency storage over all players and the fraction of players
+        that reached all targets
+        """
+        return {
+            'step': self.step_num,
+            'mean': self._storage.mean(axis=0),
+            'quantiles': np.quantile(self._storage, quantiles, axis=0),
+            'reached': np.mean(self._reached >= 0)
+        }
+
+    def time_to_target(self, quantiles=(0.1, 0.5, 0.9)):
+        """Returns the fraction of players that reached the targets and quantiles of their time to target"""
+        reached = self._reached[self._reached >= 0]
+        return {
+            'reached': len(reached) / self.players,
+            'quantiles': np.quantile(reached, quantiles) if len(reached) > 0 else np.full(len(quantiles), np.nan)
+        }
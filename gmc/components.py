@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
+import bisect
 import uuid
 import math
-from typing import List
+from typing import Dict, List
 
 
 class Position():
@@ -68,13 +69,55 @@ class Component():
         return {'_id': self.id, 'name': self.name, 'pos': (self.pos.x, self.pos.y)}
 
 
-class Connection():
+class Scheduled():
+    """GMC Scheduled Parameters Class
+
+    Piecewise constant schedules of numeric attributes, e.g. for limited banners or double drop weekends. A
+    schedule is a list of [start step, value] segments; a value holds from its start step until the next
+    segment starts, before the first segment the attribute itself holds.
+    """
+
+    SCHEDULABLE = ()
+
+    def __init__(self):
+        self.schedules: Dict[str, List[List[float]]] = {}
+
+    def set_schedule(self, attribute: str, segments: List[List[float]]):
+        """Sets the schedule of an attribute, an empty list removes it"""
+        if attribute not in self.SCHEDULABLE:
+            raise ValueError(f"Attribute '{attribute}' cannot be scheduled!")
+        segments = sorted([float(start), float(value)] for start, value in segments)
+        if any(start < 0 for start, _ in segments) or len({start for start, _ in segments}) < len(segments):
+            raise ValueError(f"Invalid schedule for '{attribute}'!")
+        if segments:
+            self.schedules[attribute] = segments
+        else:
+            self.schedules.pop(attribute, None)
+
+    def value_at(self, attribute: str, step: float, default: float = None) -> float:
+        """Returns the scheduled value of an attribute after the given number of steps"""
+        segments = self.schedules.get(attribute, [])
+        pos = bisect.bisect_right([start for start, _ in segments], step)
+        if pos == 0:
+            return getattr(self, attribute) if default is None else default
+        return segments[pos-1][1]
+
+    def schedules_dict(self) -> dict:
+        """Returns a copy of the schedules"""
+        return {attribute: [list(segment) for segment in segments] for attribute, segments in self.schedules.items()}
+
+
+class Connection(Scheduled):
     """GMC Connection Class"""
 
-    def __init__(self, source: Component, target: Component, rate: float = 1):
+    SCHEDULABLE = ('rate', 'chance')
+
+    def __init__(self, source: Component, target: Component, rate: float = 1, chance: float = 1):
+        super().__init__()
         self.source: Component = source
         self.target: Component = target
         self.rate: float = rate
+        self.chance: float = chance
         source.add_connection(self)
         target.add_input(self)
 
@@ -82,10 +125,17 @@ class Connection():
         """Returns length of the connection"""
         return self.source.pos.distance(self.target.pos)
 
+    def mean_rate(self):
+        """Returns the expected amount transferred when the source fires"""
+        return self.rate * self.chance
+
     # pylint: disable=protected-access
     def to_dict(self):
         """Converts the connection into a dictionary"""
-        return {'source': self.source.id, 'target': self.target.id, 'rate': self.rate}
+        dictionary = {'source': self.source.id, 'target': self.target.id, 'rate': self.rate, 'chance': self.chance}
+        if self.schedules:
+            dictionary['schedules'] = self.schedules_dict()
+        return dictionary
 
 
 class Currency(Component):
@@ -104,13 +154,15 @@ class Currency(Component):
         return dictionary
 
 
-class Source(Component):
+class Source(Component, Scheduled):
     """GMC Source Class"""
 
     SIZE = 0.36
+    SCHEDULABLE = ('time_step',)
 
     def __init__(self, name: str, position: Position = None, time_step: float = 1):
-        super().__init__(name, position)
+        Component.__init__(self, name, position)
+        Scheduled.__init__(self)
         self.time_step: float = time_step
         if name == "":
             raise ValueError('Source name cannot be empty!')
@@ -119,4 +171,27 @@ class Source(Component):
         """Converts the source into a dictionary"""
         dictionary = super().to_dict()
         dictionary['time_step'] = self.time_step
+        if self.schedules:
+            dictionary['schedules'] = self.schedules_dict()
         return dictionary
+
+
+class Group():
+    """GMC Group Class
+
+    A named set of components, e.g. a repeated upgrade tree. A collapsed group is drawn as a single node.
+    """
+
+    SIZE = 0.5
+
+    def __init__(self, name: str, members: List[str], collapsed: bool = True):
+        self.id = uuid.uuid4().hex  # pylint: disable=invalid-name
+        self.name: str = name
+        self.members: List[str] = list(members)
+        self.collapsed: bool = collapsed
+        if name == "":
+            raise ValueError('Group name cannot be empty!')
+
+    def to_dict(self):
+        """Converts the group into a dictionary"""
+        return {'_id': self.id, 'name': self.name, 'members': list(self.members), 'collapsed': self.collapsed}
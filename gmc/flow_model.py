@@ -2,32 +2,82 @@
 
 from __future__ import annotations
 
+import time
 from typing import List, Callable
 import yaml
 
-from gmc.components import Position, Component, Connection, Currency, Source
+from gmc.components import Position, Component, Connection, Currency, Group, Source
+from gmc.history import (AddComponents, AddGroup, AddStage, Command, CommandLog, DeleteComponent, DeleteConnection,
+    DeleteGroup, MoveComponents, SetValue)
 
 
 class FlowModel():
-    """Flow Model Class"""
+    """Flow Model Class
+
+    Edits through the methods of the model are recorded in a bounded command log and can be undone. With a
+    change journal attached every applied, undone or redone edit is also appended to the journal.
+    """
 
     def __init__(self):
         self.__callbacks: List[Callable] = []
+        self.__timing_callbacks: List[Callable] = []
         self.currencies: List[Currency] = []
         self.sources: List[Source] = []
         self.connections: List[Connection] = []
+        self.stages: List[dict] = []
+        self.groups: List[Group] = []
+        self.layout_cache: dict = {}
+        self.aggregate_cache: dict = {}
+        self.history: CommandLog = CommandLog()
+        self.journal = None
 
-    def add_currency(self, currency: Currency):
-        """Add a currency to the flow model"""
-        self.currencies.append(currency)
+    def _execute(self, command: Command, notify: bool = True):
+        """Applies and records an edit"""
+        command.apply(self)
+        self.history.record(command)
+        if self.journal is not None:
+            self.journal.append(command.records())
+        if notify:
+            self.notify()
+
+    def undo(self) -> bool:
+        """Reverts the last recorded edit"""
+        command = self.history.undo(self)
+        if command is None:
+            return False
+        if self.journal is not None:
+            self.journal.append(command.records(inverse=True))
+        self.notify()
+        return True
+
+    def redo(self) -> bool:
+        """Applies the last undone edit again"""
+        command = self.history.redo(self)
+        if command is None:
+            return False
+        if self.journal is not None:
+            self.journal.append(command.records())
+        self.notify()
+        return True
+
+    def notify(self):
+        """Calls the change callbacks, e.g. after the component lists were changed directly
+        Timing callbacks are called afterwards with the number of change callbacks and their total duration.
+        """
+        start = time.perf_counter()
         for callback in self.__callbacks:
             callback(self)
+        elapsed = time.perf_counter() - start
+        for callback in self.__timing_callbacks:
+            callback(len(self.__callbacks), elapsed)
+
+    def add_currency(self, currency: Currency):
+        """Add a currency to the flow model"""
+        self._execute(AddComponents([currency], [], []))
 
     def add_source(self, source: Source):
         """Adds a source to the flow model"""
-        self.sources.append(source)
-        for callback in self.__callbacks:
-            callback(self)
+        self._execute(AddComponents([], [source], []))
 
     def add_edge(self, source: Component, target: Component):
         """Adds a default connection to the flow model"""
@@ -35,16 +85,47 @@ class FlowModel():
             return
         if isinstance(source, Currency) and isinstance(target, Currency):
             return
-        connection = Connection(source, target)
-        self.connections.append(connection)
-        for callback in self.__callbacks:
-            callback(self)
+        self._execute(AddComponents([], [], [Connection(source, target)]))
 
     def add_connection(self, connection: Connection):
         """Adds a connection to the flow model"""
-        self.connections.append(connection)
-        for callback in self.__callbacks:
-            callback(self)
+        self._execute(AddComponents([], [], [connection]))
+
+    def add_components(self, currencies: List[Currency], sources: List[Source], connections: List[Connection]):
+        """Adds many components and connections to the flow model with a single change notification"""
+        self._execute(AddComponents(currencies, sources, connections))
+
+    def add_stage(self, targets: dict, name: str = None):
+        """Appends a target stage that has to be reached after the currency target values
+        Targets map currency ids to the storage required at the end of the stage.
+        """
+        self._execute(AddStage({'name': name if name is not None else f"Stage {len(self.stages)+2}", 'targets': dict(targets)}))
+
+    def add_group(self, name: str, components: List[Component], collapsed: bool = True) -> Group:
+        """Groups components under a name, e.g. a repeated upgrade tree, and returns the group"""
+        group = Group(name, [comp.id for comp in components], collapsed)
+        self._execute(AddGroup(group))
+        return group
+
+    def delete_group(self, group: Group):
+        """Removes a group, its components stay in the model"""
+        self._execute(DeleteGroup(group))
+
+    def group_members(self, group: Group) -> List[Component]:
+        """Returns the components of a group that are still part of the model"""
+        lookup = {comp.id: comp for comp in self.get_components()}
+        return [lookup[key] for key in group.members if key in lookup]
+
+    def stage_targets(self) -> List[dict]:
+        """Returns the target values of all stages by currency id, starting with the currency target values"""
+        first = {currency.id: currency.target_value for currency in self.currencies}
+        return [first] + [{currency.id: stage['targets'].get(currency.id, 0) for currency in self.currencies}
+            for stage in self.stages]
+
+    def schedule_breaks(self) -> List[float]:
+        """Returns the sorted steps after which a scheduled parameter changes"""
+        return sorted({start for comp in self.sources + self.connections for segments in comp.schedules.values()
+            for start, _ in segments if start > 0})
 
     def get_components(self) -> List[Component]:
         """Returns list of all components"""
@@ -55,109 +136,184 @@ class FlowModel():
         return len(self.get_components())
 
     def move_component_position(self, component: Component, dpos: Position):
-        """Sets new position for flow model component"""
-        component.pos.translate(dpos)
-        for callback in self.__callbacks:
-            callback(self)
+        """Sets new position for flow model component, or for all components of a group"""
+        components = self.group_members(component) if isinstance(component, Group) else [component]
+        new = {comp: Position(*comp.pos.coords()) for comp in components}
+        for pos in new.values():
+            pos.translate(dpos)
+        self._execute(MoveComponents({comp: comp.pos for comp in components}, new, mergeable=True))
+
+    def set_value(self, obj, attribute: str, value):
+        """Changes an attribute of a component or connection, e.g. a rate, time step or target value"""
+        if getattr(obj, attribute) == value:
+            return
+        self._execute(SetValue(obj, attribute, value))
 
     def delete_component(self, component: Component):
         """Deletes a component from the flow model"""
-        for connection in component.inputs[:]:
-            self.delete_connection(connection, notify=False)
-        for connection in component.connections[:]:
-            self.delete_connection(connection, notify=False)
-        if isinstance(component, Source):
-            self.sources.remove(component)
-        elif isinstance(component, Currency):
-            self.currencies.remove(component)
-        for callback in self.__callbacks:
-            callback(self)
+        self._execute(DeleteComponent(component))
 
     def delete_connection(self, connection: Connection, notify: bool = True):
         """Deletes a component from the flow model"""
-        connection.source.delete_connection(connection)
-        connection.target.delete_connection(connection)
-        self.connections.remove(connection)
-        if notify:
-            for callback in self.__callbacks:
-                callback(self)
+        self._execute(DeleteConnection(connection), notify)
 
     def layout(self):
         """Return node layout as dictionary"""
         return {comp.id: comp.pos.coords() for comp in self.get_components()}
 
+    def set_layout(self, layout: dict):
+        """Moves components to the positions of a node layout dictionary"""
+        moved = [comp for comp in self.get_components() if comp.id in layout]
+        self._execute(MoveComponents({comp: comp.pos for comp in moved}, {comp: Position(*layout[comp.id]) for comp in moved}))
+
+    def structure_key(self) -> int:
+        """Returns a hash of the components and connections of the model"""
+        return hash((tuple(comp.id for comp in self.get_components()),
+            tuple((conn.source.id, conn.target.id) for conn in self.connections)))
+
     def avg_connection_length(self):
         """Return average node distance"""
+        if len(self.connections) == 0:
+            return 0.
         return sum(conn.length() for conn in self.connections) / len(self.connections)
 
     def normalize_positions(self):
         """Shift component positions such that the first component has position (0,0)"""
-        dpos = self.get_components()[0].pos
-        for component in reversed(self.get_components()):
-            self.move_component_position(component, -dpos)
+        dpos = -self.get_components()[0].pos
+        new = {comp: Position(*comp.pos.coords()) for comp in self.get_components()}
+        for pos in new.values():
+            pos.translate(dpos)
+        self._execute(MoveComponents({comp: comp.pos for comp in new}, new))
 
     def connect(self, callback: Callable):
         """Add a callback for model changes"""
         self.__callbacks.append(callback)
 
+    def connect_timing(self, callback: Callable):
+        """Add a callback for the duration of the change notifications"""
+        self.__timing_callbacks.append(callback)
+
+    def disconnect_timing(self, callback: Callable):
+        """Remove a callback for the duration of the change notifications"""
+        self.__timing_callbacks.remove(callback)
+
     def copy(self):
         """Return copy of this flow model"""
+        return self.submodel(self.get_components())
+
+    def submodel(self, components: List[Component]):
+        """Return copy of the given components and the connections between them
+        Component ids are kept such that results can be mapped back onto this model.
+        """
         other = FlowModel()
-        for source in self.sources:
-            other_source = Source(source.name, source.pos, time_step=source.time_step)
-            other.add_source(other_source)
-        for currency in self.currencies:
-            other_currency = Currency(currency.name, currency.pos, target_value=currency.target_value)
-            other.add_currency(other_currency)
+        lookup = {}
+        for component in components:
+            if isinstance(component, Source):
+                other_component = Source(component.name, Position(*component.pos.coords()), time_step=component.time_step)
+                other_component.schedules = component.schedules_dict()
+                other.sources.append(other_component)
+            else:
+                other_component = Currency(component.name, Position(*component.pos.coords()), target_value=component.target_value)
+                other.currencies.append(other_component)
+            other_component.id = component.id
+            lookup[component.id] = other_component
         for connection in self.connections:
-            sid = self.get_components().index(connection.source)
-            tid = self.get_components().index(connection.target)
-            other_connection = Connection(other.get_components()[sid], other.get_components()[tid], rate=connection.rate)
-            other.add_connection(other_connection)
+            if connection.source.id in lookup and connection.target.id in lookup:
+                other_connection = Connection(lookup[connection.source.id], lookup[connection.target.id],
+                    rate=connection.rate, chance=connection.chance)
+                other_connection.schedules = connection.schedules_dict()
+                other.connections.append(other_connection)
+        other.stages = [{'name': stage['name'], 'targets': {key: value for key, value in stage['targets'].items() if key in lookup}}
+            for stage in self.stages]
+        for group in self.groups:
+            members = [key for key in group.members if key in lookup]
+            if members:
+                other_group = Group(group.name, members, group.collapsed)
+                other_group.id = group.id
+                other.groups.append(other_group)
         return other
 
-    def save_to_file(self, filename: str):
-        """Saves a flow model to a yaml file"""
-        model_dict = {
+    def to_dict(self):
+        """Converts the flow model into a dictionary"""
+        return {
             'currencies': [c.to_dict() for c in self.currencies],
             'sources': [s.to_dict() for s in self.sources],
-            'connections': [c.to_dict() for c in self.connections]
+            'connections': [c.to_dict() for c in self.connections],
+            'stages': [{'name': stage['name'], 'targets': dict(stage['targets'])} for stage in self.stages],
+            'groups': [group.to_dict() for group in self.groups]
         }
+
+    def save_to_file(self, filename: str):
+        """Saves a flow model to a yaml file"""
         with open(filename, 'w', encoding = 'utf-8') as file:
-            yaml.dump(model_dict, file)
+            yaml.dump(self.to_dict(), file)
 
     def load_from_file(self, filename: str):
         """Loads the flow model from a yaml file"""
         model_dict = {}
         with open(filename, 'r', encoding = 'utf-8') as file:
             model_dict = yaml.load(file, yaml.FullLoader)
+        self.load_from_dict(model_dict)
+
+    @staticmethod
+    def currency_from_dict(data: dict) -> Currency:
+        """Creates a currency from its dictionary"""
+        try:
+            currency = Currency(data['name'], Position(data['pos'][0], data['pos'][1]), target_value=data['target_value'])
+            currency.id = data['_id']
+            return currency
+        except (KeyError, IndexError) as exc:
+            raise RuntimeError('Error loading currency. Malformed yaml file.') from exc
+
+    @staticmethod
+    def source_from_dict(data: dict) -> Source:
+        """Creates a source from its dictionary"""
+        try:
+            source = Source(data['name'], Position(data['pos'][0], data['pos'][1]), time_step=data['time_step'])
+            source.id = data['_id']
+            for attribute, segments in data.get('schedules', {}).items():
+                source.set_schedule(attribute, segments)
+            return source
+        except (KeyError, IndexError, ValueError) as exc:
+            raise RuntimeError('Error loading source. Malformed yaml file.') from exc
+
+    @staticmethod
+    def connection_from_dict(data: dict, lookup: dict) -> Connection:
+        """Creates a connection from its dictionary and attaches it to the components in the id lookup"""
+        try:
+            connection = Connection(lookup[data['source']], lookup[data['target']], rate=data['rate'],
+                chance=data.get('chance', 1))
+            for attribute, segments in data.get('schedules', {}).items():
+                connection.set_schedule(attribute, segments)
+            return connection
+        except (KeyError, IndexError, ValueError) as exc:
+            raise RuntimeError('Error loading connection. Malformed yaml file.') from exc
+
+    @staticmethod
+    def group_from_dict(data: dict) -> Group:
+        """Creates a group from its dictionary"""
+        try:
+            group = Group(data['name'], data['members'], collapsed=data.get('collapsed', True))
+            group.id = data['_id']
+            return group
+        except (KeyError, TypeError, ValueError) as exc:
+            raise RuntimeError('Error loading group. Malformed yaml file.') from exc
+
+    def load_from_dict(self, model_dict: dict):
+        """Loads the flow model from a dictionary"""
         if 'currencies' in model_dict:
-            self.currencies = []
-            for data in model_dict['currencies']:
-                try:
-                    currency = Currency(data['name'], Position(data['pos'][0], data['pos'][1]), target_value=data['target_value'])
-                    currency.id = data['_id']
-                    self.add_currency(currency)
-                except (KeyError, IndexError) as exc:
-                    raise RuntimeError('Error loading currency. Malformed yaml file.') from exc
+            self.currencies = [self.currency_from_dict(data) for data in model_dict['currencies']]
         if 'sources' in model_dict:
-            self.sources = []
-            for data in model_dict['sources']:
-                try:
-                    source = Source(data['name'], Position(data['pos'][0], data['pos'][1]), time_step=data['time_step'])
-                    source.id = data['_id']
-                    self.add_source(source)
-                except (KeyError, IndexError) as exc:
-                    raise RuntimeError('Error loading source. Malformed yaml file.') from exc
+            self.sources = [self.source_from_dict(data) for data in model_dict['sources']]
         if 'connections' in model_dict:
-            self.connections = []
-            for data in model_dict['connections']:
-                try:
-                    source = next(s for s in self.get_components() if s.id == data['source'])
-                    target = next(t for t in self.get_components() if t.id == data['target'])
-                    connection = Connection(source, target, rate=data['rate'])
-                    self.add_connection(connection)
-                except (KeyError, IndexError) as exc:
-                    raise RuntimeError('Error loading connection. Malformed yaml file.') from exc
-        for callback in self.__callbacks:
-            callback(self)
+            lookup = {comp.id: comp for comp in self.get_components()}
+            self.connections = [self.connection_from_dict(data, lookup) for data in model_dict['connections']]
+        self.stages = []
+        for data in model_dict.get('stages', []):
+            try:
+                self.stages.append({'name': data['name'], 'targets': dict(data['targets'])})
+            except (KeyError, TypeError, ValueError) as exc:
+                raise RuntimeError('Error loading stage. Malformed yaml file.') from exc
+        self.groups = [self.group_from_dict(data) for data in model_dict.get('groups', [])]
+        self.history.clear()
+        self.notify()
@@ -0,0 +1,128 @@
+"""GMC Generalized Network Flow"""
+
+from __future__ import annotations
+
+import numpy as np
+import networkx as nx
+
+from gmc.flow_model import FlowModel
+
+
+class GeneralizedFlowSolver():
+    """Combinatorial max flow solver for models in which every source is a simple edge
+
+    A source is a simple edge if it has at most one input and at most one output connection. The solver
+    additionally requires the model to be acyclic and each currency to be produced either by a single source or
+    only by sources without inputs. Demands then propagate backwards from the targets in topological order,
+    which yields the same flows as the linear program without solving it. Production is assigned to the
+    producers with the highest output per firing first; if producers of a currency tie, the linear program has
+    several optimal flows and unique is unset, so callers that need the flows of the linear program solve it.
+    """
+
+    MESSAGE = 'Optimization terminated successfully. (Generalized network flow)'
+
+    def __init__(self, model: FlowModel):
+        self._model = model
+        self._order = None
+        self.supported = self._check_structure()
+        self.unique = self.supported and self._check_unique()
+
+    def _check_structure(self):
+        if any(len(source.inputs) > 1 or len(source.connections) > 1 for source in self._model.sources):
+            return False
+        if any(conn.mean_rate() <= 0 for conn in self._model.connections):
+            return False
+        for currency in self._model.currencies:
+            producers = [conn.source for conn in currency.inputs]
+            if len(producers) > 1 and any(len(producer.inputs) > 0 for producer in producers):
+                return False
+        graph = nx.DiGraph()
+        graph.add_nodes_from(comp.id for comp in self._model.get_components())
+        graph.add_edges_from((conn.source.id, conn.target.id) for conn in self._model.connections)
+        if not nx.is_directed_acyclic_graph(graph):
+            return False
+        self._order = list(nx.topological_sort(graph))
+        return True
+
+    def _check_unique(self):
+        """Returns whether the producers of every currency differ in their output per firing"""
+        for currency in self._model.currencies:
+            rates = sorted(conn.mean_rate() for conn in currency.inputs)
+            if any(np.isclose(low, high, rtol=1e-12, atol=0.) for low, high in zip(rates, rates[1:])):
+                return False
+        return True
+
+    def _demands(self):
+        """Returns currency demands and source flows per unit of drain rate"""
+        demand = {currency.id: currency.target_value for currency in self._model.currencies}
+        unit_flow = {source.id: 0. for source in self._model.sources}
+        sources = {source.id: source for source in self._model.sources}
+        for comp_id in reversed(self._order):
+            if comp_id not in sources:
+                continue
+            source = sources[comp_id]
+            if len(source.connections) == 0 or len(source.inputs) == 0:
+                continue
+            output = source.connections[0]
+            unit_flow[comp_id] = demand[output.target.id] / output.mean_rate()
+            demand[source.inputs[0].source.id] += source.inputs[0].rate * unit_flow[comp_id]
+        return demand, unit_flow
+
+    @staticmethod
+    def _capacity(source):
+        return 1./source.time_step if source.time_step > 0 else np.inf
+
+    def _allocate(self, currency, amount: float, flows: dict):
+        """Distributes the production of amount units of currency onto its producers"""
+        remaining = amount
+        for conn in sorted(currency.inputs, key=lambda conn: -conn.mean_rate()):
+            flow = min(remaining / conn.mean_rate(), self._capacity(conn.source)) if remaining > 1e-12 * amount else 0.
+            flows[conn.source.id] = flow
+            remaining -= flow * conn.mean_rate()
+        return remaining <= 1e-9 * max(amount, 1.)
+
+    def max_throughput(self):
+        """Returns the maximum drain rate"""
+        demand, unit_flow = self._demands()
+        throughput = 1.
+        for currency in self._model.currencies:
+            if demand[currency.id] <= 0:
+                continue
+            if len(currency.inputs) == 0:
+                return 0.
+            if len(currency.inputs) > 1 or len(currency.inputs[0].source.inputs) == 0:
+                supply = sum(conn.mean_rate() * self._capacity(conn.source) for conn in currency.inputs)
+                throughput = min(throughput, supply / demand[currency.id])
+        for source in self._model.sources:
+            if unit_flow[source.id] > 0:
+                throughput = min(throughput, self._capacity(source) / unit_flow[source.id])
+        return throughput
+
+    def solve(self, throughput: float = None):
+        """Returns flow info in the same format as the linear programming solver"""
+        if throughput is None:
+            throughput = self.max_throughput()
+        demand, unit_flow = self._demands()
+        flows = {source_id: flow * throughput for source_id, flow in unit_flow.items()}
+        feasible = all(flows[source.id] <= self._capacity(source) * (1 + 1e-9) for source in self._model.sources)
+        for currency in self._model.currencies:
+            if len(currency.inputs) > 1 or (len(currency.inputs) == 1 and len(currency.inputs[0].source.inputs) == 0):
+                feasible = self._allocate(currency, demand[currency.id] * throughput, flows) and feasible
+            elif len(currency.inputs) == 0 and demand[currency.id] * throughput > 0:
+                feasible = False
+        if not feasible:
+            return {'status': 2, 'message': 'The problem is infeasible. (Generalized network flow)'}
+        source_flows = np.array([flows[source.id] for source in self._model.sources])
+        balance = {currency.id: -currency.target_value * throughput for currency in self._model.currencies}
+        for source in self._model.sources:
+            for conn in source.inputs:
+                balance[conn.source.id] -= conn.rate * flows[source.id]
+            for conn in source.connections:
+                balance[conn.target.id] += conn.mean_rate() * flows[source.id]
+        return {
+            'status': 0,
+            'message': self.MESSAGE,
+            'steps': 1. / throughput if throughput > 0 else 0.,
+            's': source_flows,
+            'c': np.array([balance[currency.id] for currency in self._model.currencies])
+        }
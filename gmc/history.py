@@ -0,0 +1,409 @@
+"""GMC Edit History
+
+Flow model edits are recorded as small invertible commands instead of model snapshots, so undo and redo cost
+as much as the change itself.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+from typing import List
+
+from gmc.components import Component, Connection, Currency, Group, Position, Source
+
+
+def _attach(connection: Connection, positions: tuple = None):
+    """Adds a connection to the input and output lists of its components, at the given positions if known"""
+    out_pos, inp_pos = positions if positions is not None else (len(connection.source.connections), len(connection.target.inputs))
+    connection.source.connections.insert(out_pos, connection)
+    connection.target.inputs.insert(inp_pos, connection)
+
+
+def _key(obj) -> object:
+    """Returns the id of a component, or the source and target ids of a connection and its index among the
+    parallel connections between them
+    """
+    if isinstance(obj, Connection):
+        return _connection_keys([obj])[0]
+    return obj.id
+
+
+def _connection_keys(connections: List[Connection]) -> List[list]:
+    """Returns the keys of many connections, scanning the outputs of every source once"""
+    index = {}
+    for source in {conn.source for conn in connections}:
+        counts = {}
+        for conn in source.connections:
+            index[conn] = counts.get(conn.target, 0)
+            counts[conn.target] = index[conn] + 1
+    return [[conn.source.id, conn.target.id, index[conn]] for conn in connections]
+
+
+def _remove_connections(model, connections: List[Connection]):
+    """Detaches many connections and removes them from the model in one pass over the affected lists"""
+    removed = set(connections)
+    for comp in {conn.source for conn in connections} | {conn.target for conn in connections}:
+        comp.connections[:] = [conn for conn in comp.connections if conn not in removed]
+        comp.inputs[:] = [conn for conn in comp.inputs if conn not in removed]
+    model.connections[:] = [conn for conn in model.connections if conn not in removed]
+
+
+def _detach(connection: Connection) -> tuple:
+    """Removes a connection from its components and returns its positions in their lists"""
+    positions = (connection.source.connections.index(connection), connection.target.inputs.index(connection))
+    connection.source.delete_connection(connection)
+    connection.target.delete_connection(connection)
+    return positions
+
+
+class Command():
+    """Command Class
+
+    An invertible flow model edit. Commands change the model lists directly and do not notify the callbacks.
+    """
+
+    def apply(self, model):
+        """Performs the edit"""
+        raise NotImplementedError
+
+    def revert(self, model):
+        """Undoes the edit"""
+        raise NotImplementedError
+
+    def merge(self, other: Command) -> bool:  # pylint: disable=unused-argument
+        """Absorbs a following command into this one if both form a single edit"""
+        return False
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        """Returns json serializable records of the applied edit, or of its inverse, for the change journal"""
+        raise NotImplementedError
+
+
+class AddComponents(Command):
+    """Add Components Command Class
+
+    New connections are attached to their components on creation, so only a reverted command attaches them again.
+    """
+
+    def __init__(self, currencies: List[Currency], sources: List[Source], connections: List[Connection]):
+        self.currencies = list(currencies)
+        self.sources = list(sources)
+        self.connections = list(connections)
+        self.keys = []
+        self.detached = False
+
+    def apply(self, model):
+        model.currencies.extend(self.currencies)
+        model.sources.extend(self.sources)
+        if self.detached:
+            for connection in self.connections:
+                _attach(connection)
+            self.detached = False
+        model.connections.extend(self.connections)
+
+    def revert(self, model):
+        self.keys = _connection_keys(self.connections)
+        self.detached = True
+        _remove_connections(model, self.connections)
+        sources, currencies = set(self.sources), set(self.currencies)
+        model.sources[:] = [source for source in model.sources if source not in sources]
+        model.currencies[:] = [currency for currency in model.currencies if currency not in currencies]
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        if inverse:
+            return [{'op': 'remove', 'connections': self.keys,
+                     'sources': [_key(source) for source in self.sources],
+                     'currencies': [_key(currency) for currency in self.currencies]}]
+        return [{'op': 'add', 'currencies': [currency.to_dict() for currency in self.currencies],
+                 'sources': [source.to_dict() for source in self.sources],
+                 'connections': [conn.to_dict() for conn in self.connections]}]
+
+
+class DeleteConnection(Command):
+    """Delete Connection Command Class"""
+
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self.key = None
+        self.index = None
+        self.positions = None
+
+    def apply(self, model):
+        self.key = _key(self.connection)
+        self.index = model.connections.index(self.connection)
+        self.positions = _detach(self.connection)
+        model.connections.pop(self.index)
+
+    def revert(self, model):
+        _attach(self.connection, self.positions)
+        model.connections.insert(self.index, self.connection)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        if inverse:
+            return [{'op': 'add', 'connections': [self.connection.to_dict()], 'placement': [[self.index, *self.positions]]}]
+        return [{'op': 'remove', 'connections': [self.key]}]
+
+
+class DeleteComponent(Command):
+    """Delete Component Command Class"""
+
+    def __init__(self, component: Component):
+        self.component = component
+        self.connections = [DeleteConnection(conn) for conn in component.inputs + component.connections]
+        self.keys = []
+        self.index = None
+        self.targets = {}
+
+    def apply(self, model):
+        self.keys = _connection_keys([command.connection for command in self.connections])
+        for command in self.connections:
+            command.apply(model)
+        components = model.sources if isinstance(self.component, Source) else model.currencies
+        self.index = components.index(self.component)
+        components.pop(self.index)
+        if isinstance(self.component, Currency):
+            self.targets = {idx: stage['targets'].pop(self.component.id) for idx, stage in enumerate(model.stages)
+                if self.component.id in stage['targets']}
+
+    def revert(self, model):
+        components = model.sources if isinstance(self.component, Source) else model.currencies
+        components.insert(self.index, self.component)
+        for idx, value in self.targets.items():
+            model.stages[idx]['targets'][self.component.id] = value
+        for command in reversed(self.connections):
+            command.revert(model)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        kind = 'sources' if isinstance(self.component, Source) else 'currencies'
+        if inverse:
+            commands = list(reversed(self.connections))
+            return [{'op': 'add', kind: [self.component.to_dict()], 'index': self.index,
+                     'connections': [command.connection.to_dict() for command in commands],
+                     'placement': [[command.index, *command.positions] for command in commands],
+                     'stage_targets': [[idx, self.component.id, value] for idx, value in self.targets.items()]}]
+        return [{'op': 'remove', 'connections': self.keys,
+                 kind: [self.component.id]}]
+
+
+class MoveComponents(Command):
+    """Move Components Command Class
+
+    Consecutive mergeable moves of the same components, e.g. the steps of a drag, merge into one command.
+    """
+
+    def __init__(self, old: dict, new: dict, mergeable: bool = False):
+        self.old = {comp: Position(*pos.coords()) for comp, pos in old.items()}
+        self.new = {comp: Position(*pos.coords()) for comp, pos in new.items()}
+        self.mergeable = mergeable
+
+    def apply(self, model):
+        for comp, pos in self.new.items():
+            comp.pos = Position(*pos.coords())
+
+    def revert(self, model):
+        for comp, pos in self.old.items():
+            comp.pos = Position(*pos.coords())
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        positions = self.old if inverse else self.new
+        return [{'op': 'move', 'positions': {comp.id: list(pos.coords()) for comp, pos in positions.items()}}]
+
+    def merge(self, other: Command) -> bool:
+        if not (isinstance(other, MoveComponents) and self.mergeable and other.mergeable and other.new.keys() == self.new.keys()):
+            return False
+        self.new = other.new
+        return True
+
+
+class SetValue(Command):
+    """Set Value Command Class
+
+    Changes an attribute of a component or connection. Consecutive changes of the same attribute merge.
+    """
+
+    def __init__(self, obj, attribute: str, value):
+        self.obj = obj
+        self.attribute = attribute
+        self.old = getattr(obj, attribute)
+        self.new = value
+
+    def apply(self, model):
+        setattr(self.obj, self.attribute, self.new)
+
+    def revert(self, model):
+        setattr(self.obj, self.attribute, self.old)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        return [{'op': 'set', 'key': _key(self.obj), 'attribute': self.attribute,
+                 'value': self.old if inverse else self.new}]
+
+    def merge(self, other: Command) -> bool:
+        if not isinstance(other, SetValue) or other.obj is not self.obj or other.attribute != self.attribute:
+            return False
+        self.new = other.new
+        return True
+
+
+class AddStage(Command):
+    """Add Stage Command Class"""
+
+    def __init__(self, stage: dict, index: int = None):
+        self.stage = stage
+        self.index = index
+
+    def apply(self, model):
+        if self.index is None:
+            self.index = len(model.stages)
+        model.stages.insert(self.index, self.stage)
+
+    def revert(self, model):
+        model.stages.pop(self.index)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        if inverse:
+            return [{'op': 'remove_stage', 'index': self.index}]
+        return [{'op': 'add_stage', 'index': self.index, 'stage': {'name': self.stage['name'], 'targets': dict(self.stage['targets'])}}]
+
+
+class AddGroup(Command):
+    """Add Group Command Class"""
+
+    def __init__(self, group: Group, index: int = None):
+        self.group = group
+        self.index = index
+
+    def apply(self, model):
+        if self.index is None:
+            self.index = len(model.groups)
+        model.groups.insert(self.index, self.group)
+
+    def revert(self, model):
+        model.groups.pop(self.index)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        if inverse:
+            return [{'op': 'remove_group', 'key': self.group.id}]
+        return [{'op': 'add_group', 'index': self.index, 'group': self.group.to_dict()}]
+
+
+class DeleteGroup(Command):
+    """Delete Group Command Class"""
+
+    def __init__(self, group: Group):
+        self.group = group
+        self.index = None
+
+    def apply(self, model):
+        self.index = model.groups.index(self.group)
+        model.groups.pop(self.index)
+
+    def revert(self, model):
+        model.groups.insert(self.index, self.group)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        if inverse:
+            return [{'op': 'add_group', 'index': self.index, 'group': self.group.to_dict()}]
+        return [{'op': 'remove_group', 'key': self.group.id}]
+
+
+class CommandGroup(Command):
+    """Command Group Class"""
+
+    def __init__(self):
+        self.commands: List[Command] = []
+
+    def apply(self, model):
+        for command in self.commands:
+            command.apply(model)
+
+    def revert(self, model):
+        for command in reversed(self.commands):
+            command.revert(model)
+
+    def records(self, inverse: bool = False) -> List[dict]:
+        commands = reversed(self.commands) if inverse else self.commands
+        return [record for command in commands for record in command.records(inverse)]
+
+
+class CommandLog():
+    """Command Log Class
+
+    Bounded undo and redo stacks of commands. Recording a command clears the redo stack; a recorded command
+    merges into the previous one unless the log was sealed in between, e.g. when a new drag starts.
+    """
+
+    def __init__(self, limit: int = 1000):
+        self.limit = limit
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+        self._group = None
+        self._sealed = True
+
+    def record(self, command: Command):
+        """Adds an applied command to the log"""
+        if self._group is not None:
+            self._group.commands.append(command)
+            return
+        self._redo.clear()
+        if not self._sealed and len(self._undo) > 0 and self._undo[-1].merge(command):
+            return
+        self._undo.append(command)
+        self._sealed = False
+
+    def seal(self):
+        """Prevents the next command from merging into the last one"""
+        self._sealed = True
+
+    @contextmanager
+    def group(self):
+        """Records all commands within the context as a single entry"""
+        if self._group is not None:
+            yield
+            return
+        self._group = CommandGroup()
+        try:
+            yield
+        finally:
+            group, self._group = self._group, None
+            if group.commands:
+                self.seal()
+                self.record(group)
+                self.seal()
+
+    def can_undo(self) -> bool:
+        """Returns whether there is a command to undo"""
+        return len(self._undo) > 0
+
+    def can_redo(self) -> bool:
+        """Returns whether there is a command to redo"""
+        return len(self._redo) > 0
+
+    def undo(self, model) -> Command:
+        """Reverts the last command and returns it, or None if there is nothing to undo"""
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        command.revert(model)
+        self._redo.append(command)
+        self._sealed = True
+        return command
+
+    def redo(self, model) -> Command:
+        """Applies the last undone command again and returns it, or None if there is nothing to redo"""
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.apply(model)
+        self._undo.append(command)
+        self._sealed = True
+        return command
+
+    def clear(self):
+        """Forgets all commands"""
+        self._undo.clear()
+        self._redo.clear()
+        self._sealed = True
+
+    def __len__(self):
+        return len(self._undo)
@@ -0,0 +1,105 @@
+"""GMC Compiled Step Kernel
+
+Runs chunks of simulation steps in a tight loop over flat arrays. The loop is compiled with Numba when it is
+installed; without Numba run_chunk is None and the simulator keeps stepping in Python.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _run_chunk(num_steps, stop_at_targets, step_offset, storage, p_storage, steps, opt_time,
+               inp_ptr, inp_cur, inp_rate, out_ptr, out_cur, out_rate, out_chance, out_stream, uniforms, draws,
+               targets, passage_targets, first_passage, fires, stalls, starved, trajectory):
+    """Performs up to num_steps time steps and returns the number of steps performed
+    Sources are processed in order exactly like Simulator.step. Inputs and outputs of source s are the entries
+    inp_ptr[s]:inp_ptr[s+1] and out_ptr[s]:out_ptr[s+1]. Outputs with out_stream >= 0 draw the next number of
+    their row in uniforms. With stop_at_targets the chunk ends at the step in which all targets are reached.
+    Row k of trajectory, if it has that many rows, receives the storage after step k of the chunk.
+    """
+    num_sources = len(steps)
+    num_currencies = len(storage)
+    for step in range(num_steps):
+        for cid in range(num_currencies):
+            p_storage[cid] = storage[cid]
+        for sid in range(num_sources):
+            if steps[sid] < 0:
+                steps[sid] += 1
+                continue
+            blocked = False
+            for k in range(inp_ptr[sid], inp_ptr[sid+1]):
+                if p_storage[inp_cur[k]] < inp_rate[k]:
+                    blocked = True
+                    starved[k] += 1
+            if blocked:
+                steps[sid] += 1
+                stalls[sid] += 1
+                continue
+            fires[sid] += 1
+            steps[sid] = steps[sid] - opt_time[sid] + 1
+            for k in range(inp_ptr[sid], inp_ptr[sid+1]):
+                storage[inp_cur[k]] = storage[inp_cur[k]] - inp_rate[k]
+            for k in range(out_ptr[sid], out_ptr[sid+1]):
+                row = out_stream[k]
+                if row >= 0:
+                    value = uniforms[row, draws[row]]
+                    draws[row] += 1
+                    if value >= out_chance[k]:
+                        continue
+                storage[out_cur[k]] = storage[out_cur[k]] + out_rate[k]
+        if step < len(trajectory):
+            for cid in range(num_currencies):
+                trajectory[step, cid] = storage[cid]
+        reached = True
+        for cid in range(num_currencies):
+            if first_passage[cid] < 0 and storage[cid] >= passage_targets[cid]:
+                first_passage[cid] = step_offset + step + 1
+            if storage[cid] < targets[cid]:
+                reached = False
+        if stop_at_targets and reached:
+            return step + 1
+    return num_steps
+
+
+run_chunk = njit(cache=True)(_run_chunk) if njit is not None else None
+
+
+class CompiledModel():
+    """Compiled Model Class
+
+    Flat arrays of a flow model in source order: the input and output connections of all sources in CSR
+    layout, and the row of the random stream of every output with a chance below one.
+    """
+
+    def __init__(self, model, streams: dict):
+        sources, currencies = model.sources, model.currencies
+        cid_lookup = {currency.id: idx for idx, currency in enumerate(currencies)}
+        self.inp_ptr = np.cumsum([0] + [len(source.inputs) for source in sources]).astype(np.int64)
+        self.inp_cur = np.array([cid_lookup[conn.source.id] for source in sources for conn in source.inputs], dtype=np.int64)
+        self.inp_rate = np.array([conn.rate for source in sources for conn in source.inputs], dtype=float)
+        outputs = [conn for source in sources for conn in source.connections]
+        self.out_ptr = np.cumsum([0] + [len(source.connections) for source in sources]).astype(np.int64)
+        self.out_cur = np.array([cid_lookup[conn.target.id] for conn in outputs], dtype=np.int64)
+        self.out_rate = np.array([conn.rate for conn in outputs], dtype=float)
+        self.out_chance = np.array([conn.chance for conn in outputs], dtype=float)
+        self.random = [conn for conn in outputs if conn.chance < 1]
+        rows = {conn: row for row, conn in enumerate(self.random)}
+        self.out_stream = np.array([rows.get(conn, -1) for conn in outputs], dtype=np.int64)
+        self.streams = streams
+
+    def uniforms(self, count: int) -> np.ndarray:
+        """Returns the next count random numbers of every random output without consuming them"""
+        if len(self.random) == 0:
+            return np.zeros((0, count))
+        return np.stack([self.streams[conn].peek(count) for conn in self.random])
+
+    def advance(self, draws: np.ndarray):
+        """Consumes the random numbers drawn by a chunk"""
+        for conn, count in zip(self.random, draws.tolist()):
+            self.streams[conn].advance(count)
@@ -0,0 +1,233 @@
+"""GMC Change Journal
+
+Autosave for large models. Instead of writing the whole model on every save, each change is appended as a
+json line to a journal next to the model file. Once the journal reaches a threshold it is compacted into a new
+snapshot of the model file in a background thread. Loading replays the journal on top of the snapshot, so
+changes survive a crash of the editor. Journaling is opt-in; a model file without a journal is loaded as is.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import List
+import yaml
+
+from gmc.components import Position, Source
+from gmc.flow_model import FlowModel
+from gmc.history import (AddComponents, AddGroup, AddStage, DeleteGroup, _attach, _detach,
+    _remove_connections)
+
+
+def _find(lookup: dict, key):
+    """Returns the component with the given id or the connection with the given source and target ids and index
+    among the parallel connections; journals without the index refer to the first one
+    """
+    return _find_all(lookup, [key])[0]
+
+
+def _find_all(lookup: dict, keys: list) -> list:
+    """Returns the components or connections of many keys, scanning the outputs of every source once"""
+    parallel = {}
+    for source_id in {key[0] for key in keys if isinstance(key, list)}:
+        for conn in lookup[source_id].connections:
+            parallel.setdefault((source_id, conn.target.id), []).append(conn)
+    return [parallel[tuple(key[:2])][key[2] if len(key) == 3 else 0] if isinstance(key, list) else lookup[key]
+        for key in keys]
+
+
+def replay(model: FlowModel, records: List[dict]):
+    """Applies journal records to a model without recording them or notifying the callbacks"""
+    lookup = {comp.id: comp for comp in model.get_components() + model.groups}
+    for record in records:
+        try:
+            _replay_record(model, record, lookup)
+        except (KeyError, IndexError, StopIteration, TypeError, ValueError) as exc:
+            raise RuntimeError(f"Error replaying journal record {record.get('seq')}. Malformed journal.") from exc
+
+
+def _restore(model: FlowModel, components: list, index: int, connections: list, placement: list):
+    """Puts deleted components and connections back at their recorded places, as the undo of a delete does"""
+    for comp in components:
+        (model.sources if isinstance(comp, Source) else model.currencies).insert(index, comp)
+    for connection, (idx, out_pos, inp_pos) in zip(connections, placement):
+        _detach(connection)
+        _attach(connection, (out_pos, inp_pos))
+        model.connections.insert(idx, connection)
+
+
+def _replay_record(model: FlowModel, record: dict, lookup: dict):
+    operation = record['op']
+    if operation == 'add':
+        currencies = [FlowModel.currency_from_dict(data) for data in record.get('currencies', [])]
+        sources = [FlowModel.source_from_dict(data) for data in record.get('sources', [])]
+        lookup.update((comp.id, comp) for comp in currencies + sources)
+        connections = [FlowModel.connection_from_dict(data, lookup) for data in record.get('connections', [])]
+        if 'placement' in record:
+            _restore(model, currencies + sources, record.get('index'), connections, record['placement'])
+        else:
+            AddComponents(currencies, sources, connections).apply(model)
+        for idx, curr_id, value in record.get('stage_targets', []):
+            model.stages[idx]['targets'][curr_id] = value
+    elif operation == 'remove':
+        connections = _find_all(lookup, record.get('connections', []))
+        components = {lookup.pop(comp_id) for comp_id in record.get('sources', []) + record.get('currencies', [])}
+        _remove_connections(model, connections + [conn for comp in components for conn in comp.inputs + comp.connections])
+        model.sources[:] = [source for source in model.sources if source not in components]
+        model.currencies[:] = [currency for currency in model.currencies if currency not in components]
+        for stage in model.stages:
+            for comp in components:
+                stage['targets'].pop(comp.id, None)
+    elif operation == 'move':
+        for comp_id, coords in record['positions'].items():
+            lookup[comp_id].pos = Position(*coords)
+    elif operation == 'set':
+        setattr(_find(lookup, record['key']), record['attribute'], record['value'])
+    elif operation == 'add_stage':
+        AddStage({'name': record['stage']['name'], 'targets': dict(record['stage']['targets'])}, record['index']).apply(model)
+    elif operation == 'remove_stage':
+        model.stages.pop(record['index'])
+    elif operation == 'add_group':
+        group = FlowModel.group_from_dict(record['group'])
+        lookup[group.id] = group
+        AddGroup(group, record['index']).apply(model)
+    elif operation == 'remove_group':
+        DeleteGroup(lookup.pop(record['key'])).apply(model)
+    else:
+        raise ValueError(f"Unknown journal operation '{operation}'!")
+
+
+def read_journal(filename: str) -> List[dict]:
+    """Returns the records of a journal file; a partially written last line is ignored"""
+    if not os.path.exists(filename):
+        return []
+    records = []
+    with open(filename, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    for pos, line in enumerate(lines):
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError as exc:
+            if pos < len(lines) - 1:
+                raise RuntimeError(f"Error reading journal line {pos+1}. Malformed journal.") from exc
+    return records
+
+
+class ChangeJournal():
+    """Change Journal Class
+
+    Keeps a model file up to date by appending changes to <filename>.journal. Records carry increasing
+    sequence numbers and the snapshot stores the number of the last record it contains, so a crash during
+    compaction never applies a change twice. During compaction the journal is moved to <filename>.journal.1
+    until the new snapshot has replaced the model file.
+    """
+
+    def __init__(self, model: FlowModel, filename: str, threshold: int = 1000, background: bool = True, seq: int = None):
+        self.model = model
+        self.filename = filename
+        self.threshold = threshold
+        self.background = background
+        self._seq = 0 if seq is None else seq
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+        if seq is None:
+            self.compact(wait=True)
+        else:
+            self._file = open(self.journal_file(), 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+        model.journal = self
+
+    @classmethod
+    def recover(cls, model: FlowModel, filename: str) -> int:
+        """Loads a model file and replays its journal, if there is one, without writing any file
+        Returns the sequence number of the last change contained in the model.
+        """
+        with open(filename, 'r', encoding='utf-8') as file:
+            model_dict = yaml.load(file, yaml.FullLoader)
+        seq = model_dict.get('journal_seq', 0)
+        model.load_from_dict(model_dict)
+        records = [record for name in (cls.journal_name(filename) + '.1', cls.journal_name(filename))
+            for record in read_journal(name) if record['seq'] > seq]
+        replay(model, records)
+        model.notify()
+        return max([seq] + [record['seq'] for record in records])
+
+    @classmethod
+    def open(cls, model: FlowModel, filename: str, threshold: int = 1000, background: bool = True) -> ChangeJournal:
+        """Loads a model file, replays its journal and continues journaling into it"""
+        seq = cls.recover(model, filename)
+        journal = cls(model, filename, threshold, background, seq=seq)
+        if os.path.exists(journal.journal_file() + '.1') or os.path.getsize(journal.journal_file()) > 0:
+            journal.compact(wait=True)
+        return journal
+
+    @classmethod
+    def discard(cls, filename: str):
+        """Removes the journal of a model file, e.g. after the model was saved without journaling"""
+        for name in (cls.journal_name(filename), cls.journal_name(filename) + '.1'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    @staticmethod
+    def journal_name(filename: str) -> str:
+        """Returns the name of the journal of a model file"""
+        return filename + '.journal'
+
+    def journal_file(self) -> str:
+        """Returns the name of the journal"""
+        return self.journal_name(self.filename)
+
+    def append(self, records: List[dict]):
+        """Appends the records of a change and starts a compaction when the threshold is reached"""
+        with self._lock:
+            for record in records:
+                self._seq += 1
+                self._file.write(json.dumps(dict(record, seq=self._seq), separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._pending += len(records)
+        if self._pending >= self.threshold:
+            self.compact()
+
+    def compact(self, wait: bool = False):
+        """Writes a snapshot of the model to the model file and starts a new journal
+        Without wait the snapshot is written in a background thread; a running compaction is not restarted.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            if not wait:
+                return
+            self._thread.join()
+        with self._lock:
+            snapshot = self.model.to_dict()
+            snapshot['journal_seq'] = self._seq
+            if self._file is not None:
+                self._file.close()
+            if os.path.exists(self.journal_file()):
+                os.replace(self.journal_file(), self.journal_file() + '.1')
+            self._file = open(self.journal_file(), 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+            self._pending = 0
+        if wait or not self.background:
+            self._write_snapshot(snapshot)
+            return
+        self._thread = threading.Thread(target=self._write_snapshot, args=(snapshot,))
+        self._thread.start()
+
+    def _write_snapshot(self, snapshot: dict):
+        temp = self.filename + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            yaml.dump(snapshot, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.filename)
+        if os.path.exists(self.journal_file() + '.1'):
+            os.remove(self.journal_file() + '.1')
+
+    def close(self):
+        """Compacts the journal and stops journaling the model"""
+        self.compact(wait=True)
+        with self._lock:
+            self._file.close()
+            self._file = None
+        if self.model.journal is self:
+            self.model.journal = None
@@ -0,0 +1,147 @@
+"""GMC Graph Layout"""
+
+from __future__ import annotations
+
+from typing import Iterable
+import numpy as np
+import networkx as nx
+from scipy.spatial import cKDTree
+
+from gmc.flow_model import FlowModel
+
+
+def _accumulate(target: np.ndarray, index: np.ndarray, values: np.ndarray):
+    """Adds rows of values to the rows of target given by index"""
+    for axis in range(target.shape[1]):
+        target[:, axis] += np.bincount(index, weights=values[:, axis], minlength=len(target))
+
+
+def force_layout(graph: nx.Graph, pos: dict = None, fixed: Iterable = None, k: float = 1.,
+                 iterations: int = 50, seed: int = None) -> dict:
+    """Returns a force directed layout of the graph
+    Repulsion is only computed between nodes closer than 3k using a spatial index, so an iteration costs
+    O(n log n) instead of O(n^2). Nodes in fixed keep their given position, nodes without a position start
+    next to their placed neighbours.
+    """
+    rng = np.random.default_rng(seed)
+    nodes = list(graph.nodes)
+    index = {node: idx for idx, node in enumerate(nodes)}
+    pos = pos if pos is not None else {}
+    points = np.zeros((len(nodes), 2))
+    placed = np.array([node in pos for node in nodes], dtype=bool)
+    for node in pos:
+        if node in index:
+            points[index[node]] = pos[node]
+    center = points[placed].mean(axis=0) if placed.any() else np.zeros(2)
+    spread = k * np.sqrt(len(nodes))
+    for node in nodes:
+        if node not in pos:
+            neighbours = [index[other] for other in nx.all_neighbors(graph, node) if placed[index[other]]]
+            if neighbours:
+                points[index[node]] = points[neighbours].mean(axis=0) + rng.uniform(-k, k, 2)
+            else:
+                points[index[node]] = center + rng.uniform(-spread, spread, 2) / 2
+    free = np.ones(len(nodes), dtype=bool)
+    for node in fixed if fixed is not None else []:
+        if node in index:
+            free[index[node]] = False
+    free_idx = np.flatnonzero(free)
+    edges = np.array([(index[u], index[v]) for u, v in graph.edges if u != v], dtype=int).reshape((-1, 2))
+    edges = edges[free[edges[:, 0]] | free[edges[:, 1]]]
+    extent = np.ptp(points, axis=0).max() if len(nodes) > 1 else 1.
+    temperature = max(extent, k) / 10
+    for iteration in range(iterations if len(free_idx) > 0 else 0):
+        displacement = np.zeros_like(points)
+        tree = cKDTree(points)
+        if 2 * len(free_idx) > len(nodes):
+            pairs = tree.query_pairs(3*k, output_type='ndarray')
+            source, target = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+        else:
+            neighbours = tree.query_ball_point(points[free_idx], 3*k)
+            source = np.repeat(free_idx, [len(near) for near in neighbours])
+            target = np.fromiter((other for near in neighbours for other in near), dtype=int, count=len(source))
+        if len(source) > 0:
+            delta = points[source] - points[target]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-6)
+            _accumulate(displacement, source, delta * (k**2 / distance**2)[:, None])
+        if len(edges) > 0:
+            delta = points[edges[:, 0]] - points[edges[:, 1]]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-6)
+            force = delta * (distance / k)[:, None]
+            _accumulate(displacement, edges[:, 0], -force)
+            _accumulate(displacement, edges[:, 1], force)
+        displacement[~free] = 0.
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        step = temperature * (1 - iteration / iterations)
+        points += displacement * (np.minimum(length, step) / length)[:, None]
+    return {node: tuple(points[idx]) for idx, node in enumerate(nodes)}
+
+
+def layered_layout(model: FlowModel, spacing: float = 1.) -> dict:
+    """Returns a layout with the flow running from left to right
+    Each component is placed one layer behind its furthest predecessor, components on a cycle share a layer.
+    The order within the layers is improved by a few barycenter sweeps to reduce edge crossings.
+    """
+    graph = nx.DiGraph()
+    graph.add_nodes_from(comp.id for comp in model.get_components())
+    graph.add_edges_from((conn.source.id, conn.target.id) for conn in model.connections)
+    condensed = nx.condensation(graph)
+    layer_of = {}
+    for scc in nx.topological_sort(condensed):
+        layer_of[scc] = max((layer_of[pred] + 1 for pred in condensed.predecessors(scc)), default=0)
+    layers = [[] for _ in range(max(layer_of.values(), default=-1) + 1)]
+    for comp in model.get_components():
+        layers[layer_of[condensed.graph['mapping'][comp.id]]].append(comp.id)
+    order = {node: idx for layer in layers for idx, node in enumerate(layer)}
+    for sweep in range(4):
+        adjacent = graph.predecessors if sweep % 2 == 0 else graph.successors
+        for layer in layers[1:] if sweep % 2 == 0 else layers[-2::-1]:
+            barycenter = {}
+            for node in layer:
+                others = [order[other] for other in adjacent(node)]
+                barycenter[node] = sum(others) / len(others) if others else order[node]
+            layer.sort(key=barycenter.get)
+            order.update((node, idx) for idx, node in enumerate(layer))
+    return {
+        node: (layer_idx * spacing, ((len(layer) - 1) / 2 - idx) * spacing)
+        for layer_idx, layer in enumerate(layers) for idx, node in enumerate(layer)
+    }
+
+
+class LayoutEngine():
+    """Layout Engine Class
+
+    Arranges flow models either in layers or force directed and caches the result on the model. When the
+    model structure changed since the last arrangement only new components and their neighbours are moved.
+    """
+
+    def __init__(self, mode: str = 'layered', spacing: float = 1., iterations: int = 50):
+        if mode not in ('layered', 'force'):
+            raise ValueError(f"Unknown layout mode '{mode}'!")
+        self.mode = mode
+        self.spacing = spacing
+        self.iterations = iterations
+
+    def arrange(self, model: FlowModel, full: bool = False) -> dict:
+        """Returns new component positions of the model"""
+        key = model.structure_key()
+        cached = model.layout_cache.get(self.mode)
+        if cached is not None and cached[0] == key and not full:
+            return cached[1]
+        graph = nx.Graph()
+        graph.add_nodes_from(comp.id for comp in model.get_components())
+        graph.add_edges_from((conn.source.id, conn.target.id) for conn in model.connections)
+        if cached is None or full:
+            if self.mode == 'layered':
+                positions = layered_layout(model, self.spacing)
+            else:
+                positions = force_layout(graph, k=self.spacing, iterations=self.iterations, seed=0)
+        else:
+            known = {node for node in cached[1] if node in graph}
+            affected = set(graph.nodes) - known
+            affected.update(other for node in list(affected) for other in graph.neighbors(node))
+            current = {node: coords for node, coords in model.layout().items() if node in known}
+            positions = force_layout(graph, pos=current, fixed=known - affected, k=self.spacing,
+                iterations=self.iterations, seed=0)
+        model.layout_cache[self.mode] = (key, positions)
+        return positions
@@ -1,25 +1,75 @@
 """Monte Carlo Simulator"""
 
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
 import numpy as np
 import networkx as nx
+from scipy import sparse as sp
 from scipy.optimize import linprog
+try:
+    import highspy
+except ImportError:
+    highspy = None
 
+from gmc.aggregation import collapse_groups
+from gmc.fixed_point import FixedPointKernel
 from gmc.flow_model import FlowModel
+from gmc.generalized_flow import GeneralizedFlowSolver
+from gmc.jit_kernel import CompiledModel, run_chunk
+from gmc.layout import force_layout
+from gmc.random_streams import connection_streams, stream_keys
+from gmc.reduction import prune_model, split_model
 
 
 class Simulator():
-    """MC Simulator Class"""
+    """MC Simulator Class
 
-    def __init__(self, model: FlowModel):
+    With fixed_point set to a number of units per currency unit (e.g. 10**6) the simulation runs on the exact
+    int64 kernel instead of float storage in the component properties. Otherwise run() performs chunks of
+    steps in the compiled kernel when Numba is installed and jit is set. With sparse set the linear program is
+    built from sparse incidence matrices. Collapsing a group does not change the results; with aggregate set,
+    collapsed groups that form a linear chain are simulated as single aggregate sources.
+
+    Models with several target stages are simulated in one run: when all targets of a stage are reached the
+    storage is kept, the flow is re-solved for the targets of the next stage and sources without flow in a
+    stage are paused.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, model: FlowModel, reduce: bool = False, throughput: float = None, seed: int = None,
+                 fixed_point: int = None, jit: bool = True, sparse: bool = False, aggregate: bool = False):
         self.step_num = 0
+        self.fixed_point = fixed_point
+        self.jit = jit
+        self.sparse = sparse
         self.status = 0
-        self._model = model.copy()
+        if aggregate and any(group.collapsed for group in model.groups):
+            model = collapse_groups(model)
+        self._model = prune_model(model) if reduce else model.copy()
+        self._streams = connection_streams(self._model.connections, seed)
+        self._scheduled = [(comp, attribute, getattr(comp, attribute))
+            for comp in self._model.sources + self._model.connections for attribute in comp.schedules]
+        self._breaks = self._model.schedule_breaks()
+        self._regime = self._regime_key(0)
+        self._next_break = self._breaks[0] if self._breaks else np.inf
+        self._apply_regime()
         self._graph = self._build_networkx_graph(self._model)
-        rates, inc_inp, inc_out = self._build_flow_matrices(self._model)
-        self._flow_info = self._compute_max_flow(inc_inp-inc_out, rates)
+        self._stage_targets = [[targets[currency.id] for currency in self._model.currencies]
+            for targets in self._model.stage_targets()]
+        self._stage_names = ['Stage 1'] + [stage['name'] for stage in self._model.stages]
+        self._stage = 0
+        self._stage_flows = {}
+        self._stage_steps = []
+        self._stage_solver = StageSolver(self._model) if len(self._stage_targets) > 1 else None
+        self._flow_info = self._stage_flows[0] = self._solve(throughput)
+        self._regimes = {self._regime: (self._stage_flows, self._stage_solver, None)}
         if self._flow_info['status'] == 0:
+            if self._flow_info['steps'] == 0:
+                self.status = 2
             for idx, source in enumerate(self._model.sources):
-                if self._flow_info['s'][idx] == 0:
+                if self._flow_info['s'][idx] == 0 and self._stage_solver is None:
                     self.status = 2
                 source.prop = {
                     'name': source.name,
@@ -37,9 +87,116 @@ class Simulator():
                 }
         else:
             self.status = 1
+        self._input_conns = [conn for source in self._model.sources for conn in source.inputs]
+        self._input_offset = np.cumsum([0] + [len(source.inputs) for source in self._model.sources]).tolist()
+        self._kernel = None
+        self._compiled = None
+        self._initial_flow = self._flow_info
+        self._synced = True
+        if self._flow_info['status'] == 0 and self._stage_solver is not None:
+            self._pause_sources()
+        if fixed_point and self._flow_info['status'] == 0:
+            self._kernel = FixedPointKernel(self._model, self._streams, fixed_point)
+            self._load_kernel()
+        self._reset_counters()
+        self._initial_status = self.status
+        if self.status == 0:
+            self._advance_stages()
+
+    def _solve(self, throughput: float = None):
+        """Solves the max flow problem for the current target values"""
+        solver = GeneralizedFlowSolver(self._model)
+        if solver.unique:
+            return solver.solve(throughput)
+        if self._stage_solver is not None:
+            return self._stage_solver.solve([currency.target_value for currency in self._model.currencies], throughput)
+        rates, inc_inp, inc_out = self._build_flow_matrices(self._model, self.sparse)
+        return self._compute_max_flow(inc_inp-inc_out, rates, throughput)
+
+    def _pause_sources(self):
+        """Pauses sources without flow in the current stage and resumes the others"""
+        for idx, source in enumerate(self._model.sources):
+            if self._flow_info['s'][idx] == 0:
+                source.prop['steps'] = -np.inf
+            elif source.prop['steps'] == -np.inf:
+                source.prop['steps'] = 0
+
+    def _enter_stage(self, stage: int):
+        """Sets the target values of a stage and re-solves the flow, keeping the storage"""
+        self._sync()
+        self._stage = stage
+        for currency, value in zip(self._model.currencies, self._stage_targets[stage]):
+            currency.target_value = value
+        self._pending_targets = [(idx, curr) for idx, curr in enumerate(self._model.currencies)
+            if curr.target_value > 0 and self._first_passage[idx] < 0]
+        if stage not in self._stage_flows:
+            self._stage_flows[stage] = self._solve()
+        self._flow_info = self._stage_flows[stage]
+        if self._flow_info['status'] != 0:
+            self.status = 1
+            return
+        if self._flow_info['steps'] == 0:
+            self.status = 2
+        for idx, source in enumerate(self._model.sources):
+            source.prop['opt_time'] = 1./self._flow_info['s'][idx] if self._flow_info['s'][idx] > 0 else 0
+        for idx, currency in enumerate(self._model.currencies):
+            currency.prop['delta'] = self._flow_info['c'][idx]
+            currency.prop['target'] = currency.target_value
+        self._pause_sources()
+        if self._kernel is not None:
+            self._kernel.target = self._kernel.to_fixed(self._stage_targets[stage])
+            self._kernel.opt_time = self._kernel.to_fixed([source.prop['opt_time'] for source in self._model.sources])
+            self._load_kernel()
+
+    def _regime_key(self, step: float) -> tuple:
+        """Returns the values of the scheduled parameters after the given number of steps"""
+        return tuple(comp.value_at(attribute, step, base) for comp, attribute, base in self._scheduled)
+
+    def _apply_regime(self):
+        for (comp, attribute, _), value in zip(self._scheduled, self._regime):
+            setattr(comp, attribute, value)
+
+    def _enter_regime(self):
+        """Switches to the parameter values of the schedule segment of the current step
+        Flows, stage solvers and compiled arrays are cached per distinct set of parameter values.
+        """
+        pos = int(np.searchsorted(self._breaks, self.step_num, side='right'))
+        self._next_break = self._breaks[pos] if pos < len(self._breaks) else np.inf
+        regime = self._regime_key(self._breaks[pos-1] if pos > 0 else 0)
+        if regime == self._regime:
+            return
+        self._sync()
+        self._regimes[self._regime] = (self._stage_flows, self._stage_solver, self._compiled)
+        self._regime = regime
+        self._apply_regime()
+        if regime in self._regimes:
+            self._stage_flows, self._stage_solver, self._compiled = self._regimes[regime]
+        else:
+            self._stage_flows = {}
+            self._stage_solver = StageSolver(self._model) if len(self._stage_targets) > 1 else None
+            self._compiled = None
+        for source in self._model.sources:
+            source.prop['min_time'] = source.time_step
+        if self._kernel is not None:
+            self._kernel.set_rates(self._model)
+        self._enter_stage(self._stage)
+
+    def _stage_reached(self):
+        if self._kernel is not None:
+            return bool(np.all(self._kernel.storage >= self._kernel.target))
+        return all(curr.prop['storage'] >= curr.target_value for curr in self._model.currencies)
+
+    def _advance_stages(self):
+        """Records completed stages and moves on to the next stage"""
+        while self.status == 0 and len(self._stage_steps) < len(self._stage_targets) and self._stage_reached():
+            self._stage_steps.append(self.step_num)
+            if len(self._stage_steps) < len(self._stage_targets):
+                self._enter_stage(len(self._stage_steps))
 
     @staticmethod
-    def _build_flow_matrices(model: FlowModel):
+    def _build_flow_matrices(model: FlowModel, sparse: bool = False):
+        if sparse:
+            return Simulator._build_sparse_flow_matrices(model)
         source_rates = np.zeros(len(model.sources)+1)
         out_incidence = np.zeros((len(model.currencies), len(model.sources)+1))
         inp_incidence = np.zeros((len(model.currencies), len(model.sources)+1))
@@ -51,11 +208,29 @@ class Simulator():
                 out_incidence[cid, sid] = connection.rate
             for connection in source.connections:
                 cid = cid_lookup[connection.target.id]
-                inp_incidence[cid, sid] = connection.rate
+                inp_incidence[cid, sid] = connection.mean_rate()
         source_rates[-1] = 1.
         out_incidence[:, -1] = np.array([currency.target_value for currency in model.currencies])
         return source_rates, inp_incidence, out_incidence
 
+    @staticmethod
+    def _build_sparse_flow_matrices(model: FlowModel):
+        """Builds the incidence matrices in CSR format, which needs memory in the number of connections only"""
+        source_rates = np.array([1./source.time_step if source.time_step > 0 else np.inf for source in model.sources] + [1.])
+        cid_lookup = {currency.id: idx for idx, currency in enumerate(model.currencies)}
+        out_entries = {(cid, len(model.sources)): currency.target_value for cid, currency in enumerate(model.currencies)}
+        inp_entries = {}
+        for sid, source in enumerate(model.sources):
+            for connection in source.inputs:
+                out_entries[cid_lookup[connection.source.id], sid] = connection.rate
+            for connection in source.connections:
+                inp_entries[cid_lookup[connection.target.id], sid] = connection.mean_rate()
+        shape = (len(model.currencies), len(model.sources)+1)
+        def csr(entries: dict):
+            rows, cols = zip(*entries.keys()) if entries else ((), ())
+            return sp.csr_array((list(entries.values()), (rows, cols)), shape=shape)
+        return source_rates, csr(inp_entries), csr(out_entries)
+
     @staticmethod
     def _build_networkx_graph(model: FlowModel):
         graph = nx.DiGraph()
@@ -71,62 +246,601 @@ class Simulator():
         return graph
 
     @staticmethod
-    def _compute_max_flow(A: np.ndarray, b: np.ndarray):
-        """Finds maximum model flow using linear programming with positive contstraints A and upper bounds b"""
+    def _compute_max_throughput(A: np.ndarray, b: np.ndarray):
+        """Finds maximum drain rate using linear programming with positive contstraints A and upper bounds b"""
         nc, ns = A.shape
         target = np.zeros(ns)
         target[-1] = 1.
         bounds = np.stack([np.zeros(ns), b], axis=1)
-        result = linprog(-target, -A, np.zeros(nc), bounds=bounds)
-        result = linprog(np.ones(ns), -A, np.zeros(nc), target.reshape((1, -1)), result.x[-1], bounds=bounds)
+        return linprog(-target, -A, np.zeros(nc), bounds=bounds)
+
+    @staticmethod
+    def _compute_max_flow(A: np.ndarray, b: np.ndarray, throughput: float = None):
+        """Finds maximum model flow using linear programming with positive contstraints A and upper bounds b
+        If throughput is given the drain rate is fixed to it instead of being maximized.
+        """
+        nc, ns = A.shape
+        target = np.zeros(ns)
+        target[-1] = 1.
+        bounds = np.stack([np.zeros(ns), b], axis=1)
+        duals = {}
+        if throughput is None:
+            result = Simulator._compute_max_throughput(A, b)
+            if result.status != 0:
+                return {'status': result.status, 'message': result.message}
+            throughput = result.x[-1]
+            duals['shadow_prices'] = -result.ineqlin.marginals
+            duals['reduced_costs'] = -result.upper.marginals[:-1]
+        result = linprog(np.ones(ns), -A, np.zeros(nc), target.reshape((1, -1)), throughput, bounds=bounds)
         ret = {'status': result.status, 'message': result.message}
         if result.status == 0:
             ret['steps'] = 1. / result.x[-1] if result.x[-1] > 0 else 0.
             ret['s'] = result.x[:-1]
-            ret['c'] = np.matmul(A, result.x)
+            ret['c'] = A @ result.x
+            ret.update(duals)
         return ret
 
     def flow_info(self):
-        """Return flow info"""
+        """Return flow info
+        For a solvable model it also contains the shadow prices of the currency constraints and the reduced
+        costs of the source bounds of the max flow problem, i.e. the increase of the drain rate per additional
+        unit of currency or source rate per time step. Flows found without the linear program, e.g. by the
+        generalized network flow, get them from one linear program on the first request.
+        """
+        if self._flow_info['status'] == 0 and 'shadow_prices' not in self._flow_info:
+            rates, inc_inp, inc_out = self._build_flow_matrices(self._model, self.sparse)
+            result = self._compute_max_throughput(inc_inp-inc_out, rates)
+            if result.status == 0:
+                self._flow_info['shadow_prices'] = -result.ineqlin.marginals
+                self._flow_info['reduced_costs'] = -result.upper.marginals[:-1]
         return self._flow_info
 
+    def sensitivity(self):
+        """Returns the model parameters ranked by their influence on the throughput time
+        Gradients are computed from the dual values of a single max flow solve. The elasticity is the relative
+        change of the throughput time per relative change of the parameter.
+        """
+        rates, inc_inp, inc_out = self._build_flow_matrices(self._model, self.sparse)
+        result = self._compute_max_throughput(inc_inp-inc_out, rates)
+        if result.status != 0 or result.x[-1] <= 0:
+            return []
+        throughput = result.x[-1]
+        prices = result.ineqlin.marginals
+        cid_lookup = {currency.id: idx for idx, currency in enumerate(self._model.currencies)}
+        report = []
+        def add_entry(parameter: str, name: str, key, value: float, gradient: float):
+            report.append({
+                'parameter': parameter,
+                'name': name,
+                'id': key,
+                'value': value,
+                'gradient': gradient,
+                'elasticity': -gradient * value / throughput
+            })
+        for sid, source in enumerate(self._model.sources):
+            flow = result.x[sid]
+            for conn in source.inputs:
+                add_entry('rate', f"{conn.source.name} -> {source.name}", (conn.source.id, source.id), conn.rate,
+                    prices[cid_lookup[conn.source.id]] * flow)
+            for conn in source.connections:
+                add_entry('rate', f"{source.name} -> {conn.target.name}", (source.id, conn.target.id), conn.rate,
+                    -prices[cid_lookup[conn.target.id]] * flow * conn.chance)
+                if conn.chance < 1:
+                    add_entry('chance', f"{source.name} -> {conn.target.name}", (source.id, conn.target.id), conn.chance,
+                        -prices[cid_lookup[conn.target.id]] * flow * conn.rate)
+            if source.time_step > 0:
+                add_entry('time_step', source.name, source.id, source.time_step,
+                    result.upper.marginals[sid] / source.time_step**2)
+        for cid, currency in enumerate(self._model.currencies):
+            if currency.target_value > 0:
+                add_entry('target_value', currency.name, currency.id, currency.target_value, prices[cid] * throughput)
+        return sorted(report, key=lambda entry: -abs(entry['elasticity']))
+
+    def model(self):
+        """Return the simulated flow model"""
+        return self._model
+
     def graph(self):
         """Return networkx graph"""
         return self._graph
 
     def layout(self):
         """Return model node layout as dictionary"""
-        return nx.spring_layout(self._graph, pos=self._model.layout(), fixed=self._model.layout().keys(),
-            k=self._model.avg_connection_length()/self._model.num_components()/8, iterations=500)
+        key = self._model.structure_key()
+        cached = self._model.layout_cache.get('simulation')
+        if cached is None or cached[0] != key:
+            k = self._model.avg_connection_length() / 2 or 1.
+            positions = force_layout(self._graph, pos=self._model.layout(), fixed=self._model.layout().keys(), k=k, seed=0)
+            cached = self._model.layout_cache['simulation'] = (key, positions)
+        return cached[1]
 
     def stage(self):
-        """Returns number of stages completed
-        (Currently only a single stage is supported)
-        """
-        return int(all(curr.prop['storage'] >= curr.target_value for curr in self._model.currencies))
+        """Returns number of stages completed"""
+        return len(self._stage_steps)
+
+    def num_stages(self):
+        """Returns the number of target stages"""
+        return len(self._stage_targets)
+
+    def stage_results(self):
+        """Returns name, targets, completion step and duration of every stage"""
+        results = []
+        for idx, name in enumerate(self._stage_names):
+            step = self._stage_steps[idx] if idx < len(self._stage_steps) else None
+            previous = self._stage_steps[idx-1] if 0 < idx <= len(self._stage_steps) else 0
+            results.append({
+                'name': name,
+                'targets': {curr.id: value for curr, value in zip(self._model.currencies, self._stage_targets[idx])},
+                'step': step,
+                'duration': step - previous if step is not None else None
+            })
+        return results
 
     def source_properties(self):
         """Returns current source properties"""
+        self._sync()
         return {source.id: source.prop for source in self._model.sources}
 
     def currency_properties(self):
         """Returns current currency storage"""
+        self._sync()
         return {curr.id: curr.prop for curr in self._model.currencies}
 
+    def _sync(self):
+        """Copies the state of the fixed point kernel into the component properties"""
+        if self._kernel is None or self._synced:
+            return
+        kernel = self._kernel
+        storage, p_storage = kernel.to_float(kernel.storage).tolist(), kernel.to_float(kernel.p_storage).tolist()
+        for idx, currency in enumerate(self._model.currencies):
+            currency.prop['storage'], currency.prop['p_storage'] = storage[idx], p_storage[idx]
+        for source, steps in zip(self._model.sources, kernel.to_float(kernel.steps).tolist()):
+            source.prop['steps'] = steps if steps > kernel.PAUSED / (2 * kernel.scale) else -np.inf
+        self._synced = True
+
+    def _load_kernel(self):
+        """Copies the component properties into the fixed point kernel"""
+        kernel = self._kernel
+        kernel.storage = kernel.to_fixed([curr.prop['storage'] for curr in self._model.currencies])
+        kernel.p_storage = kernel.to_fixed([curr.prop['p_storage'] for curr in self._model.currencies])
+        steps = np.array([source.prop['steps'] for source in self._model.sources], dtype=float)
+        kernel.steps = np.where(np.isinf(steps), kernel.PAUSED, kernel.to_fixed(np.where(np.isinf(steps), 0, steps)))
+        kernel.set_streams(self._streams)
+        self._synced = True
+
+    def _reset_counters(self):
+        """Clears the fire, wait and stall counters and the first passage steps"""
+        self._fires = [0] * len(self._model.sources)
+        self._stalls = [0] * len(self._model.sources)
+        self._starved = [0] * len(self._input_conns)
+        self._first_passage = np.full(len(self._model.currencies), -1, dtype=np.int64)
+        self._counted_from = self.step_num
+        self._pending_targets = [(idx, curr) for idx, curr in enumerate(self._model.currencies) if curr.target_value > 0]
+        if self._kernel is not None:
+            self._kernel.reset_counters()
+
+    def summary(self):
+        """Returns the source utilization and the first passage steps of the currency targets
+        For every source the steps are counted in which it fired, waited for its cooldown or stalled because an
+        input currency was short; starvation is counted per input currency. Utilization is the share of steps
+        in which the source was not stalled. Counters start at the last reset or restore.
+        """
+        counted = self.step_num - self._counted_from
+        if self._kernel is not None:
+            self._fires, self._stalls = self._kernel.fires.tolist(), self._kernel.stalls.tolist()
+            self._starved = self._kernel.starved.tolist()
+        starved = {}
+        for conn, count in zip(self._input_conns, self._starved):
+            starved.setdefault(conn.target.id, {})[conn.source.id] = count
+        return {
+            'steps': counted,
+            'sources': {
+                source.id: {
+                    'name': source.name,
+                    'fires': self._fires[idx],
+                    'waits': counted - self._fires[idx] - self._stalls[idx],
+                    'stalls': self._stalls[idx],
+                    'utilization': 1. - self._stalls[idx] / max(counted, 1),
+                    'starved': starved.get(source.id, {})
+                } for idx, source in enumerate(self._model.sources)
+            },
+            'currencies': {
+                curr.id: {
+                    'name': curr.name,
+                    'target': curr.target_value,
+                    'first_passage': int(self._first_passage[idx]) if self._first_passage[idx] >= 0 else None
+                } for idx, curr in enumerate(self._model.currencies)
+            }
+        }
+
+    def _update_first_passage(self):
+        if self._kernel is not None:
+            reached = (self._first_passage < 0) & (self._kernel.target > 0) & (self._kernel.storage >= self._kernel.target)
+            self._first_passage[reached] = self.step_num
+            return
+        reached = [(idx, curr) for idx, curr in self._pending_targets if curr.prop['storage'] >= curr.target_value]
+        for idx, curr in reached:
+            self._first_passage[idx] = self.step_num
+            self._pending_targets.remove((idx, curr))
+
     def step(self):
         """Performs one simulation time step"""
+        if self.step_num >= self._next_break:
+            self._enter_regime()
         self.step_num += 1
+        if self._kernel is not None:
+            self._kernel.step()
+            self._synced = False
+            self._update_first_passage()
+            self._advance_stages()
+            return
         for currency in self._model.currencies:
             currency.prop['p_storage'] = currency.prop['storage']
-        for source in self._model.sources:
+        for idx, source in enumerate(self._model.sources):
             if source.prop['steps'] < 0:
                 source.prop['steps'] += 1
                 continue
-            if any(conn.source.prop['p_storage'] < conn.rate for conn in source.inputs):
+            short = [pos for pos, conn in enumerate(source.inputs, self._input_offset[idx])
+                if conn.source.prop['p_storage'] < conn.rate]
+            if short:
                 source.prop['steps'] += 1
+                self._stalls[idx] += 1
+                for pos in short:
+                    self._starved[pos] += 1
                 continue
+            self._fires[idx] += 1
             source.prop['steps'] = source.prop['steps'] - source.prop['opt_time'] + 1
             for conn in source.inputs:
                 conn.source.prop['storage'] = conn.source.prop['storage'] - conn.rate
             for conn in source.connections:
+                if conn.chance < 1 and self._streams[conn].next() >= conn.chance:
+                    continue
                 conn.target.prop['storage'] = conn.target.prop['storage'] + conn.rate
+        if self._pending_targets:
+            self._update_first_passage()
+        self._advance_stages()
+
+    def checkpoint(self):
+        """Returns a snapshot of the simulation state
+        The arrays are read-only so a snapshot can be shared by several forks without copying.
+        """
+        self._sync()
+        solved = self._flow_info['status'] == 0
+        currencies = self._model.currencies if solved else []
+        sources = self._model.sources if solved else []
+        keys = stream_keys(self._model.connections)
+        snapshot = {
+            'step_num': self.step_num,
+            'currencies': np.array([curr.id for curr in currencies], dtype=str),
+            'storage': np.array([curr.prop['storage'] for curr in currencies], dtype=float),
+            'p_storage': np.array([curr.prop['p_storage'] for curr in currencies], dtype=float),
+            'sources': np.array([source.id for source in sources], dtype=str),
+            'steps': np.array([source.prop['steps'] for source in sources], dtype=float),
+            'rng': np.array(json.dumps({keys[conn]: stream.state() for conn, stream in self._streams.items()})),
+            'stage_steps': np.array(self._stage_steps, dtype=np.int64)
+        }
+        for value in snapshot.values():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        """Continues the simulation from a snapshot
+        Components are matched by id; components that are not part of the snapshot start from empty storage.
+        """
+        if self._initial_flow['status'] != 0:
+            return
+        stage_steps = [int(step) for step in snapshot['stage_steps']] if 'stage_steps' in snapshot else []
+        self.step_num = int(snapshot['step_num'])
+        self._enter_regime()
+        if min(len(stage_steps), self.num_stages()-1) != self._stage:
+            self._enter_stage(min(len(stage_steps), self.num_stages()-1))
+        self.status = self._initial_status
+        self._stage_steps = stage_steps
+        storage = dict(zip(snapshot['currencies'], zip(snapshot['storage'], snapshot['p_storage'])))
+        steps = dict(zip(snapshot['sources'], snapshot['steps']))
+        for currency in self._model.currencies:
+            currency.prop['storage'], currency.prop['p_storage'] = (float(value) for value in storage.get(currency.id, (0, 0)))
+        for source in self._model.sources:
+            source.prop['steps'] = float(steps.get(source.id, 0))
+        if 'rng' in snapshot:
+            states = json.loads(str(snapshot['rng']))
+            keys = stream_keys(self._model.connections)
+            for conn, stream in self._streams.items():
+                if str(keys[conn]) in states:
+                    stream.set_state(states[str(keys[conn])])
+        if self._kernel is not None:
+            self._load_kernel()
+        self._reset_counters()
+        self._update_first_passage()
+
+    def reset(self, seed: int = None, antithetic: bool = False):
+        """Restarts the simulation from empty storage with a new random seed
+        Antithetic runs use the complementary random numbers of a run with the same seed.
+        """
+        self.step_num = 0
+        self._streams = connection_streams(self._model.connections, seed, antithetic)
+        if self._initial_flow['status'] != 0:
+            return
+        self._enter_regime()
+        if self._stage != 0:
+            self._enter_stage(0)
+        self.status = self._initial_status
+        self._stage_steps = []
+        for currency in self._model.currencies:
+            currency.prop['storage'] = 0
+            currency.prop['p_storage'] = 0
+        for source in self._model.sources:
+            source.prop['steps'] = 0
+        if self._stage_solver is not None:
+            self._pause_sources()
+        if self._kernel is not None:
+            self._load_kernel()
+        self._reset_counters()
+        if self.status == 0:
+            self._advance_stages()
+
+    def fork(self, model: FlowModel = None, reduce: bool = False):
+        """Returns a new simulator that continues from the current state
+        If a model is given the branch is simulated with its parameters instead of the ones of this simulator.
+        """
+        branch = Simulator(model if model is not None else self._model, reduce=reduce, fixed_point=self.fixed_point,
+                           jit=self.jit, sparse=self.sparse)
+        branch.restore(self.checkpoint())
+        return branch
+
+    @staticmethod
+    def save_checkpoint(snapshot: dict, filename: str):
+        """Saves a snapshot to a numpy archive"""
+        np.savez(filename, **snapshot)
+
+    @staticmethod
+    def load_checkpoint(filename: str):
+        """Loads a snapshot from a numpy archive"""
+        with np.load(filename) as archive:
+            return {key: archive[key] for key in archive.files}
+
+    def run(self, until: int = None, callback: Callable = None, max_steps: int = None, record: Callable = None,
+            record_interval: int = 1):
+        """Performs time steps until all targets are reached or until the given step number
+        The callback is called with the simulator after every time step. Without an explicit step number the
+        run also stops at max_steps, if given. Record is called with an array of step numbers and the currency
+        storage after these steps, one row per step, for every step divisible by the record interval; unlike a
+        callback it keeps the compiled kernel, which hands over the rows of a whole chunk at once.
+        """
+        if self.jit and run_chunk is not None and self._kernel is None and callback is None:
+            self._run_compiled(until, max_steps, record, record_interval)
+            return
+        step_nums, rows = [], []
+        while self.status == 0 and (self.stage() < self.num_stages() if until is None else self.step_num < until):
+            if max_steps is not None and self.step_num >= max_steps:
+                break
+            self.step()
+            if callback is not None:
+                callback(self)
+            if record is not None and self.step_num % record_interval == 0:
+                step_nums.append(self.step_num)
+                rows.append(self._storage_row())
+                if len(rows) == self.CHUNK_SIZE:
+                    record(np.array(step_nums), np.array(rows))
+                    step_nums, rows = [], []
+        if rows:
+            record(np.array(step_nums), np.array(rows))
+
+    def _storage_row(self) -> np.ndarray:
+        """Returns the current storage of all currencies without syncing the component properties"""
+        if self._kernel is not None:
+            return self._kernel.to_float(self._kernel.storage)
+        return np.array([curr.prop['storage'] for curr in self._model.currencies], dtype=float)
+
+    def _run_compiled(self, until: int = None, max_steps: int = None, record: Callable = None, record_interval: int = 1):
+        """Performs the time steps of run in chunks of the compiled kernel, which end at schedule breaks"""
+        currencies, sources = self._model.currencies, self._model.sources
+        while self.status == 0 and (self.stage() < self.num_stages() if until is None else self.step_num < until):
+            if self.step_num >= self._next_break:
+                self._enter_regime()
+                if self.status != 0:
+                    break
+            if self._compiled is None:
+                self._compiled = CompiledModel(self._model, self._streams)
+            compiled = self._compiled
+            compiled.streams = self._streams
+            limit = self.CHUNK_SIZE
+            for stop in (until, max_steps, self._next_break):
+                if stop is not None and stop - self.step_num < limit:
+                    limit = int(np.ceil(stop - self.step_num))
+            if limit <= 0:
+                break
+            storage = np.array([curr.prop['storage'] for curr in currencies], dtype=float)
+            p_storage = np.array([curr.prop['p_storage'] for curr in currencies], dtype=float)
+            steps = np.array([source.prop['steps'] for source in sources], dtype=float)
+            opt_time = np.array([source.prop['opt_time'] for source in sources], dtype=float)
+            targets = np.array([curr.target_value for curr in currencies], dtype=float)
+            passage_targets = np.full(len(currencies), np.inf)
+            for idx, curr in self._pending_targets:
+                passage_targets[idx] = curr.target_value
+            uniforms = compiled.uniforms(limit)
+            draws = np.zeros(len(uniforms), dtype=np.int64)
+            fires = np.zeros(len(sources), dtype=np.int64)
+            stalls = np.zeros(len(sources), dtype=np.int64)
+            starved = np.zeros(len(self._input_conns), dtype=np.int64)
+            trajectory = np.zeros((limit if record is not None else 0, len(currencies)))
+            done = run_chunk(limit, self.stage() < self.num_stages(), self.step_num, storage, p_storage, steps,
+                opt_time, compiled.inp_ptr, compiled.inp_cur, compiled.inp_rate, compiled.out_ptr, compiled.out_cur,
+                compiled.out_rate, compiled.out_chance, compiled.out_stream, uniforms, draws, targets,
+                passage_targets, self._first_passage, fires, stalls, starved, trajectory)
+            if record is not None:
+                step_nums = np.arange(self.step_num + 1, self.step_num + int(done) + 1)
+                recorded = step_nums % record_interval == 0
+                if np.any(recorded):
+                    record(step_nums[recorded], trajectory[:int(done)][recorded])
+            compiled.advance(draws)
+            for curr, value, p_value in zip(currencies, storage.tolist(), p_storage.tolist()):
+                curr.prop['storage'], curr.prop['p_storage'] = value, p_value
+            for source, value in zip(sources, steps.tolist()):
+                source.prop['steps'] = value
+            self._fires = [count + new for count, new in zip(self._fires, fires.tolist())]
+            self._stalls = [count + new for count, new in zip(self._stalls, stalls.tolist())]
+            self._starved = [count + new for count, new in zip(self._starved, starved.tolist())]
+            self.step_num += int(done)
+            self._pending_targets = [(idx, curr) for idx, curr in self._pending_targets if self._first_passage[idx] < 0]
+            self._advance_stages()
+
+
+class StageSolver():
+    """Stage Solver Class
+
+    Solves the max flow problem of a model for the target values of its stages. Only the drain column of the
+    linear program differs between stages, so with highspy installed the program is kept in one HiGHS instance
+    and every stage is re-solved starting from the optimal basis of the previous one. Without highspy each
+    stage is solved from scratch with linprog.
+    """
+
+    MESSAGE = 'Optimization terminated successfully. (HiGHS warm start)'
+
+    def __init__(self, model: FlowModel):
+        self._rates, inc_inp, inc_out = Simulator._build_flow_matrices(model)  # pylint: disable=protected-access
+        self._A = inc_inp - inc_out
+        self._basis = None
+        self._highs = self._build_highs() if highspy is not None else None
+
+    def _build_highs(self):
+        nc, ns = self._A.shape
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', False)
+        highs.addVars(ns, np.zeros(ns), self._rates)
+        rows, cols = np.nonzero(self._A[:, :-1])
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        starts = np.searchsorted(rows, np.arange(nc)).astype(np.int32)
+        highs.addRows(nc, np.zeros(nc), np.full(nc, highspy.kHighsInf), len(rows), starts, cols.astype(np.int32),
+            self._A[rows, cols])
+        return highs
+
+    def _run(self, cost: np.ndarray):
+        highs = self._highs
+        highs.changeColsCost(len(cost), np.arange(len(cost), dtype=np.int32), cost)
+        highs.run()
+        return highs.getModelStatus() == highspy.HighsModelStatus.kOptimal
+
+    def solve(self, targets, throughput: float = None):
+        """Returns the flow info for the given target values of the currencies"""
+        self._A[:, -1] = -np.asarray(targets, dtype=float)
+        if self._highs is None:
+            return Simulator._compute_max_flow(self._A, self._rates, throughput)  # pylint: disable=protected-access
+        nc, ns = self._A.shape
+        highs = self._highs
+        for cid in range(nc):
+            highs.changeCoeff(cid, ns-1, self._A[cid, -1])
+        highs.changeColBounds(ns-1, 0., self._rates[-1])
+        duals = {}
+        if throughput is None:
+            if self._basis is not None:
+                highs.setBasis(self._basis)
+            cost = np.zeros(ns)
+            cost[-1] = -1.
+            if not self._run(cost):
+                return {'status': 4, 'message': highs.modelStatusToString(highs.getModelStatus())}
+            self._basis = highs.getBasis()
+            solution = highs.getSolution()
+            throughput = solution.col_value[-1]
+            duals['shadow_prices'] = np.array(solution.row_dual)
+            duals['reduced_costs'] = -np.minimum(np.array(solution.col_dual)[:-1], 0.)
+        highs.changeColBounds(ns-1, throughput, throughput)
+        if not self._run(np.ones(ns)):
+            return {'status': 4, 'message': highs.modelStatusToString(highs.getModelStatus())}
+        x = np.array(highs.getSolution().col_value)
+        ret = {'status': 0, 'message': self.MESSAGE}
+        ret['steps'] = 1. / x[-1] if x[-1] > 0 else 0.
+        ret['s'] = x[:-1]
+        ret['c'] = np.matmul(self._A, x)
+        ret.update(duals)
+        return ret
+
+
+def _part_throughput(model: FlowModel):
+    solver = GeneralizedFlowSolver(model)
+    if solver.supported:
+        return {'status': 0, 'message': solver.MESSAGE, 'throughput': solver.max_throughput()}
+    rates, inc_inp, inc_out = Simulator._build_flow_matrices(model)  # pylint: disable=protected-access
+    result = Simulator._compute_max_throughput(inc_inp-inc_out, rates)  # pylint: disable=protected-access
+    return {'status': result.status, 'message': result.message, 'throughput': result.x[-1] if result.status == 0 else 0.}
+
+
+def _part_flow(model: FlowModel):
+    solver = GeneralizedFlowSolver(model)
+    if solver.unique:
+        return solver.solve()
+    rates, inc_inp, inc_out = Simulator._build_flow_matrices(model)  # pylint: disable=protected-access
+    return Simulator._compute_max_flow(inc_inp-inc_out, rates)  # pylint: disable=protected-access
+
+
+def _run_part(simulator: Simulator, until: int = None, max_steps: int = None, record_interval: int = 1):
+    storage = {curr_id: [] for curr_id in simulator.currency_properties()}
+    def record(_, rows: np.ndarray):
+        for curr_id, values in zip(storage, rows.T.tolist()):
+            storage[curr_id].extend(values)
+    simulator.run(until, max_steps=max_steps, record=record, record_interval=record_interval)
+    return simulator, storage
+
+
+def simulate_decomposed(model: FlowModel, processes: int = None, seed: int = None, max_steps: int = None,
+                        record_interval: int = 1):
+    """Simulates a model by pruning it and running its independent subgraphs in parallel
+    All subgraphs share the drain rate of the slowest one, so the merged result matches a simulation of the
+    pruned model as a whole. The random streams of all subgraphs derive from the seed like those of a single
+    simulator, so seeded runs are reproducible. The storage is recorded every record_interval steps and after
+    the last step. Use processes=1 to run all subgraphs in the calling process.
+    """
+    reduced = prune_model(model)
+    parts = split_model(reduced)
+    executor = ProcessPoolExecutor(processes) if processes != 1 and len(parts) > 1 else None
+    mapper = executor.map if executor is not None else map
+    try:
+        results = list(mapper(_part_throughput, parts))
+        result = {'status': 0, 'step_num': 0, 'storage': {curr.id: [0] for curr in reduced.currencies}}
+        failed = next((res for res in results if res['status'] != 0), None)
+        if failed is not None:
+            result['status'] = 1
+            result['flow_info'] = {'status': failed['status'], 'message': failed['message']}
+            return result
+        throughput = min((res['throughput'] for res in results), default=1.)
+        count = len(parts)
+        simulators: List[Simulator] = list(mapper(Simulator, parts, [False]*count, [throughput]*count, [seed]*count))
+        result['status'] = max((sim.status for sim in simulators), default=0)
+        result['flow_info'] = _merge_flow_info(reduced, parts, simulators, throughput)
+        if result['status'] != 0:
+            return result
+        runs = list(mapper(_run_part, simulators, [None]*count, [max_steps]*count, [record_interval]*count))
+        step_num = max((sim.step_num for sim, _ in runs), default=0)
+        late = [idx for idx, (sim, _) in enumerate(runs) if sim.step_num < step_num]
+        extensions = mapper(_run_part, [runs[idx][0] for idx in late], [step_num]*len(late), [None]*len(late),
+            [record_interval]*len(late))
+        for idx, (sim, storage) in zip(late, extensions):
+            runs[idx] = (sim, {curr_id: runs[idx][1][curr_id] + values for curr_id, values in storage.items()})
+        for sim, storage in runs:
+            final = {curr_id: prop['storage'] for curr_id, prop in sim.currency_properties().items()}
+            for curr_id, values in storage.items():
+                result['storage'][curr_id].extend(values + ([final[curr_id]] if step_num % record_interval else []))
+        result['step_num'] = step_num
+        return result
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _merge_flow_info(model: FlowModel, parts: List[FlowModel], simulators: List[Simulator], throughput: float):
+    flow_infos = [sim._flow_info for sim in simulators]  # pylint: disable=protected-access
+    info = {'status': max((flow['status'] for flow in flow_infos), default=0)}
+    info['message'] = next((flow['message'] for flow in flow_infos if flow['status'] != 0),
+        flow_infos[0]['message'] if flow_infos else '')
+    if info['status'] != 0:
+        return info
+    source_flow, currency_flow = {}, {}
+    for part, flow in zip(parts, flow_infos):
+        source_flow.update(zip((source.id for source in part.sources), flow['s']))
+        currency_flow.update(zip((currency.id for currency in part.currencies), flow['c']))
+    info['steps'] = 1. / throughput if throughput > 0 else 0.
+    info['s'] = np.array([source_flow[source.id] for source in model.sources])
+    info['c'] = np.array([currency_flow[currency.id] for currency in model.currencies])
+    return info
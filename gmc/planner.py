@@ -0,0 +1,344 @@
+"""GMC Execution Planner
+
+Chooses how a model is simulated: the step engine, the format of the incidence matrices of the linear program,
+how the trajectory is recorded and whether independent subgraphs run in parallel. The choice is based on cheap
+model statistics and rough cost estimates, it can be inspected with ExecutionPlan.explain() and overridden.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from typing import List
+import numpy as np
+
+from gmc import jit_kernel
+from gmc.aggregation import collapse_groups
+from gmc.flow_model import FlowModel
+from gmc.generalized_flow import GeneralizedFlowSolver
+from gmc.mc_simulator import Simulator, _part_throughput, simulate_decomposed
+from gmc.reduction import prune_model, split_model
+from gmc.trajectory import NpyTrajectorySink
+
+
+ENGINES = ('python', 'compiled', 'fixed_point', 'decomposed')
+MATRICES = ('dense', 'sparse')
+RECORDERS = ('none', 'memory', 'npy')
+
+
+def model_statistics(model: FlowModel) -> dict:
+    """Returns size, density, time step spread and target magnitudes of the pruned model"""
+    pruned = prune_model(model)
+    currencies, sources, connections = pruned.currencies, pruned.sources, pruned.connections
+    time_steps = [source.time_step for source in sources if source.time_step > 0] or [1.]
+    stage_targets = pruned.stage_targets()
+    return {
+        'currencies': len(currencies),
+        'sources': len(sources),
+        'connections': len(connections),
+        'random_connections': sum(1 for conn in connections if conn.chance < 1),
+        'density': len(connections) / max(len(currencies) * len(sources), 1),
+        'min_time_step': min(time_steps),
+        'max_time_step': max(time_steps),
+        'time_step_spread': max(time_steps) / min(time_steps),
+        'max_target': max((value for targets in stage_targets for value in targets.values()), default=0.),
+        'stages': len(stage_targets),
+        'schedule_breaks': len(pruned.schedule_breaks()),
+        'parts': len(split_model(pruned)),
+        'generalized_flow': GeneralizedFlowSolver(pruned).supported,
+        'estimated_steps': _estimate_steps(pruned, stage_targets)
+    }
+
+
+def _estimate_steps(model: FlowModel, stage_targets: List[dict]) -> float:
+    """Returns the throughput time of the linear program summed over all stages, or a lower bound of the steps
+    that ignores inputs of the producing sources for models whose dense program is too large to solve here
+    """
+    supported = GeneralizedFlowSolver(model).supported
+    if supported or len(model.currencies) * (len(model.sources) + 1) < ExecutionPlanner.SPARSE_MIN_CELLS:
+        model = model.copy()
+        steps = 0.
+        for targets in stage_targets:
+            for currency in model.currencies:
+                currency.target_value = targets[currency.id]
+            result = _part_throughput(model)
+            if result['status'] != 0 or result['throughput'] <= 0:
+                return np.inf
+            steps += 1. / result['throughput']
+        return steps
+    production = {currency.id: sum(conn.mean_rate() / max(conn.source.time_step, 1.) for conn in currency.inputs)
+        for currency in model.currencies}
+    steps, previous = 0., {currency.id: 0. for currency in model.currencies}
+    for targets in stage_targets:
+        needed = [max(value - previous[curr_id], 0.) / production[curr_id] if production[curr_id] > 0 else np.inf
+            for curr_id, value in targets.items() if value > 0]
+        steps += max(needed, default=0.)
+        previous = {curr_id: max(value, previous[curr_id]) for curr_id, value in targets.items()}
+    return steps
+
+
+class ExecutionPlan():
+    """Execution Plan Class
+
+    The chosen strategy with its memory and run time estimates. Estimates are rough and meant for comparing
+    strategies and refusing runs that clearly do not fit, not for predicting exact numbers.
+    """
+
+    def __init__(self, model: FlowModel, statistics: dict, memory_budget: float):
+        self.model = model
+        self.statistics = statistics
+        self.memory_budget = memory_budget
+        self.engine = 'python'
+        self.matrix = 'dense'
+        self.recorder = 'memory'
+        self.record_interval = 1
+        self.filename = None
+        self.processes = 1
+        self.max_steps = None
+        self.fixed_point = 10**6
+        self.aggregated = 0
+        self.reasons = {}
+        self.memory = {}
+        self.time = {}
+        self.overrides = set()
+
+    def memory_total(self) -> float:
+        """Returns the estimated peak memory in bytes"""
+        return sum(self.memory.values())
+
+    def time_total(self) -> float:
+        """Returns the estimated run time in seconds"""
+        return sum(self.time.values())
+
+    def feasible(self) -> bool:
+        """Returns whether the estimated memory fits into the budget"""
+        return self.memory_budget is None or self.memory_total() <= self.memory_budget
+
+    def explain(self) -> str:
+        """Returns a readable description of the plan and its estimates"""
+        stats = self.statistics
+        def choice(key: str, value: str) -> str:
+            return f"{value} ({'override' if key in self.overrides else self.reasons.get(key, '')})"
+        recorder = self.recorder if self.recorder == 'none' else f"{self.recorder}, every {self.record_interval} steps"
+        lines = [
+            f"Model: {stats['currencies']} currencies, {stats['sources']} sources, {stats['connections']} connections "
+            f"(density {stats['density']:.1%}), time steps {stats['min_time_step']:g} to {stats['max_time_step']:g}, "
+            f"max target {stats['max_target']:g}, {stats['stages']} stages, {stats['parts']} independent parts",
+            f"Estimated steps: {stats['estimated_steps']:.0f}",
+            f"Engine: {choice('engine', self.engine)}",
+            f"Matrix: {choice('matrix', self.matrix)}",
+            f"Recorder: {choice('recorder', recorder)}",
+            f"Processes: {self.processes}",
+            f"Aggregated groups: {self.aggregated}",
+            "Memory: " + _format_bytes(self.memory_total()) + " (" +
+            ', '.join(f"{key} {_format_bytes(value)}" for key, value in self.memory.items()) + ")" +
+            (f" of {_format_bytes(self.memory_budget)} budget" if self.memory_budget is not None else ''),
+            f"Time: ~{self.time_total():.3g} s (" + ', '.join(f"{key} {value:.3g} s" for key, value in self.time.items()) + ")"
+        ]
+        if not self.feasible():
+            lines.append('Refused: the estimated memory exceeds the budget.')
+        return '\n'.join(lines)
+
+    def simulator(self) -> Simulator:
+        """Returns a simulator configured for the plan"""
+        return Simulator(self.model, reduce=True, jit=self.engine == 'compiled', sparse=self.matrix == 'sparse',
+            fixed_point=self.fixed_point if self.engine == 'fixed_point' else None)
+
+    def run(self, seed: int = None) -> dict:
+        """Runs the simulation with the plan and returns status, step number and recorded storage
+        The storage maps currency ids to one value per recorded step; with the npy recorder it is written to
+        the file instead. Raises a RuntimeError if the plan does not fit into the memory budget.
+        """
+        if not self.feasible():
+            raise RuntimeError(f"Estimated memory {_format_bytes(self.memory_total())} exceeds the budget of "
+                               f"{_format_bytes(self.memory_budget)}!")
+        if self.engine == 'decomposed':
+            return simulate_decomposed(self.model, self.processes, seed, self.max_steps, self.record_interval)
+        simulator = self.simulator()
+        simulator.reset(seed)
+        result = {'status': simulator.status, 'step_num': 0, 'storage': {}}
+        if simulator.status != 0:
+            result['flow_info'] = simulator.flow_info()
+            return result
+        sink = NpyTrajectorySink(self.filename, simulator) if self.recorder == 'npy' else None
+        rows = [simulator._storage_row().reshape((1, -1))]  # pylint: disable=protected-access
+        recorded = [0]
+        def record(step_nums: np.ndarray, storage: np.ndarray):
+            if sink is not None:
+                sink.record_rows(step_nums, storage)
+            else:
+                rows.append(storage.copy())
+            recorded[0] = int(step_nums[-1])
+        try:
+            simulator.run(max_steps=self.max_steps, record=record if self.recorder != 'none' else None,
+                record_interval=self.record_interval)
+            if self.recorder != 'none' and recorded[0] != simulator.step_num:
+                record(np.array([simulator.step_num]), simulator._storage_row().reshape((1, -1)))  # pylint: disable=protected-access
+        finally:
+            if sink is not None:
+                sink.close()
+        storage = {}
+        if self.recorder == 'memory':
+            trajectory = np.vstack(rows)
+            storage = {curr_id: trajectory[:, idx].tolist() for idx, curr_id in enumerate(simulator.currency_properties())}
+        result['status'] = simulator.status
+        result['step_num'] = simulator.step_num
+        result['flow_info'] = simulator.flow_info()
+        result['storage'] = storage
+        result['simulator'] = simulator
+        return result
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f"{value:.3g} {unit}"
+        value /= 1024
+    return f"{value:.3g} GB"
+
+
+class ExecutionPlanner():
+    """Execution Planner Class
+
+    Inspects a model and picks an execution plan. Keyword overrides (engine, matrix, recorder, record_interval,
+    filename, processes, max_steps) replace the automatic choice; the estimates are computed for the final plan.
+    With aggregate=True collapsed groups that form linear chains are replaced by single sources first, so the
+    plan, the linear program and the step loop work on the smaller graph.
+    """
+
+    # seconds per step and element or per step, measured with plan.run on chains of 3 to 1000 sources; the
+    # compiled costs are scaled from the Python step and include loading the cached kernel
+    PYTHON_STEP_COST = 1.5e-7
+    PYTHON_BASE_COST = 2e-6
+    COMPILED_STEP_COST = 5e-9
+    COMPILED_BASE_COST = 5e-3
+    FIXED_POINT_STEP_COST = 5.5e-9
+    FIXED_POINT_BASE_COST = 1.7e-5
+    RECORD_COST = 2e-7
+    SETUP_COST = 2e-5
+    DENSE_SOLVE_COST = 1e-7
+    SPARSE_SOLVE_COST = 2e-6
+    SOLVER_BYTES = 200
+    COMPONENT_BYTES = 600
+    MEMORY_RECORD_BYTES = 32
+    RECORDER_SHARE = 0.5
+    SPARSE_DENSITY = 0.05
+    SPARSE_MIN_CELLS = 100000
+    FIXED_POINT_MIN_SOURCES = 200
+    PARALLEL_MIN_TIME = 2.
+
+    def __init__(self, memory_budget: float = 2 * 1024**3, processes: int = None):
+        self.memory_budget = memory_budget
+        self.processes = processes or os.cpu_count() or 1
+
+    def plan(self, model: FlowModel, **overrides) -> ExecutionPlan:
+        """Returns the execution plan for a model"""
+        unknown = set(overrides) - {'engine', 'matrix', 'recorder', 'record_interval', 'filename', 'processes', 'max_steps',
+            'aggregate'}
+        if unknown:
+            raise ValueError(f"Unknown plan options: {', '.join(sorted(unknown))}!")
+        aggregated = 0
+        if overrides.get('aggregate') and any(group.collapsed for group in model.groups):
+            group_ids = {group.id for group in model.groups}
+            model = collapse_groups(model)
+            aggregated = sum(1 for source in model.sources if source.id in group_ids)
+        stats = model_statistics(model)
+        plan = ExecutionPlan(model, stats, self.memory_budget)
+        plan.aggregated = aggregated
+        plan.overrides = {key for key, value in overrides.items() if value is not None}
+        plan.max_steps = overrides.get('max_steps')
+        steps = stats['estimated_steps'] if np.isfinite(stats['estimated_steps']) else 0.
+        if plan.max_steps is not None:
+            steps = min(steps, plan.max_steps) if steps > 0 else plan.max_steps
+        elements = stats['sources'] + 2 * stats['connections']
+        cells = stats['currencies'] * (stats['sources'] + 1)
+
+        plan.matrix, plan.reasons['matrix'] = self._choose_matrix(stats, cells)
+        plan.engine, plan.reasons['engine'] = self._choose_engine(stats, steps, elements)
+        for key in ('engine', 'matrix'):
+            if overrides.get(key) is not None:
+                setattr(plan, key, overrides[key])
+        plan.processes = min(self.processes, stats['parts']) if plan.engine == 'decomposed' else 1
+        if overrides.get('processes') is not None:
+            plan.processes = overrides['processes']
+        if plan.engine not in ENGINES or plan.matrix not in MATRICES:
+            raise ValueError(f"Unknown engine '{plan.engine}' or matrix '{plan.matrix}'!")
+        if plan.engine == 'compiled' and jit_kernel.run_chunk is None:
+            raise ValueError('The compiled engine requires Numba!')
+
+        self._estimate(plan, steps, elements, cells)
+        if plan.engine == 'decomposed':
+            _, plan.record_interval, reason = self._choose_recorder(plan, steps, {'record_interval': overrides.get('record_interval')})
+            plan.recorder, plan.reasons['recorder'] = 'memory', f"the decomposed run records in memory, {reason}"
+        else:
+            plan.recorder, plan.record_interval, plan.reasons['recorder'] = self._choose_recorder(plan, steps, overrides)
+        if plan.recorder not in RECORDERS:
+            raise ValueError(f"Unknown recorder '{plan.recorder}'!")
+        plan.filename = overrides.get('filename')
+        if plan.recorder == 'npy' and plan.filename is None:
+            raise ValueError('The npy recorder requires a filename!')
+
+        rows = steps / plan.record_interval if plan.recorder != 'none' else 0.
+        plan.memory['trajectory'] = rows * stats['currencies'] * self.MEMORY_RECORD_BYTES if plan.recorder == 'memory' else 0.
+        plan.time['recording'] = rows * stats['currencies'] * self.RECORD_COST
+        return plan
+
+    def _choose_matrix(self, stats: dict, cells: int):
+        if stats['generalized_flow']:
+            return 'dense', 'solved without matrices by the generalized network flow'
+        if stats['stages'] > 1:
+            return 'dense', 'the stage solver keeps dense matrices'
+        if stats['density'] < self.SPARSE_DENSITY and cells >= self.SPARSE_MIN_CELLS:
+            return 'sparse', f"density below {self.SPARSE_DENSITY:.0%} with {cells} matrix cells"
+        return 'dense', 'small or dense model'
+
+    def _choose_engine(self, stats: dict, steps: float, elements: int):
+        python_time = steps * (self.PYTHON_BASE_COST + elements * self.PYTHON_STEP_COST)
+        trajectory = steps * stats['currencies'] * self.MEMORY_RECORD_BYTES
+        fits = self.memory_budget is None or trajectory <= self.memory_budget * self.RECORDER_SHARE
+        if (stats['parts'] > 1 and self.processes > 1 and stats['stages'] == 1 and stats['schedule_breaks'] == 0
+                and fits and python_time / min(self.processes, stats['parts']) > self.PARALLEL_MIN_TIME):
+            return 'decomposed', f"{stats['parts']} independent parts run in parallel"
+        if jit_kernel.run_chunk is not None and python_time > self.COMPILED_BASE_COST:
+            return 'compiled', 'Numba is installed and the run outweighs loading the kernel'
+        if stats['sources'] >= self.FIXED_POINT_MIN_SOURCES and stats['max_target'] * 10**6 < 2**62:
+            return 'fixed_point', f"vectorized steps pay off from {self.FIXED_POINT_MIN_SOURCES} sources"
+        return 'python', 'small model or short run'
+
+    def _choose_recorder(self, plan: ExecutionPlan, steps: float, overrides: dict):
+        recorder = overrides.get('recorder') or ('npy' if overrides.get('filename') else 'memory')
+        interval = overrides.get('record_interval')
+        if recorder != 'memory' or interval is not None or self.memory_budget is None:
+            return recorder, interval or 1, 'requested'
+        full = steps * plan.statistics['currencies'] * self.MEMORY_RECORD_BYTES
+        share = max(self.memory_budget - plan.memory_total(), 0.) * self.RECORDER_SHARE
+        if share <= 0:
+            return 'none', 1, 'no memory left for a trajectory'
+        if full <= share:
+            return 'memory', 1, 'the full trajectory fits into the budget'
+        return 'memory', math.ceil(full / share), 'decimated to fit the full trajectory into the budget'
+
+    def _estimate(self, plan: ExecutionPlan, steps: float, elements: int, cells: int):
+        stats = plan.statistics
+        nonzeros = 2 * stats['connections'] + stats['currencies']
+        if stats['generalized_flow']:
+            plan.memory['matrices'] = 0.
+            plan.time['solve'] = 1e-5 * elements
+        elif plan.matrix == 'sparse':
+            plan.memory['matrices'] = 3 * 12. * nonzeros
+            plan.time['solve'] = self.SPARSE_SOLVE_COST * nonzeros * stats['stages']
+        else:
+            plan.memory['matrices'] = 3 * 8. * cells
+            plan.time['solve'] = self.DENSE_SOLVE_COST * cells * stats['stages']
+        plan.memory['solver'] = 0. if stats['generalized_flow'] else self.SOLVER_BYTES * nonzeros
+        plan.time['setup'] = self.SETUP_COST * (stats['currencies'] + stats['sources'] + stats['connections'])
+        plan.memory['state'] = self.COMPONENT_BYTES * (stats['currencies'] + stats['sources'] + stats['connections'])
+        per_step = {
+            'python': self.PYTHON_BASE_COST + self.PYTHON_STEP_COST * elements,
+            'compiled': self.COMPILED_STEP_COST * elements,
+            'fixed_point': self.FIXED_POINT_BASE_COST + self.FIXED_POINT_STEP_COST * elements,
+            'decomposed': (self.PYTHON_BASE_COST + self.PYTHON_STEP_COST * elements) / max(plan.processes, 1)
+        }[plan.engine]
+        plan.time['simulation'] = steps * per_step + (self.COMPILED_BASE_COST if plan.engine == 'compiled' else 0.)
+        if plan.engine == 'decomposed':
+            plan.memory['state'] *= max(plan.processes, 1)
@@ -0,0 +1,105 @@
+"""GMC Random Streams"""
+
+from __future__ import annotations
+
+import zlib
+from typing import List
+import numpy as np
+
+from gmc.components import Connection
+
+
+class RandomStream():
+    """Random Stream Class
+
+    Buffered uniform random numbers for a single connection. Streams are derived from a common seed and the key
+    of the connection from stream_keys, so two model variants seeded alike draw the same numbers for the same
+    connection (common random numbers) regardless of how often other connections fire. Antithetic streams
+    return 1-u.
+    """
+
+    BLOCK_SIZE = 1024
+
+    def __init__(self, seed_sequence: np.random.SeedSequence, antithetic: bool = False):
+        self._generator = np.random.default_rng(seed_sequence)
+        self._antithetic = antithetic
+        self._block_state = None
+        self._buffer = None
+        self._pos = 0
+        self._fill()
+
+    def _fill(self):
+        self._block_state = self._generator.bit_generator.state
+        self._buffer = self._generator.random(self.BLOCK_SIZE)
+        if self._antithetic:
+            self._buffer = 1. - self._buffer
+        self._pos = 0
+
+    def next(self) -> float:
+        """Returns the next uniform random number"""
+        if self._pos == self.BLOCK_SIZE:
+            self._fill()
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+    def peek(self, count: int) -> np.ndarray:
+        """Returns the next count uniform random numbers without consuming them"""
+        values = [self._buffer[self._pos:]]
+        available = len(values[0])
+        state = self._generator.bit_generator.state
+        while available < count:
+            block = self._generator.random(self.BLOCK_SIZE)
+            values.append(1. - block if self._antithetic else block)
+            available += self.BLOCK_SIZE
+        self._generator.bit_generator.state = state
+        return np.concatenate(values)[:count]
+
+    def advance(self, count: int):
+        """Consumes count random numbers"""
+        pos = self._pos + count
+        while pos > self.BLOCK_SIZE:
+            pos -= self.BLOCK_SIZE
+            self._fill()
+        self._pos = pos
+
+    def state(self) -> dict:
+        """Returns the stream position"""
+        return {'state': self._block_state, 'pos': self._pos, 'antithetic': self._antithetic}
+
+    def set_state(self, state: dict):
+        """Moves the stream to a position returned by state()"""
+        self._antithetic = state['antithetic']
+        self._generator.bit_generator.state = state['state']
+        self._fill()
+        self._pos = state['pos']
+
+
+def stream_keys(connections: List[Connection]) -> dict:
+    """Returns a distinct stable key for every connection
+    The key is the checksum of the source and target ids and of the position of the connection among parallel
+    connections with the same ids, so it does not change when unrelated connections are added or removed. A
+    checksum that is already taken is incremented until it is free.
+    """
+    keys = {}
+    taken = set()
+    parallel = {}
+    for conn in connections:
+        pair = (conn.source.id, conn.target.id)
+        parallel[pair] = parallel.get(pair, -1) + 1
+        key = zlib.crc32(f"{pair[0]}->{pair[1]}#{parallel[pair]}".encode('utf-8'))
+        while key in taken:
+            key = (key + 1) % 2**32
+        taken.add(key)
+        keys[conn] = key
+    return keys
+
+
+def connection_streams(connections: List[Connection], seed=None, antithetic: bool = False) -> dict:
+    """Returns a random stream for every connection with a chance below one, now or in its schedule"""
+    base = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    keys = stream_keys(connections)
+    return {
+        conn: RandomStream(np.random.SeedSequence(base.entropy, spawn_key=base.spawn_key + (keys[conn],)), antithetic)
+        for conn in connections if min([conn.chance] + [value for _, value in conn.schedules.get('chance', [])]) < 1
+    }
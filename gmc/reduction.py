@@ -0,0 +1,65 @@
+"""GMC Model Reduction"""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import List
+import networkx as nx
+
+from gmc.flow_model import FlowModel
+
+
+def live_components(model: FlowModel) -> set:
+    """Returns ids of all components that can ever hold or produce currency when starting from empty storage"""
+    missing = {source.id: len({conn.source.id for conn in source.inputs}) for source in model.sources}
+    consumers = {currency.id: list(dict.fromkeys(conn.target for conn in currency.connections)) for currency in model.currencies}
+    queue = deque(source for source in model.sources if missing[source.id] == 0)
+    live = set()
+    while queue:
+        source = queue.popleft()
+        live.add(source.id)
+        for conn in source.connections:
+            if conn.target.id in live:
+                continue
+            live.add(conn.target.id)
+            for consumer in consumers[conn.target.id]:
+                missing[consumer.id] -= 1
+                if missing[consumer.id] == 0:
+                    queue.append(consumer)
+    return live
+
+
+def prune_model(model: FlowModel) -> FlowModel:
+    """Returns a copy of the model without components that cannot contribute to any target value
+    Currencies with a positive target value in any stage are always kept such that unreachable targets are
+    still reported.
+    """
+    live = live_components(model)
+    targeted = {key for targets in model.stage_targets() for key, value in targets.items() if value > 0}
+    graph = nx.DiGraph()
+    graph.add_node('drain')
+    graph.add_nodes_from(live)
+    for currency in model.currencies:
+        if currency.id in targeted and currency.id in live:
+            graph.add_edge(currency.id, 'drain')
+    for connection in model.connections:
+        if connection.source.id in live and connection.target.id in live:
+            graph.add_edge(connection.source.id, connection.target.id)
+    keep = nx.ancestors(graph, 'drain')
+    keep.update(targeted)
+    return model.submodel([comp for comp in model.get_components() if comp.id in keep])
+
+
+def split_model(model: FlowModel) -> List[FlowModel]:
+    """Splits the model into its weakly connected components"""
+    graph = nx.Graph()
+    graph.add_nodes_from(comp.id for comp in model.get_components())
+    graph.add_edges_from((conn.source.id, conn.target.id) for conn in model.connections)
+    part_lookup = {}
+    members = []
+    for idx, nodes in enumerate(nx.connected_components(graph)):
+        part_lookup.update((node, idx) for node in nodes)
+        members.append([])
+    for comp in model.get_components():
+        members[part_lookup[comp.id]].append(comp)
+    return [model.submodel(components) for components in members]
@@ -0,0 +1,235 @@
+"""GMC Regression Runs
+
+Re-simulates a new version of a model file while reusing the stored results of its previous version. The
+pruned model is split into independent subgraphs as in simulate_decomposed. Subgraphs are identified by a hash
+of their components, connections and stage targets, so only subgraphs touched by a change are solved again.
+All subgraphs run at the drain rate of the slowest one, so unchanged subgraphs are only re-simulated when a
+change moves that drain rate. Run it with
+
+    python -m gmc.regression model.yaml --results model.results.json
+
+which compares against the results file if it exists, prints the structural diff and the changed metrics as
+json and writes the new results to the file.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import numpy as np
+import yaml
+
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator, _part_throughput
+from gmc.reduction import prune_model, split_model
+
+
+MAX_STEPS = 1000000
+
+
+def _strip(data: dict) -> dict:
+    return {key: value for key, value in data.items() if key != 'pos'}
+
+
+def model_diff(old: dict, new: dict) -> dict:
+    """Returns the components and connections that were added, removed or changed between two model dictionaries
+    Components are matched by id and connections by their source and target ids and their index among the
+    parallel connections between the same components, e.g. 'source -> target #1'; positions are ignored.
+    """
+    def index(model_dict: dict) -> tuple:
+        components = {data['_id']: _strip(data) for data in model_dict.get('currencies', []) + model_dict.get('sources', [])}
+        connections, parallel = {}, {}
+        for data in model_dict.get('connections', []):
+            pair = f"{data['source']} -> {data['target']}"
+            parallel[pair] = parallel.get(pair, -1) + 1
+            connections[f"{pair} #{parallel[pair]}"] = data
+        return components, connections
+    diff = {}
+    for kind, old_items, new_items in zip(('components', 'connections'), index(old), index(new)):
+        diff[kind] = {
+            'added': sorted(new_items.keys() - old_items.keys()),
+            'removed': sorted(old_items.keys() - new_items.keys()),
+            'changed': sorted(key for key in old_items.keys() & new_items.keys() if old_items[key] != new_items[key])
+        }
+    diff['stages'] = old.get('stages', []) != new.get('stages', [])
+    diff['groups'] = old.get('groups', []) != new.get('groups', [])
+    return diff
+
+
+def touched_components(diff: dict) -> set:
+    """Returns the ids of all components affected by a model diff"""
+    touched = {key for keys in diff['components'].values() for key in keys}
+    for keys in diff['connections'].values():
+        for key in keys:
+            touched.update(key.rsplit(' #', 1)[0].split(' -> '))
+    return touched
+
+
+def part_key(part: FlowModel, seed: int, max_steps: int) -> str:
+    """Returns a hash of everything that influences the simulation of a subgraph"""
+    data = part.to_dict()
+    content = {
+        'currencies': sorted((_strip(item) for item in data['currencies']), key=lambda item: item['_id']),
+        'sources': sorted((_strip(item) for item in data['sources']), key=lambda item: item['_id']),
+        'connections': sorted(data['connections'], key=lambda item: (item['source'], item['target'])),
+        'stages': data['stages'],
+        'groups': sorted(data['groups'], key=lambda item: item['_id']),
+        'seed': seed,
+        'max_steps': max_steps
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _simulate_part(part: FlowModel, throughput: float, seed: int, max_steps: int) -> dict:
+    """Simulates a subgraph at the given drain rate and returns its metrics and their labels"""
+    simulator = Simulator(part, throughput=throughput, seed=seed)
+    if simulator.status == 0:
+        simulator.run(max_steps=max_steps)
+    summary = simulator.summary()
+    storage = simulator.currency_properties()
+    metrics, labels = {}, {}
+    def add(key: str, label: str, value):
+        metrics[key] = value
+        labels[key] = label
+    for curr_id, entry in summary['currencies'].items():
+        add(f"{curr_id}.storage", f"{entry['name']} storage", float(storage[curr_id]['storage']))
+        if entry['target'] > 0:
+            add(f"{curr_id}.first_passage", f"{entry['name']} first passage", entry['first_passage'])
+    for source_id, entry in summary['sources'].items():
+        add(f"{source_id}.fires", f"{entry['name']} fires", entry['fires'])
+        add(f"{source_id}.utilization", f"{entry['name']} utilization", float(entry['utilization']))
+    return {'status': simulator.status, 'steps': simulator.step_num, 'metrics': metrics, 'labels': labels}
+
+
+def compare_metrics(old: dict, new: dict, labels: dict, tolerance: float = 0.) -> List[dict]:
+    """Returns the metrics that differ by more than the tolerance, were added or were removed"""
+    changes = []
+    for key in sorted(old.keys() | new.keys()):
+        before, after = old.get(key), new.get(key)
+        if before is None or after is None:
+            if before is not after:
+                changes.append({'metric': key, 'label': labels.get(key, key), 'old': before, 'new': after})
+            continue
+        if abs(after - before) > tolerance:
+            changes.append({'metric': key, 'label': labels.get(key, key), 'old': before, 'new': after,
+                            'delta': after - before, 'relative': (after - before) / abs(before) if before != 0 else None})
+    return changes
+
+
+class RegressionRunner():
+    """Regression Runner Class
+
+    Simulates all subgraphs of a model with a fixed seed and keeps their results in a json serializable
+    dictionary. Given the results of a previous run, subgraphs with an unchanged hash reuse their drain rate and,
+    if the common drain rate did not move, their simulation results.
+    """
+
+    def __init__(self, seed: int = 0, max_steps: int = MAX_STEPS, processes: int = 1, tolerance: float = 0.):
+        self.seed = seed
+        self.max_steps = max_steps
+        self.processes = processes
+        self.tolerance = tolerance
+
+    def run(self, model: FlowModel, previous: dict = None, previous_model: dict = None) -> dict:
+        """Returns the results of the model together with a report of the changes against previous results
+        The diff is computed against the previous model dictionary, which defaults to the one stored with the
+        previous results.
+        """
+        previous = previous if previous is not None and previous.get('seed') == self.seed else None
+        cached = {part['key']: part for part in previous['parts']} if previous is not None else {}
+        parts = split_model(prune_model(model))
+        keys = [part_key(part, self.seed, self.max_steps) for part in parts]
+        executor = ProcessPoolExecutor(self.processes) if self.processes != 1 and len(parts) > 1 else None
+        mapper = executor.map if executor is not None else map
+        try:
+            unsolved = [idx for idx, key in enumerate(keys) if key not in cached]
+            solved = dict(zip(unsolved, mapper(_part_throughput, [parts[idx] for idx in unsolved])))
+            entries = [solved[idx] if idx in solved else {key: cached[keys[idx]][key] for key in ('status', 'message', 'throughput')}
+                for idx in range(len(parts))]
+            results = {'seed': self.seed, 'max_steps': self.max_steps, 'model': model.to_dict(), 'parts': []}
+            failed = next((entry for entry in entries if entry['status'] != 0), None)
+            throughput = min((entry['throughput'] for entry in entries), default=1.)
+            if failed is not None:
+                results.update(status=1, message=failed['message'], throughput=None, steps=None, metrics={}, labels={})
+                return self._report(results, previous, previous_model, keys, [], solved.keys())
+            reused = [idx for idx, key in enumerate(keys) if key in cached and cached[key].get('sim_throughput') is not None
+                and np.isclose(cached[key]['sim_throughput'], throughput, rtol=1e-12, atol=0.)]
+            pending = [idx for idx in range(len(parts)) if idx not in reused]
+            simulated = dict(zip(pending, mapper(_simulate_part, [parts[idx] for idx in pending], [throughput]*len(pending),
+                [self.seed]*len(pending), [self.max_steps]*len(pending))))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        metrics, labels = {}, {}
+        status, steps = 0, 0
+        for idx, part in enumerate(parts):
+            run = simulated[idx] if idx in simulated else cached[keys[idx]]['run']
+            results['parts'].append({'key': keys[idx], 'components': [comp.id for comp in part.get_components()],
+                'status': entries[idx]['status'], 'message': entries[idx]['message'],
+                'throughput': float(entries[idx]['throughput']), 'sim_throughput': float(throughput), 'run': run})
+            metrics.update(run['metrics'])
+            labels.update(run['labels'])
+            status = max(status, run['status'])
+            steps = max(steps, run['steps'])
+        metrics['steps'], labels['steps'] = steps, 'steps to targets'
+        metrics['flow_steps'], labels['flow_steps'] = 1. / throughput if throughput > 0 else 0., 'optimal steps to targets'
+        results.update(status=status, message='', throughput=float(throughput), steps=steps, metrics=metrics, labels=labels)
+        return self._report(results, previous, previous_model, keys, reused, solved.keys())
+
+    def _report(self, results: dict, previous: dict, previous_model: dict, keys: List[str], reused: List[int],
+                solved=()) -> dict:
+        if previous_model is None and previous is not None:
+            previous_model = previous['model']
+        diff = model_diff(previous_model, results['model']) if previous_model is not None else None
+        touched = touched_components(diff) if diff is not None else set()
+        results['report'] = {
+            'diff': diff,
+            'parts': len(keys),
+            'affected': [idx for idx, part in enumerate(results['parts']) if touched & set(part['components'])],
+            'solved': len(solved),
+            'simulated': len(keys) - len(reused),
+            'reused': len(reused),
+            'changes': compare_metrics(previous['metrics'], results['metrics'], {**previous['labels'], **results['labels']},
+                self.tolerance) if previous is not None else None
+        }
+        return results
+
+
+def main():
+    """Runs a regression of a model file against its stored results"""
+    parser = argparse.ArgumentParser(description='GachaMC incremental regression run')
+    parser.add_argument('model', help='model yaml file')
+    parser.add_argument('--results', default=None, help='results json file, defaults to <model>.results.json')
+    parser.add_argument('--previous', default=None, help='previous model yaml file to diff against')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the simulations')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='maximum number of simulated steps')
+    parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--tolerance', type=float, default=0., help='absolute tolerance for changed metrics')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 if any metric changed')
+    args = parser.parse_args()
+    filename = args.results or os.path.splitext(args.model)[0] + '.results.json'
+    previous, previous_model = None, None
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as file:
+            previous = json.load(file)
+    if args.previous is not None:
+        with open(args.previous, 'r', encoding='utf-8') as file:
+            previous_model = yaml.load(file, yaml.FullLoader)
+    model = FlowModel()
+    model.load_from_file(args.model)
+    runner = RegressionRunner(args.seed, args.max_steps, args.processes, args.tolerance)
+    results = runner.run(model, previous, previous_model)
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(results, file)
+    print(json.dumps(results['report'], indent=2))
+    if args.check and results['report']['changes']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""GMC Adaptive Replication"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import numpy as np
+from scipy.stats import t as student_t
+
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+
+
+def _run_replicas(simulators: List[Simulator], seeds: List[np.random.SeedSequence], antithetic: bool = False):
+    """Returns time to target and final storage of every simulator for one replica per seed
+    All simulators of a replica share the seed. With antithetic replicas each sample is the average of a run
+    and its antithetic counterpart.
+    """
+    samples = []
+    for seed in seeds:
+        runs = []
+        for flipped in ([False, True] if antithetic else [False]):
+            row = []
+            for simulator in simulators:
+                simulator.reset(seed, flipped)
+                simulator.run()
+                row.append(simulator.step_num)
+                row.extend(prop['storage'] for prop in simulator.currency_properties().values())
+            runs.append(row)
+        samples.append(np.mean(runs, axis=0))
+    return samples
+
+
+def confidence_interval(samples: np.ndarray, confidence: float = 0.95):
+    """Returns mean and half width of the student t confidence interval along the first axis"""
+    num = len(samples)
+    mean = samples.mean(axis=0)
+    if num < 2:
+        return mean, np.full(mean.shape, np.inf)
+    scale = student_t.ppf((1 + confidence) / 2, num - 1) / np.sqrt(num)
+    return mean, scale * samples.std(axis=0, ddof=1)
+
+
+class ReplicationRunner():
+    """Adaptive Replication Runner Class
+
+    Runs replicas of a simulation in batches with independent random streams until the confidence interval
+    of the time to target, and optionally of the final currency storage, is narrower than the tolerance.
+    A relative tolerance is measured against the magnitude of the mean.
+    """
+
+    def __init__(self, model: FlowModel, tolerance: float = 0.01, relative: bool = True, confidence: float = 0.95,
+                 include_storage: bool = False, antithetic: bool = False, batch_size: int = 16,
+                 max_replicas: int = 10000, seed: int = None, processes: int = 1):
+        self.tolerance = tolerance
+        self.relative = relative
+        self.confidence = confidence
+        self.include_storage = include_storage
+        self.antithetic = antithetic
+        self.batch_size = batch_size
+        self.max_replicas = max_replicas
+        self.processes = processes
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self._simulators = [Simulator(model, reduce=True)]
+
+    def _statistics(self, samples: np.ndarray) -> np.ndarray:
+        """Returns the sample columns the stopping rule and the result are based on"""
+        return samples
+
+    def _converged(self, mean: np.ndarray, half_width: np.ndarray):
+        columns = slice(None) if self.include_storage else slice(0, 1)
+        limit = self.tolerance * np.abs(mean[columns]) if self.relative else self.tolerance
+        return bool(np.all(half_width[columns] <= limit))
+
+    def _summarize(self, result: dict, mean: np.ndarray, half_width: np.ndarray):
+        result['time'] = {'mean': mean[0], 'half_width': half_width[0]}
+        if self.include_storage:
+            result['storage'] = {
+                curr_id: {'mean': mean[idx+1], 'half_width': half_width[idx+1]}
+                for idx, curr_id in enumerate(self._simulators[0].currency_properties())
+            }
+
+    def run(self):
+        """Runs replica batches until the requested precision or the replica limit is reached"""
+        result = {'status': max(sim.status for sim in self._simulators), 'replicas': 0, 'converged': False}
+        if result['status'] != 0:
+            return result
+        workers = self.processes or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        samples = []
+        try:
+            while len(samples) < self.max_replicas:
+                seeds = self._seed_sequence.spawn(min(self.batch_size, self.max_replicas - len(samples)))
+                if executor is None:
+                    samples.extend(_run_replicas(self._simulators, seeds, self.antithetic))
+                else:
+                    chunks = [seeds[idx::workers] for idx in range(workers) if len(seeds[idx::workers]) > 0]
+                    for batch in executor.map(_run_replicas, [self._simulators]*len(chunks), chunks,
+                                              [self.antithetic]*len(chunks)):
+                        samples.extend(batch)
+                mean, half_width = confidence_interval(self._statistics(np.array(samples)), self.confidence)
+                if self._converged(mean, half_width):
+                    result['converged'] = True
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        result['replicas'] = len(samples)
+        if len(samples) > 0:
+            self._summarize(result, mean, half_width)
+        return result
+
+
+class PairedComparison(ReplicationRunner):
+    """Paired Comparison Class
+
+    Compares the time to target of two model variants. Both variants are simulated with the same seed in every
+    replica, so connections that exist in both models draw the same random numbers (common random numbers),
+    and the paired difference has a much smaller variance than the difference of independent runs. The
+    tolerance applies to the half width of the difference, relative to the mean time of the first variant.
+    """
+
+    def __init__(self, model_a: FlowModel, model_b: FlowModel, tolerance: float = 0.01, relative: bool = True,
+                 confidence: float = 0.95, antithetic: bool = False, batch_size: int = 16,
+                 max_replicas: int = 10000, seed: int = None, processes: int = 1):
+        super().__init__(model_a, tolerance=tolerance, relative=relative, confidence=confidence,
+            antithetic=antithetic, batch_size=batch_size, max_replicas=max_replicas, seed=seed,
+            processes=processes)
+        self._simulators.append(Simulator(model_b, reduce=True))
+
+    def _statistics(self, samples: np.ndarray) -> np.ndarray:
+        time_a = samples[:, 0]
+        time_b = samples[:, len(self._simulators[0].currency_properties())+1]
+        return np.stack([time_b - time_a, time_a, time_b], axis=1)
+
+    def _converged(self, mean: np.ndarray, half_width: np.ndarray):
+        limit = self.tolerance * abs(mean[1]) if self.relative else self.tolerance
+        return bool(half_width[0] <= limit)
+
+    def _summarize(self, result: dict, mean: np.ndarray, half_width: np.ndarray):
+        scale = half_width[0] / student_t.ppf((1 + self.confidence) / 2, max(result['replicas'] - 1, 1))
+        result['time_a'] = {'mean': mean[1], 'half_width': half_width[1]}
+        result['time_b'] = {'mean': mean[2], 'half_width': half_width[2]}
+        result['difference'] = {'mean': mean[0], 'half_width': half_width[0], 'standard_error': scale}
@@ -0,0 +1,122 @@
+"""GMC Scenario Solver
+
+Rate sweeps and parameter screenings solve the max flow problem of the same model many times. Scenarios that
+only change source time steps and currency target values change the bounds and the drain column of the linear
+program but not its constraint structure, so the program is built once and all scenarios are solved in a batch.
+"""
+
+from __future__ import annotations
+
+from typing import List
+import numpy as np
+
+from gmc.flow_model import FlowModel
+from gmc.generalized_flow import GeneralizedFlowSolver
+from gmc.mc_simulator import Simulator, StageSolver, highspy
+
+
+class ScenarioSolver(StageSolver):
+    """Scenario Solver Class
+
+    Solves variants of the max flow problem of a model that differ in time steps and target values. Scenarios
+    are solved in lexicographic order of their parameters such that neighbouring scenarios follow each other,
+    and with highspy installed every solve starts from the optimal basis of the previous one. Whether the
+    targets can be reached at all only depends on which rates and targets are positive, so scenarios with a
+    pattern that already proved unreachable are not solved again. Generalized network models are solved with
+    the combinatorial solver instead, whose structure and tie checks do not depend on the scenario parameters.
+    """
+
+    def __init__(self, model: FlowModel):
+        super().__init__(model)
+        self._base_rates = self._rates.copy()
+        self._base_targets = np.array([currency.target_value for currency in model.currencies], dtype=float)
+        self._sid_lookup = {source.id: idx for idx, source in enumerate(model.sources)}
+        self._cid_lookup = {currency.id: idx for idx, currency in enumerate(model.currencies)}
+        self._model = model.copy()
+        self._network = GeneralizedFlowSolver(self._model)
+        self.solved = 0
+        self.skipped = 0
+
+    def scenario_arrays(self, scenarios: List[dict]) -> tuple:
+        """Returns source rates and target values of scenarios that map source ids to time steps and currency ids
+        to target values; parameters not given keep the values of the model
+        """
+        rates = np.tile(self._base_rates, (len(scenarios), 1))
+        targets = np.tile(self._base_targets, (len(scenarios), 1))
+        for row, scenario in enumerate(scenarios):
+            for key, value in scenario.items():
+                if key in self._sid_lookup:
+                    rates[row, self._sid_lookup[key]] = 1./value if value > 0 else np.inf
+                elif key in self._cid_lookup:
+                    targets[row, self._cid_lookup[key]] = value
+                else:
+                    raise ValueError(f"Unknown source or currency id '{key}'!")
+        return rates, targets
+
+    def solve_all(self, scenarios: List[dict], flows: bool = False) -> List[dict]:
+        """Returns the flow info of every scenario
+        Without flows only the throughput and the steps to reach the targets are computed, which needs one
+        linear program per scenario instead of two.
+        """
+        rates, targets = self.scenario_arrays(scenarios)
+        return self.solve_arrays(rates, targets, flows)
+
+    def solve_arrays(self, rates: np.ndarray, targets: np.ndarray, flows: bool = False) -> List[dict]:
+        """Returns the flow info for rows of source rates, including the drain rate 1, and target values"""
+        rates = np.asarray(rates, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+        if rates.shape[1:] != self._base_rates.shape or targets.shape[1:] != self._base_targets.shape or len(rates) != len(targets):
+            raise ValueError('Scenario arrays do not match the model!')
+        results = [None] * len(rates)
+        unreachable = {}
+        for idx in np.lexsort(np.hstack([rates, targets]).T[::-1]):
+            pattern = (np.where(np.isinf(rates[idx]), 2, rates[idx] > 0).tobytes(), (targets[idx] > 0).tobytes())
+            if pattern in unreachable:
+                results[idx] = dict(unreachable[pattern])
+                self.skipped += 1
+                continue
+            self._rates = rates[idx].copy()
+            if self._network.unique or (self._network.supported and not flows):
+                results[idx] = self._solve_network(targets[idx], flows)
+            else:
+                if self._highs is not None:
+                    self._highs.changeColsBounds(len(self._rates), np.arange(len(self._rates), dtype=np.int32),
+                        np.zeros(len(self._rates)), np.minimum(self._rates, highspy.kHighsInf))
+                results[idx] = self.solve(targets[idx]) if flows else self._throughput(targets[idx])
+            self.solved += 1
+            if results[idx]['status'] != 0 or results[idx]['steps'] == 0:
+                unreachable[pattern] = results[idx]
+        return results
+
+    def _solve_network(self, targets: np.ndarray, flows: bool) -> dict:
+        for source, rate in zip(self._model.sources, self._rates):
+            source.time_step = 1./rate if rate > 0 else np.inf
+        for currency, value in zip(self._model.currencies, targets):
+            currency.target_value = value
+        if flows:
+            return self._network.solve()
+        throughput = self._network.max_throughput()
+        return {'status': 0, 'message': self._network.MESSAGE, 'throughput': throughput,
+                'steps': 1. / throughput if throughput > 0 else 0.}
+
+    def _throughput(self, targets: np.ndarray) -> dict:
+        self._A[:, -1] = -targets
+        if self._highs is None:
+            result = Simulator._compute_max_throughput(self._A, self._rates)  # pylint: disable=protected-access
+            if result.status != 0:
+                return {'status': result.status, 'message': result.message}
+            throughput = result.x[-1]
+            message = result.message
+        else:
+            nc, ns = self._A.shape
+            highs = self._highs
+            for cid in range(nc):
+                highs.changeCoeff(cid, ns-1, self._A[cid, -1])
+            cost = np.zeros(ns)
+            cost[-1] = -1.
+            if not self._run(cost):
+                return {'status': 4, 'message': highs.modelStatusToString(highs.getModelStatus())}
+            throughput = highs.getSolution().col_value[-1]
+            message = self.MESSAGE
+        return {'status': 0, 'message': message, 'throughput': throughput,
+                'steps': 1. / throughput if throughput > 0 else 0.}
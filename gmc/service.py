@@ -0,0 +1,341 @@
+"""GMC Simulation Service
+
+Long running local server that accepts model payloads over HTTP or a Unix socket and runs simulations on a
+pool of warm worker processes. Start it with
+
+    python -m gmc.service --port 8765
+    python -m gmc.service --socket /tmp/gmc.sock
+
+and submit jobs with POST /jobs. A job is a json object with the model (as saved by FlowModel.to_dict), the
+kind of job ('simulate', 'sensitivity' or 'replicate'), options passed to the job and an optional sweep, a
+list of overrides each producing one result. GET /jobs/<id> reports the progress, GET /jobs/<id>/results
+streams the results as newline delimited json as they become available.
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import socketserver
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+from gmc.replication import ReplicationRunner
+
+
+JOB_KINDS = ('simulate', 'sensitivity', 'replicate')
+MAX_STEPS = 1000000
+MAX_JOBS = 1000
+
+_MODEL_CACHE = {}
+_MODEL_CACHE_SIZE = 64
+
+
+def _warm_up():
+    """Imports the solver stack and solves a tiny model once in a new worker process"""
+    model = FlowModel()
+    model.load_from_dict({
+        'currencies': [{'_id': 'c', 'name': 'c', 'pos': (0, 0), 'target_value': 1}],
+        'sources': [{'_id': 's', 'name': 's', 'pos': (0, 1), 'time_step': 1}],
+        'connections': [{'source': 's', 'target': 'c', 'rate': 1}]
+    })
+    Simulator(model).run()
+
+
+def _model_hash(model_dict: dict) -> str:
+    return hashlib.sha256(json.dumps(model_dict, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _cached_simulator(model_dict: dict):
+    """Returns the parsed model and its solved simulator, reusing them for models seen before"""
+    key = _model_hash(model_dict)
+    if key not in _MODEL_CACHE:
+        if len(_MODEL_CACHE) >= _MODEL_CACHE_SIZE:
+            _MODEL_CACHE.pop(next(iter(_MODEL_CACHE)))
+        model = FlowModel()
+        model.load_from_dict(model_dict)
+        _MODEL_CACHE[key] = (model, Simulator(model, reduce=True))
+    return _MODEL_CACHE[key]
+
+
+def apply_overrides(model_dict: dict, overrides: dict) -> dict:
+    """Returns a copy of the model dictionary with changed component attributes
+    Overrides map a component name or id, or 'source -> target' for connections, to the new attribute values.
+    """
+    result = copy.deepcopy(model_dict)
+    names = {}
+    for data in result.get('currencies', []) + result.get('sources', []):
+        names[data['name']] = data['_id']
+        names[data['_id']] = data['_id']
+    for key, values in overrides.items():
+        if '->' in key:
+            src, tgt = (names.get(part.strip()) for part in key.split('->', 1))
+            matches = [data for data in result.get('connections', [])
+                if data['source'] == src and data['target'] == tgt]
+        else:
+            matches = [data for data in result.get('currencies', []) + result.get('sources', [])
+                if data['_id'] == names.get(key)]
+        if len(matches) == 0:
+            raise ValueError(f"Unknown component '{key}'!")
+        for data in matches:
+            data.update(values)
+    return result
+
+
+def run_job(kind: str, model_dict: dict, options: dict) -> dict:
+    """Runs a single job in a worker process and returns its json serializable result"""
+    model, simulator = _cached_simulator(model_dict)
+    if kind == 'simulate':
+        simulator.reset(options.get('seed'))
+        simulator.run(until=options.get('until'), max_steps=options.get('max_steps', MAX_STEPS))
+        return {
+            'status': simulator.status,
+            'message': simulator.flow_info()['message'],
+            'step_num': simulator.step_num,
+            'stage': simulator.stage() if simulator.status == 0 else 0,
+            'storage': {prop['name']: prop['storage'] for prop in simulator.currency_properties().values()},
+            'stages': [{'name': entry['name'], 'step': entry['step'], 'duration': entry['duration']}
+                for entry in simulator.stage_results()]
+        }
+    if kind == 'sensitivity':
+        simulator.reset()
+        return {'status': simulator.status, 'sensitivity': simulator.sensitivity() if simulator.status == 0 else []}
+    if kind == 'replicate':
+        result = ReplicationRunner(model, **dict(options, processes=1)).run()
+        if 'storage' in result:
+            names = {prop_id: prop['name'] for prop_id, prop in simulator.currency_properties().items()}
+            result['storage'] = {names[curr_id]: value for curr_id, value in result['storage'].items()}
+        return result
+    raise ValueError(f"Unknown job kind '{kind}'!")
+
+
+def _run_sweep_item(kind: str, model_dict: dict, options: dict, overrides: dict) -> dict:
+    if overrides:
+        model_dict = apply_overrides(model_dict, overrides)
+    return run_job(kind, model_dict, options)
+
+
+def _json_default(obj):
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return str(obj)
+
+
+class Job():
+    """Job Class"""
+
+    def __init__(self, kind: str, total: int):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.total = total
+        self.results = []
+        self.failed = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def status(self) -> dict:
+        """Returns the job progress"""
+        with self.condition:
+            completed = len(self.results)
+            if self.cancelled:
+                state = 'cancelled'
+            elif completed < self.total:
+                state = 'running' if completed > 0 else 'queued'
+            else:
+                state = 'failed' if self.failed == self.total else 'done'
+            return {'id': self.id, 'kind': self.kind, 'status': state, 'completed': completed,
+                    'failed': self.failed, 'total': self.total}
+
+    def add_result(self, index: int, future):
+        """Stores the result of a finished sweep item"""
+        with self.condition:
+            if future.cancelled():
+                self.cancelled = True
+                result = {'index': index, 'error': 'cancelled'}
+            elif future.exception() is not None:
+                self.failed += 1
+                result = {'index': index, 'error': str(future.exception())}
+            else:
+                result = {'index': index, 'result': future.result()}
+            self.results.append(result)
+            self.condition.notify_all()
+
+    def stream(self):
+        """Yields the results in completion order and waits for the pending ones"""
+        pos = 0
+        while True:
+            with self.condition:
+                while pos == len(self.results) and pos < self.total:
+                    self.condition.wait()
+                pending = self.results[pos:]
+            if len(pending) == 0:
+                return
+            yield from pending
+            pos += len(pending)
+
+
+class SimulationService():
+    """Simulation Service Class
+
+    Queues jobs on a process pool whose workers are started and warmed up once, so a job only pays for its
+    own simulation. Workers keep the parsed and solved models of recent payloads, keyed by the model hash.
+    At most max_jobs jobs are kept; the oldest finished jobs are forgotten first.
+    """
+
+    def __init__(self, workers: int = None, max_jobs: int = MAX_JOBS):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_warm_up)
+        for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, payload: dict) -> Job:
+        """Queues a job and returns it"""
+        kind = payload.get('kind', 'simulate')
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'!")
+        if 'model' not in payload:
+            raise ValueError('Job without model!')
+        sweep = payload.get('sweep') or [{}]
+        job = Job(kind, len(sweep))
+        with self._lock:
+            self._expire()
+            self.jobs[job.id] = job
+        for index, overrides in enumerate(sweep):
+            future = self._executor.submit(_run_sweep_item, kind, payload['model'], payload.get('options', {}), overrides)
+            future.add_done_callback(lambda fut, idx=index: job.add_result(idx, fut))
+        return job
+
+    def _expire(self):
+        """Forgets the oldest finished jobs until there is room for a new one"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status()['status'] in ('done', 'failed', 'cancelled')]
+        for job_id in finished[:max(len(self.jobs) - self.max_jobs + 1, 0)]:
+            del self.jobs[job_id]
+
+    def job(self, job_id: str) -> Job:
+        """Returns the job with the given id or None"""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def remove(self, job_id: str):
+        """Forgets a job"""
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def shutdown(self):
+        """Stops the worker processes"""
+        self._executor.shutdown(cancel_futures=True)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """Service Request Handler Class"""
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def _send_json(self, code: int, data):
+        body = json.dumps(data, default=_json_default).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job(self):
+        parts = self.path.strip('/').split('/')
+        job = self.server.service.job(parts[1]) if len(parts) >= 2 and parts[0] == 'jobs' else None
+        if job is None:
+            self._send_json(404, {'error': 'Unknown job!'})
+        return job, parts
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Returns the service health, a job status or streams job results"""
+        if self.path.rstrip('/') == '/health':
+            self._send_json(200, {'status': 'ok', 'workers': self.server.service.workers,
+                                  'jobs': len(self.server.service.jobs)})
+            return
+        job, parts = self._job()
+        if job is None:
+            return
+        if len(parts) == 2:
+            self._send_json(200, job.status())
+        elif len(parts) == 3 and parts[2] == 'results':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            for result in job.stream():
+                self.wfile.write(json.dumps(result, default=_json_default).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        else:
+            self._send_json(404, {'error': 'Unknown endpoint!'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Queues a new job"""
+        if self.path.rstrip('/') != '/jobs':
+            self._send_json(404, {'error': 'Unknown endpoint!'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job = self.server.service.submit(payload)
+        except (ValueError, TypeError, AttributeError) as exc:
+            self._send_json(400, {'error': str(exc)})
+            return
+        self._send_json(202, job.status())
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """Forgets a job"""
+        job, _ = self._job()
+        if job is not None:
+            self.server.service.remove(job.id)
+            self._send_json(200, {'id': job.id})
+
+
+class UnixSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix Socket Server Class"""
+    daemon_threads = True
+
+
+def create_server(service: SimulationService, port: int = 8765, host: str = '127.0.0.1', socket_path: str = None):
+    """Returns a server for the service listening on a local port or on a Unix socket"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixSocketServer(socket_path, ServiceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.service = service
+    return server
+
+
+def main():
+    """Runs the simulation service until interrupted"""
+    parser = argparse.ArgumentParser(description='GachaMC simulation service')
+    parser.add_argument('--host', default='127.0.0.1', help='host to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--socket', default=None, help='listen on a Unix socket instead of a port')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--max-jobs', type=int, default=MAX_JOBS, help='number of jobs kept for their results')
+    args = parser.parse_args()
+    service = SimulationService(args.workers, args.max_jobs)
+    server = create_server(service, args.port, args.host, args.socket)
+    print(f"Serving on {args.socket or f'{args.host}:{args.port}'} with {service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""GMC Tabular Import
+
+Builds flow models from CSV rate tables. Currencies are given by the columns name and target_value, sources
+by name and time_step and connections by source, target, rate and chance. Components are referenced by name,
+optional columns may be missing or left empty. All rows are validated before any component is created.
+"""
+
+from __future__ import annotations
+
+import csv
+from typing import List
+import numpy as np
+
+from gmc.components import Position, Connection, Currency, Source
+from gmc.flow_model import FlowModel
+from gmc.layout import layered_layout
+
+
+MAX_REPORTED_ERRORS = 20
+
+
+def read_table(filename: str) -> dict:
+    """Reads a CSV file with a header row into a dictionary of column arrays"""
+    with open(filename, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file)
+        header = [column.strip().lower() for column in next(reader, [])]
+        rows = [row for row in reader if any(cell.strip() for cell in row)]
+    table = {}
+    for idx, column in enumerate(header):
+        table[column] = np.array([row[idx].strip() if idx < len(row) else '' for row in rows], dtype=object)
+    table['_rows'] = len(rows)
+    return table
+
+
+def _column(table: dict, name: str, default: str = '') -> np.ndarray:
+    if name in table:
+        return table[name].astype(str)
+    return np.full(table.get('_rows', 0), default, dtype=object).astype(str)
+
+
+def _numeric(values: np.ndarray, default: float):
+    """Returns the values as floats and a mask of the cells that are not numbers"""
+    values = np.where(values == '', str(default), values)
+    try:
+        return values.astype(float), np.zeros(len(values), dtype=bool)
+    except ValueError:
+        numbers = np.full(len(values), np.nan)
+        invalid = np.zeros(len(values), dtype=bool)
+        for idx, value in enumerate(values):
+            try:
+                numbers[idx] = float(value)
+            except ValueError:
+                invalid[idx] = True
+        return numbers, invalid
+
+
+def _report(errors: List[str], table: str, mask: np.ndarray, message: str, values: np.ndarray = None):
+    for idx in np.flatnonzero(mask)[:MAX_REPORTED_ERRORS]:
+        detail = f" '{values[idx]}'" if values is not None else ''
+        errors.append(f"{table} row {idx+2}: {message}{detail}")
+    if np.count_nonzero(mask) > MAX_REPORTED_ERRORS:
+        errors.append(f"{table}: {np.count_nonzero(mask) - MAX_REPORTED_ERRORS} more rows: {message}")
+
+
+def _validate_components(errors: List[str], table: str, names: np.ndarray, known: np.ndarray,
+                         values: np.ndarray, invalid: np.ndarray, column: str, minimum: float, strict: bool):
+    _report(errors, table, names == '', 'empty name')
+    _, inverse, counts = np.unique(names, return_inverse=True, return_counts=True)
+    duplicate = (counts[inverse] > 1) | np.isin(names, known)
+    _report(errors, table, duplicate & (names != ''), 'duplicate name', names)
+    _report(errors, table, invalid, f"{column} is not a number")
+    bad = ~invalid & ~(values > minimum if strict else values >= minimum)
+    _report(errors, table, bad, f"{column} must be {'greater than' if strict else 'at least'} {minimum}", values)
+
+
+def import_tables(currencies: dict, sources: dict, connections: dict, model: FlowModel = None,
+                  spacing: float = 1.5) -> FlowModel:
+    """Adds the components of the tables to the model, or to a new model, and returns it
+    Tables are dictionaries of column arrays as returned by read_table. New components are arranged in layers
+    next to the existing ones. Raises a ValueError listing the invalid rows if any row does not validate.
+    """
+    model = model if model is not None else FlowModel()
+    errors = []
+    existing_currencies = np.array([curr.name for curr in model.currencies], dtype=str)
+    existing_sources = np.array([src.name for src in model.sources], dtype=str)
+    existing = np.concatenate([existing_currencies, existing_sources])
+
+    curr_names = _column(currencies, 'name')
+    targets, invalid = _numeric(_column(currencies, 'target_value'), 0)
+    _validate_components(errors, 'currencies', curr_names, existing, targets, invalid, 'target_value', 0, False)
+    src_names = _column(sources, 'name')
+    time_steps, invalid = _numeric(_column(sources, 'time_step'), 1)
+    _validate_components(errors, 'sources', src_names, existing, time_steps, invalid, 'time_step', 0, True)
+    _report(errors, 'sources', np.isin(src_names, curr_names) & (src_names != ''), 'name is also a currency', src_names)
+
+    conn_sources, conn_targets = _column(connections, 'source'), _column(connections, 'target')
+    rates, invalid_rates = _numeric(_column(connections, 'rate'), 1)
+    chances, invalid_chances = _numeric(_column(connections, 'chance'), 1)
+    all_currencies = np.concatenate([existing_currencies, curr_names])
+    all_sources = np.concatenate([existing_sources, src_names])
+    src_is_curr, src_is_src = np.isin(conn_sources, all_currencies), np.isin(conn_sources, all_sources)
+    tgt_is_curr, tgt_is_src = np.isin(conn_targets, all_currencies), np.isin(conn_targets, all_sources)
+    _report(errors, 'connections', ~src_is_curr & ~src_is_src, 'unknown source', conn_sources)
+    _report(errors, 'connections', ~tgt_is_curr & ~tgt_is_src, 'unknown target', conn_targets)
+    _report(errors, 'connections', (src_is_curr & tgt_is_curr) | (src_is_src & tgt_is_src),
+        'connection must link a currency and a source', conn_targets)
+    _report(errors, 'connections', invalid_rates, 'rate is not a number')
+    _report(errors, 'connections', ~invalid_rates & ~(rates > 0), 'rate must be greater than 0', rates)
+    _report(errors, 'connections', invalid_chances, 'chance is not a number')
+    _report(errors, 'connections', ~invalid_chances & ~((chances > 0) & (chances <= 1)),
+        'chance must be in (0, 1]', chances)
+    pairs = np.char.add(np.char.add(conn_sources.astype(str), '\x00'), conn_targets.astype(str))
+    _, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+    _report(errors, 'connections', counts[inverse] > 1, 'duplicate connection', conn_targets)
+    if errors:
+        raise ValueError('Invalid tables:\n' + '\n'.join(errors))
+
+    new_currencies = [Currency(name, target_value=value) for name, value in zip(curr_names, targets.tolist())]
+    new_sources = [Source(name, time_step=value) for name, value in zip(src_names, time_steps.tolist())]
+    lookup = {comp.name: comp for comp in model.get_components() + new_currencies + new_sources}
+    new_connections = [
+        Connection(lookup[src], lookup[tgt], rate=rate, chance=chance)
+        for src, tgt, rate, chance in zip(conn_sources, conn_targets, rates.tolist(), chances.tolist())
+    ]
+
+    staging = FlowModel()
+    staging.currencies, staging.sources = new_currencies, new_sources
+    new_ids = {comp.id for comp in new_currencies + new_sources}
+    staging.connections = [conn for conn in new_connections if conn.source.id in new_ids and conn.target.id in new_ids]
+    layout = layered_layout(staging, spacing)
+    offset = max((comp.pos.x for comp in model.get_components()), default=-spacing) + spacing
+    for comp in new_currencies + new_sources:
+        x, y = layout[comp.id]
+        comp.pos = Position(x + offset, y)
+    model.add_components(new_currencies, new_sources, new_connections)
+    return model
+
+
+def import_csv(currencies_file: str = None, sources_file: str = None, connections_file: str = None,
+               model: FlowModel = None, spacing: float = 1.5) -> FlowModel:
+    """Reads currency, source and connection tables from CSV files and adds them to the model"""
+    tables = [read_table(filename) if filename is not None else {'_rows': 0}
+        for filename in (currencies_file, sources_file, connections_file)]
+    return import_tables(*tables, model=model, spacing=spacing)
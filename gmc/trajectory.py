@@ -0,0 +1,129 @@
+"""GMC Trajectory Export"""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+import numpy as np
+
+from gmc.mc_simulator import Simulator
+
+
+class TrajectorySink():
+    """Trajectory Sink Class
+
+    Collects the currency storage of a running simulation into a fixed-size chunk and writes every full chunk
+    to disk, so memory use does not depend on the number of steps. An instance can be passed as callback to
+    Simulator.run and records the initial state on creation.
+    """
+
+    def __init__(self, filename: str, simulator: Simulator, chunk_size: int = 4096, interval: int = 1):
+        self.filename = filename
+        self.interval = interval
+        self.ids = list(simulator.currency_properties().keys())
+        self.names = [prop['name'] for prop in simulator.currency_properties().values()]
+        self.rows = 0
+        self._chunk = np.zeros((chunk_size, len(self.ids)+1))
+        self._filled = 0
+        self._file = None
+        self._open()
+        self.record(simulator)
+
+    def __call__(self, simulator: Simulator):
+        if simulator.step_num % self.interval == 0:
+            self.record(simulator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def columns(self):
+        """Returns the column names"""
+        return ['step'] + self.names
+
+    def record(self, simulator: Simulator):
+        """Adds the current storage of the simulator to the trajectory"""
+        row = self._chunk[self._filled]
+        row[0] = simulator.step_num
+        for idx, properties in enumerate(simulator.currency_properties().values()):
+            row[idx+1] = properties['storage']
+        self._filled += 1
+        if self._filled == len(self._chunk):
+            self.flush()
+
+    def record_rows(self, step_nums: np.ndarray, storage: np.ndarray):
+        """Adds rows of step numbers and currency storage, e.g. as record function of Simulator.run"""
+        start = 0
+        while start < len(step_nums):
+            count = min(len(step_nums) - start, len(self._chunk) - self._filled)
+            rows = self._chunk[self._filled:self._filled+count]
+            rows[:, 0] = step_nums[start:start+count]
+            rows[:, 1:] = storage[start:start+count]
+            self._filled += count
+            start += count
+            if self._filled == len(self._chunk):
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered rows to disk"""
+        if self._filled > 0:
+            self._write(self._chunk[:self._filled])
+            self.rows += self._filled
+            self._filled = 0
+        self._file.flush()
+
+    def close(self):
+        """Flushes the remaining rows and closes the file"""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        raise NotImplementedError()
+
+    def _write(self, rows: np.ndarray):
+        raise NotImplementedError()
+
+
+class NpyTrajectorySink(TrajectorySink):
+    """Numpy Trajectory Sink Class
+
+    Writes the trajectory as a two dimensional float64 .npy file with one row per recorded step. The header is
+    rewritten after every chunk such that the file is always valid and can be opened with
+    np.load(filename, mmap_mode='r'). Column names are stored in a json file next to it.
+    """
+
+    HEADER_SIZE = 128
+
+    def _open(self):
+        self._file = open(self.filename, 'wb')  # pylint: disable=consider-using-with
+        self._write_header()
+        stem, _ = os.path.splitext(self.filename)
+        with open(stem + '.json', 'w', encoding='utf-8') as file:
+            json.dump({'columns': self.columns(), 'ids': ['step'] + self.ids}, file)
+
+    def _write_header(self, rows: int = 0):
+        header = str({'descr': '<f8', 'fortran_order': False, 'shape': (rows, len(self.ids)+1)})
+        header = header.ljust(self.HEADER_SIZE - 11) + '\n'
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1'))
+        self._file.seek(0, os.SEEK_END)
+
+    def _write(self, rows: np.ndarray):
+        self._file.write(rows.astype('<f8').tobytes())
+        self._write_header(self.rows + len(rows))
+
+
+class CsvTrajectorySink(TrajectorySink):
+    """CSV Trajectory Sink Class"""
+
+    def _open(self):
+        self._file = open(self.filename, 'w', encoding='utf-8', newline='')  # pylint: disable=consider-using-with
+        csv.writer(self._file).writerow(self.columns())
+
+    def _write(self, rows: np.ndarray):
+        np.savetxt(self._file, rows, delimiter=',', fmt=['%d'] + ['%.10g'] * len(self.ids))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from gmc.aggregation import collapse_groups
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+from gmc.planner import ExecutionPlanner
+
+
+def chain_model() -> FlowModel:
+    model = FlowModel()
+    ore = Currency('ore', Position(1, 0))
+    ingots = Currency('ingots', Position(3, 0))
+    gold = Currency('gold', Position(5, 0), target_value=200)
+    mine = Source('mine', Position(0, 0), time_step=2)
+    smelter = Source('smelter', Position(2, 0))
+    forge = Source('forge', Position(4, 0), time_step=3)
+    model.add_components([ore, ingots, gold], [mine, smelter, forge], [
+        Connection(mine, ore, rate=3),
+        Connection(ore, smelter, rate=2),
+        Connection(smelter, ingots, rate=1),
+        Connection(ingots, forge, rate=1),
+        Connection(forge, gold, rate=5)
+    ])
+    model.add_group('gold chain', [mine, ore, smelter, ingots, forge])
+    return model
+
+
+def test_aggregated_chain_keeps_flow_steps():
+    model = chain_model()
+    flat = Simulator(model).flow_info()
+    plan = ExecutionPlanner().plan(model, aggregate=True)
+    assert plan.aggregated == 1 and plan.statistics['sources'] == 1
+    aggregated = plan.simulator().flow_info()
+    assert flat['status'] == aggregated['status'] == 0
+    assert np.isclose(aggregated['steps'], flat['steps'])
+    assert np.isclose(Simulator(model, aggregate=True).flow_info()['steps'], flat['steps'])
+    result = plan.run(seed=1)
+    assert result['status'] == 0 and result['storage'][model.currencies[2].id][-1] >= 200
+
+
+def test_groups_that_are_not_chains_stay_expanded():
+    model = chain_model()
+    slag = Currency('slag', Position(3, 1))
+    model.add_currency(slag)
+    model.add_connection(Connection(model.sources[1], slag, rate=1))
+    model.groups[0].members.append(slag.id)
+    assert len(collapse_groups(model).sources) == len(model.sources)
+    plan = ExecutionPlanner().plan(model, aggregate=True)
+    assert plan.aggregated == 0 and plan.statistics['sources'] == len(model.sources)
+    assert np.isclose(plan.simulator().flow_info()['steps'], Simulator(model).flow_info()['steps'])
+
+
+def test_aggregation_is_opt_in():
+    plan = ExecutionPlanner().plan(chain_model())
+    assert plan.aggregated == 0 and plan.statistics['sources'] == 3
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from gmc.balancing import RateBalancer, Tunable, simulated_time, surrogate_time
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+
+
+def recipe_model(daily_gems: float) -> FlowModel:
+    model = FlowModel()
+    gems = Currency('gems', Position(0, 0))
+    chars = Currency('chars', Position(2, 0), target_value=20)
+    daily = Source('daily', Position(0, 1))
+    cheap = Source('cheap', Position(1, 1))
+    pricey = Source('pricey', Position(1, 2))
+    for currency in (gems, chars):
+        model.add_currency(currency)
+    for source in (daily, cheap, pricey):
+        model.add_source(source)
+    model.add_connection(Connection(daily, gems, rate=daily_gems))
+    model.add_connection(Connection(gems, cheap, rate=1))
+    model.add_connection(Connection(cheap, chars, rate=1))
+    model.add_connection(Connection(gems, pricey, rate=10))
+    model.add_connection(Connection(pricey, chars, rate=1))
+    return model
+
+
+def test_surrogate_matches_throughput_time():
+    assert np.isclose(surrogate_time(recipe_model(2)), 20 / 1.1)
+
+
+def test_surrogate_rejects_candidates_the_simulator_rejects():
+    model = recipe_model(1)
+    assert np.isinf(simulated_time(model))
+    assert np.isinf(surrogate_time(model))
+
+
+def test_optimize_reaches_goal_within_budget():
+    model = recipe_model(2)
+    balancer = RateBalancer(model, goal=16, parameters=[Tunable('daily -> gems', 'rate', 0.5, 10)], budget=8,
+                            seed=1, processes=1)
+    result = balancer.optimize()
+    assert result['status'] == 0 and result['evaluations'] <= 8
+    assert abs(result['time'] / 16 - 1) <= balancer.tolerance
+    assert model.connections[0].rate == 2
+    balancer.apply(model, result)
+    assert model.connections[0].rate == result['parameters']['daily -> gems rate']
+
+
+def test_parallel_connections_need_an_index():
+    model = recipe_model(2)
+    model.add_connection(Connection(model.sources[0], model.currencies[0], rate=3))
+    with pytest.raises(ValueError, match='Ambiguous'):
+        RateBalancer(model, goal=16, parameters=[Tunable('daily -> gems', 'rate', 0.5, 10)])
+    balancer = RateBalancer(model, goal=16, parameters=[Tunable('daily -> gems #1', 'rate', 0.5, 10)])
+    candidate = balancer.candidate(np.array([1.]))
+    assert np.allclose([conn.rate for conn in candidate.connections if conn.source.name == 'daily'], [2, 10])
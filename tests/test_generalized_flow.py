@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.generalized_flow import GeneralizedFlowSolver
+from gmc.mc_simulator import Simulator
+
+
+def random_network(rng: np.random.Generator) -> FlowModel:
+    """Returns a random model of simple edge sources: raw currencies with several producers without inputs,
+    refined by chains of converters"""
+    model = FlowModel()
+    raw = [Currency(f'raw{idx}', Position(idx, 0)) for idx in range(rng.integers(1, 4))]
+    for currency in raw:
+        model.add_currency(currency)
+        for idx in range(rng.integers(1, 4)):
+            source = Source(f'{currency.name}-producer{idx}', Position(0, idx), time_step=float(rng.choice([0.5, 1, 2, 3])))
+            model.add_source(source)
+            model.add_connection(Connection(source, currency, rate=float(rng.choice([1, 2, 3])),
+                chance=float(rng.choice([1, 1, 0.5]))))
+    currencies = list(raw)
+    for idx in range(rng.integers(1, 5)):
+        product = Currency(f'product{idx}', Position(idx, 2))
+        converter = Source(f'converter{idx}', Position(idx, 1), time_step=float(rng.choice([0, 1, 2])))
+        model.add_currency(product)
+        model.add_source(converter)
+        model.add_connection(Connection(currencies[rng.integers(len(currencies))], converter, rate=float(rng.integers(1, 5))))
+        model.add_connection(Connection(converter, product, rate=float(rng.integers(1, 4))))
+        currencies.append(product)
+    for currency in currencies:
+        if rng.random() < 0.5:
+            currency.target_value = float(rng.integers(1, 100))
+    if all(currency.target_value == 0 for currency in currencies):
+        currencies[-1].target_value = 10.
+    return model
+
+
+def linear_program(model: FlowModel) -> dict:
+    rates, inc_inp, inc_out = Simulator._build_flow_matrices(model)  # pylint: disable=protected-access
+    return Simulator._compute_max_flow(inc_inp-inc_out, rates)  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_generalized_flow_matches_linear_program(seed):
+    model = random_network(np.random.default_rng(seed))
+    solver = GeneralizedFlowSolver(model)
+    assert solver.supported
+    expected = linear_program(model)
+    assert solver.max_throughput() == pytest.approx(1. / expected['steps'] if expected['steps'] > 0 else 0., rel=1e-7)
+    if not solver.unique:
+        return
+    result = solver.solve()
+    assert result['status'] == expected['status'] == 0
+    assert result['steps'] == pytest.approx(expected['steps'], rel=1e-7)
+    assert np.allclose(result['s'], expected['s'], rtol=1e-7, atol=1e-9)
+    assert np.allclose(result['c'], expected['c'], rtol=1e-7, atol=1e-7)
+
+
+def test_tied_producers_fall_back_to_linear_program():
+    model = FlowModel()
+    gems = Currency('gems', Position(0, 0), target_value=10)
+    model.add_currency(gems)
+    for idx in range(2):
+        source = Source(f'daily{idx}', Position(idx, 1))
+        model.add_source(source)
+        model.add_connection(Connection(source, gems, rate=2))
+    assert not GeneralizedFlowSolver(model).unique
+    assert np.allclose(Simulator(model).flow_info()['s'], linear_program(model)['s'])
+
+
+def test_simulator_reports_duals_of_generalized_flow_models():
+    model = random_network(np.random.default_rng(1))
+    assert GeneralizedFlowSolver(model).unique
+    flow = Simulator(model).flow_info()
+    expected = linear_program(model)
+    assert flow['message'] == GeneralizedFlowSolver.MESSAGE
+    assert np.allclose(flow['shadow_prices'], expected['shadow_prices'])
+    assert np.allclose(flow['reduced_costs'], expected['reduced_costs'])
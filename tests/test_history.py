@@ -0,0 +1,20 @@
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+
+
+def test_undo_and_redo_of_bulk_add_restore_attachments():
+    model = FlowModel()
+    hub = Source('hub', Position(0, 0))
+    model.add_source(hub)
+    currencies = [Currency(f"c{idx}", Position(idx, 1)) for idx in range(100)]
+    connections = [Connection(hub, currency) for currency in currencies]
+    model.add_components(currencies, [], connections)
+    assert hub.connections == connections
+
+    model.undo()
+    assert hub.connections == [] and model.connections == [] and model.currencies == []
+    assert all(currency.inputs == [] for currency in currencies)
+
+    model.redo()
+    assert hub.connections == connections and model.connections == connections
+    assert all(currency.inputs == [conn] for currency, conn in zip(currencies, connections))
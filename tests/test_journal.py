@@ -0,0 +1,75 @@
+import os
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.journal import ChangeJournal
+
+
+def gold_model() -> FlowModel:
+    model = FlowModel()
+    model.add_currency(Currency('gold', Position(0, 0), target_value=100))
+    return model
+
+
+def test_recover_replays_journal_without_writing(tmp_path):
+    filename = str(tmp_path / 'model.yaml')
+    model = gold_model()
+    journal = ChangeJournal(model, filename, background=False)
+    model.set_value(model.currencies[0], 'target_value', 250)
+    journal._file.close()  # pylint: disable=protected-access
+    files = {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)}
+
+    recovered = FlowModel()
+    seq = ChangeJournal.recover(recovered, filename)
+    assert recovered.currencies[0].target_value == 250
+    assert seq > 0
+    assert recovered.journal is None
+    assert {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)} == files
+
+
+def test_recover_without_journal_creates_none(tmp_path):
+    filename = str(tmp_path / 'model.yaml')
+    gold_model().save_to_file(filename)
+    recovered = FlowModel()
+    assert ChangeJournal.recover(recovered, filename) == 0
+    recovered.normalize_positions()
+    assert recovered.currencies[0].target_value == 100
+    assert os.listdir(tmp_path) == ['model.yaml']
+
+
+def test_discard_removes_outdated_journal(tmp_path):
+    filename = str(tmp_path / 'model.yaml')
+    model = gold_model()
+    ChangeJournal(model, filename, background=False).close()
+    model.set_value(model.currencies[0], 'target_value', 250)
+    model.save_to_file(filename)
+    ChangeJournal.discard(filename)
+    recovered = FlowModel()
+    ChangeJournal.recover(recovered, filename)
+    assert recovered.currencies[0].target_value == 250
+    assert os.listdir(tmp_path) == ['model.yaml']
+
+
+def test_replay_tells_parallel_connections_apart(tmp_path):
+    filename = str(tmp_path / 'model.yaml')
+    model = gold_model()
+    mine = Source('mine', Position(1, 0))
+    model.add_source(mine)
+    first = Connection(mine, model.currencies[0], rate=1)
+    second = Connection(mine, model.currencies[0], rate=2)
+    third = Connection(mine, model.currencies[0], rate=3)
+    model.add_components([], [], [first, second, third])
+    journal = ChangeJournal(model, filename, background=False)
+    model.set_value(second, 'rate', 7)
+    model.delete_connection(first)
+    model.undo()
+    model.delete_connection(third)
+    model.set_value(second, 'chance', 0.5)
+    model.add_connection(Connection(mine, model.currencies[0], rate=4))
+    model.undo()
+    journal._file.close()  # pylint: disable=protected-access
+
+    recovered = FlowModel()
+    ChangeJournal.recover(recovered, filename)
+    assert [(conn.rate, conn.chance) for conn in recovered.connections] == [(1, 1), (7, 0.5)]
+    assert [(conn.rate, conn.chance) for conn in model.connections] == [(1, 1), (7, 0.5)]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.planner import ExecutionPlanner
+
+
+def mine_model() -> FlowModel:
+    model = FlowModel()
+    gold = Currency('gold', Position(0, 0), target_value=100)
+    gems = Currency('gems', Position(1, 0), target_value=10)
+    mine = Source('mine', Position(0, 1), time_step=2)
+    shop = Source('shop', Position(1, 1))
+    model.add_currency(gold)
+    model.add_currency(gems)
+    model.add_source(mine)
+    model.add_source(shop)
+    model.add_connection(Connection(mine, gold, rate=5))
+    model.add_connection(Connection(gold, shop, rate=10))
+    model.add_connection(Connection(shop, gems, rate=1, chance=0.7))
+    return model
+
+
+def reference_trajectory(model: FlowModel, seed: int) -> np.ndarray:
+    simulator = ExecutionPlanner().plan(model, engine='python').simulator()
+    simulator.reset(seed)
+    rows = [[prop['storage'] for prop in simulator.currency_properties().values()]]
+    while simulator.status == 0 and simulator.stage() < simulator.num_stages():
+        simulator.step()
+        rows.append([prop['storage'] for prop in simulator.currency_properties().values()])
+    return np.array(rows)
+
+
+@pytest.mark.parametrize('engine', ['python', 'fixed_point'])
+@pytest.mark.parametrize('interval', [1, 7])
+def test_recorded_trajectory_matches_steps(engine, interval):
+    model = mine_model()
+    reference = reference_trajectory(model, 5)
+    result = ExecutionPlanner().plan(model, engine=engine, record_interval=interval).run(seed=5)
+    steps = result['step_num']
+    assert steps == len(reference) - 1
+    recorded = sorted(set(range(0, steps + 1, interval)) | {steps})
+    assert np.allclose(np.array(list(result['storage'].values())).T, reference[recorded])
+
+
+def test_npy_recorder_writes_step_numbers(tmp_path):
+    model = mine_model()
+    filename = str(tmp_path / 'trajectory.npy')
+    result = ExecutionPlanner().plan(model, filename=filename, record_interval=7).run(seed=5)
+    trajectory = np.load(filename)
+    steps = result['step_num']
+    assert trajectory[:, 0].tolist() == sorted(set(range(0, steps + 1, 7)) | {steps})
+    assert np.allclose(trajectory[:, 1:], reference_trajectory(model, 5)[trajectory[:, 0].astype(int)])
+
+
+def two_part_model() -> FlowModel:
+    model = mine_model()
+    dust = Currency('dust', Position(0, 2), target_value=20)
+    forge = Source('forge', Position(0, 3))
+    model.add_currency(dust)
+    model.add_source(forge)
+    model.add_connection(Connection(forge, dust, rate=2, chance=0.5))
+    return model
+
+
+def test_decomposed_engine_override_uses_processes():
+    plan = ExecutionPlanner(processes=4).plan(two_part_model(), engine='decomposed')
+    assert plan.processes == 2
+
+
+@pytest.mark.parametrize('interval', [1, 3])
+def test_decomposed_run_is_reproducible_and_limited(interval):
+    plan = ExecutionPlanner().plan(two_part_model(), engine='decomposed', processes=1, max_steps=5,
+                                   record_interval=interval)
+    results = [plan.run(seed=1) for _ in range(2)]
+    assert results[0]['step_num'] == 5
+    assert results[0]['storage'] == results[1]['storage']
+    assert all(len(values) == len(sorted(set(range(0, 6, interval)) | {5})) for values in results[0]['storage'].values())
@@ -0,0 +1,33 @@
+import numpy as np
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.random_streams import connection_streams, stream_keys
+
+
+def parallel_model() -> FlowModel:
+    model = FlowModel()
+    chars = Currency('chars', Position(1, 0), target_value=10)
+    pull = Source('pull', Position(0, 0))
+    model.add_currency(chars)
+    model.add_source(pull)
+    model.add_connection(Connection(pull, chars, rate=1, chance=0.5))
+    model.add_connection(Connection(pull, chars, rate=2, chance=0.5))
+    return model
+
+
+def test_parallel_connections_draw_different_numbers():
+    model = parallel_model()
+    keys = stream_keys(model.connections)
+    assert len(set(keys.values())) == len(model.connections)
+    first, second = connection_streams(model.connections, seed=1).values()
+    assert not np.array_equal(first.peek(100), second.peek(100))
+
+
+def test_stream_keys_are_stable_across_copies():
+    model = parallel_model()
+    copy = model.copy()
+    assert list(stream_keys(model.connections).values()) == list(stream_keys(copy.connections).values())
+    streams = [connection_streams(variant.connections, seed=1) for variant in (model, copy)]
+    for original, copied in zip(*(variant.values() for variant in streams)):
+        assert np.array_equal(original.peek(100), copied.peek(100))
@@ -0,0 +1,35 @@
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.regression import RegressionRunner, model_diff, touched_components
+
+
+def parallel_model() -> FlowModel:
+    model = FlowModel()
+    gold = Currency('gold', Position(1, 0), target_value=50)
+    mine = Source('mine', Position(0, 0))
+    model.add_currency(gold)
+    model.add_source(mine)
+    model.add_connection(Connection(mine, gold, rate=1))
+    model.add_connection(Connection(mine, gold, rate=2))
+    return model
+
+
+def test_change_of_parallel_connection_is_reported():
+    model = parallel_model()
+    previous = RegressionRunner().run(model)
+    model.set_value(model.connections[1], 'rate', 3)
+    results = RegressionRunner().run(model, previous)
+    mine, gold = model.sources[0].id, model.currencies[0].id
+    diff = results['report']['diff']
+    assert diff['connections'] == {'added': [], 'removed': [], 'changed': [f"{mine} -> {gold} #1"]}
+    assert touched_components(diff) == {mine, gold}
+    assert results['report']['affected'] == [0]
+    assert results['report']['changes']
+
+
+def test_added_parallel_connection_is_reported():
+    model = parallel_model()
+    old = model.to_dict()
+    model.add_connection(Connection(model.sources[0], model.currencies[0], rate=4))
+    mine, gold = model.sources[0].id, model.currencies[0].id
+    assert model_diff(old, model.to_dict())['connections']['added'] == [f"{mine} -> {gold} #2"]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+from gmc.scenarios import ScenarioSolver
+
+
+def workshop_model() -> FlowModel:
+    model = FlowModel()
+    gold = Currency('gold', Position(0, 0))
+    wood = Currency('wood', Position(1, 0))
+    tools = Currency('tools', Position(2, 0), target_value=10)
+    relic = Currency('relic', Position(3, 0))
+    mine = Source('mine', Position(0, 1), time_step=2)
+    saw = Source('saw', Position(1, 1))
+    smith = Source('smith', Position(2, 1), time_step=3)
+    model.add_components([gold, wood, tools, relic], [mine, saw, smith], [
+        Connection(mine, gold, rate=4),
+        Connection(saw, wood, rate=2),
+        Connection(gold, smith, rate=2),
+        Connection(wood, smith, rate=1),
+        Connection(smith, tools, rate=1, chance=0.5)
+    ])
+    return model
+
+
+def chain_model() -> FlowModel:
+    model = FlowModel()
+    gold = Currency('gold', Position(0, 0))
+    tools = Currency('tools', Position(1, 0), target_value=10)
+    relic = Currency('relic', Position(2, 0))
+    mine = Source('mine', Position(0, 1), time_step=2)
+    smith = Source('smith', Position(1, 1), time_step=3)
+    model.add_components([gold, tools, relic], [mine, smith], [
+        Connection(mine, gold, rate=4),
+        Connection(gold, smith, rate=2),
+        Connection(smith, tools, rate=1)
+    ])
+    return model
+
+
+def reference(model: FlowModel, scenario: dict) -> dict:
+    variant = model.copy()
+    for comp in variant.get_components():
+        if comp.id in scenario:
+            setattr(comp, 'time_step' if isinstance(comp, Source) else 'target_value', scenario[comp.id])
+    return Simulator(variant).flow_info()
+
+
+@pytest.mark.parametrize('build', [workshop_model, chain_model])
+@pytest.mark.parametrize('flows', [False, True])
+def test_solve_all_matches_simulator(build, flows):
+    model = build()
+    mine, smith = model.sources[0], model.sources[-1]
+    tools, relic = model.currencies[-2], model.currencies[-1]
+    scenarios = [{mine.id: time_step, smith.id: time_step + 1, tools.id: target, relic.id: missing}
+        for time_step in (np.inf, 0.5, 1, 4) for target in (0, 5, 20) for missing in (0, 3)]
+    solver = ScenarioSolver(model)
+    results = solver.solve_all(scenarios, flows)
+    assert solver.skipped > 0 and solver.solved + solver.skipped == len(scenarios)
+    for scenario, result in zip(scenarios, results):
+        expected = reference(model, scenario)
+        reachable = expected['status'] == 0 and expected['steps'] > 0
+        assert reachable == (result['status'] == 0 and result['steps'] > 0)
+        if reachable:
+            assert np.isclose(result['steps'], expected['steps'])
+            if flows:
+                assert np.allclose(result['s'], expected['s'])
+                assert np.allclose(result['c'], expected['c'])
@@ -0,0 +1,30 @@
+from concurrent.futures import Future
+
+from gmc.service import Job, SimulationService, run_job
+from test_simulator import staged_model
+
+
+def test_sensitivity_does_not_depend_on_previous_jobs():
+    model_dict = staged_model().to_dict()
+    before = run_job('sensitivity', model_dict, {})
+    simulated = run_job('simulate', model_dict, {'seed': 1})
+    after = run_job('sensitivity', model_dict, {})
+    assert simulated['stage'] == 2 and isinstance(simulated['stage'], int)
+    assert before == after
+
+
+def test_oldest_finished_jobs_are_forgotten():
+    service = SimulationService(workers=1, max_jobs=3)
+    try:
+        finished = Future()
+        finished.set_result({})
+        jobs = [Job('simulate', 1) for _ in range(4)]
+        for job in jobs[:3]:
+            service.jobs[job.id] = job
+        jobs[1].add_result(0, finished)
+        jobs[2].add_result(0, finished)
+        service.submit({'model': staged_model().to_dict(), 'kind': 'sensitivity'})
+        assert jobs[0].id in service.jobs and jobs[1].id not in service.jobs and jobs[2].id in service.jobs
+        assert len(service.jobs) == 3
+    finally:
+        service.shutdown()
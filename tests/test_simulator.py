@@ -0,0 +1,36 @@
+import pytest
+
+from gmc.components import Connection, Currency, Position, Source
+from gmc.flow_model import FlowModel
+from gmc.mc_simulator import Simulator
+
+
+def staged_model() -> FlowModel:
+    model = FlowModel()
+    gems = Currency('gems', Position(0, 0))
+    chars = Currency('chars', Position(2, 0), target_value=17)
+    daily = Source('daily', Position(0, 1), time_step=1)
+    pull = Source('pull', Position(1, 1), time_step=1)
+    model.add_currency(gems)
+    model.add_currency(chars)
+    model.add_source(daily)
+    model.add_source(pull)
+    model.add_connection(Connection(daily, gems, rate=3))
+    model.add_connection(Connection(gems, pull, rate=2))
+    model.add_connection(Connection(pull, chars, rate=1, chance=0.5))
+    model.add_stage({gems.id: 50, chars.id: 17})
+    return model
+
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_first_passage_of_later_stages_matches_fixed_point(jit):
+    model = staged_model()
+    summaries = []
+    for fixed_point in (None, 10**6):
+        simulator = Simulator(model, seed=3, fixed_point=fixed_point, jit=jit)
+        simulator.run(max_steps=10000)
+        assert simulator.stage() == simulator.num_stages()
+        summaries.append(simulator.summary())
+    assert summaries[0] == summaries[1]
+    gems = model.currencies[0].id
+    assert summaries[0]['currencies'][gems]['first_passage'] is not None
@@ -1,18 +1,26 @@
 """Central Canvas UI"""
 
 import math
+import time
 from typing import Tuple, Callable
-from PySide2.QtGui import QPixmap, QMouseEvent, QWheelEvent
+from PySide2.QtGui import QPixmap, QMouseEvent, QWheelEvent, QPaintEvent
 from PySide2.QtWidgets import QLabel, QSizePolicy
 
 from gmc.flow_model import FlowModel
-from gmc.components import Position, Currency, Source
+from gmc.components import Position, Currency, Source, Group
 from ui.constants import PRIMARY_COLOR, BACKGROUND_COLOR
+from ui.instrumentation import CanvasProfiler
 from ui.painter import Painter
 
 
 class CentralCanvas(QLabel):
-    """Central Canvas Class"""
+    """Central Canvas Class
+
+    Items outside of the visible area are culled when redrawing. With a profiler set the canvas records redraw
+    times, item counts and input to paint latencies and shows them in an overlay.
+    """
+
+    CULL_MARGIN = 3 * Group.SIZE
 
     def __init__(self):
         super().__init__()
@@ -28,17 +36,42 @@ class CentralCanvas(QLabel):
         self.__center = Position()
         self.__selection_callbacks = []
         self.__drag_callbacks = []
+        self.__toggle_callbacks = []
 
         self.__currencies = []
         self.__sources = []
         self.__connections = []
+        self.__groups = []
+        self.__hidden = {}
         self.__drag_start = Position()
+        self.profiler: CanvasProfiler = None
+        self.__pending_input = None
 
     def draw_flow_model(self, flow_model: FlowModel) -> None:
-        """Draws a flow model"""
-        self.__currencies = flow_model.currencies
-        self.__sources = flow_model.sources
+        """Draws a flow model
+        The components of a collapsed group are drawn and hit-tested as a single group node.
+        """
+        self.__groups = []
+        self.__hidden = {}
+        for group in flow_model.groups:
+            members = [comp for comp in flow_model.group_members(group) if comp.id not in self.__hidden]
+            if members:
+                self.__groups.append((group, members))
+            if group.collapsed:
+                self.__hidden.update((comp.id, group) for comp in members)
+        self.__currencies = [comp for comp in flow_model.currencies if comp.id not in self.__hidden]
+        self.__sources = [comp for comp in flow_model.sources if comp.id not in self.__hidden]
         self.__connections = flow_model.connections
+        if self.selected_object is not None and getattr(self.selected_object, 'id', None) in self.__hidden:
+            self.selected_object = None
+        if self.profiler is not None:
+            self.profiler.model_size = (flow_model.num_components(), len(flow_model.connections))
+        self.__redraw()
+
+    def set_profiler(self, profiler: CanvasProfiler):
+        """Starts recording performance samples with the given profiler, or stops recording if it is None"""
+        self.profiler = profiler
+        self.__pending_input = None
         self.__redraw()
 
     def center(self) -> Position:
@@ -68,13 +101,31 @@ class CentralCanvas(QLabel):
         """Add a callback for dragging items"""
         self.__drag_callbacks.append(callback)
 
-    def mousePressEvent(self, ev: QMouseEvent):
-        pos = self.screen_to_world(ev.pos().x(), ev.pos().y())
-        self.__drag_start = pos
+    def connect_group_toggle(self, callback: Callable):
+        """Add a callback for collapsing or expanding a group by double click"""
+        self.__toggle_callbacks.append(callback)
+
+    def __object_at(self, pos: Position):
         select_obj = None
         for comp in self.__components():
             if abs(pos.x - comp.pos.x) < comp.SIZE/2 and abs(pos.y - comp.pos.y) < comp.SIZE/2:
                 select_obj = comp
+        for group, members in self.__groups:
+            if group.collapsed:
+                center = self.__group_pos(members)
+                if abs(pos.x - center.x) < Group.SIZE/2 and abs(pos.y - center.y) < Group.SIZE/2:
+                    select_obj = group
+        return select_obj
+
+    def __input_event(self, kind: str):
+        if self.profiler is not None and self.__pending_input is None:
+            self.__pending_input = (kind, time.perf_counter())
+
+    def mousePressEvent(self, ev: QMouseEvent):
+        self.__input_event('press')
+        pos = self.screen_to_world(ev.pos().x(), ev.pos().y())
+        self.__drag_start = pos
+        select_obj = self.__object_at(pos)
         self.selected_object = select_obj
         for callback in self.__selection_callbacks:
             callback(select_obj)
@@ -83,13 +134,24 @@ class CentralCanvas(QLabel):
 
     def mouseMoveEvent(self, ev: QMouseEvent):
         if self.selected_object is not None:
+            self.__input_event('move')
             pos = self.screen_to_world(ev.pos().x(), ev.pos().y())
             for callback in self.__drag_callbacks:
                 callback(self.selected_object, Position(pos.x - self.__drag_start.x, pos.y - self.__drag_start.y))
             self.__drag_start = pos
         return super().mouseMoveEvent(ev)
 
+    def mouseDoubleClickEvent(self, ev: QMouseEvent):
+        obj = self.__object_at(self.screen_to_world(ev.pos().x(), ev.pos().y()))
+        if obj is not None and not isinstance(obj, Group):
+            obj = next((group for group, members in self.__groups if obj in members), None)
+        if obj is not None:
+            for callback in self.__toggle_callbacks:
+                callback(obj)
+        return super().mouseDoubleClickEvent(ev)
+
     def wheelEvent(self, ev: QWheelEvent):
+        self.__input_event('wheel')
         factor = math.exp(ev.delta() / 1000)
         pos = self.screen_to_world(ev.pos().x(), ev.pos().y())
         self.ppu = min(max(self.ppu * factor, 10), 1000)
@@ -98,23 +160,82 @@ class CentralCanvas(QLabel):
         self.__redraw()
         return super().wheelEvent(ev)
 
+    def paintEvent(self, ev: QPaintEvent):
+        super().paintEvent(ev)
+        if self.profiler is not None and self.__pending_input is not None:
+            kind, start = self.__pending_input
+            self.profiler.record_latency(kind, time.perf_counter() - start)
+            self.__pending_input = None
 
     def __redraw(self):
+        start = time.perf_counter()
         canvas = self.pixmap()
         canvas.fill(BACKGROUND_COLOR)
         painter = Painter(canvas, self)
+        view = (self.screen_to_world(0, canvas.height()), self.screen_to_world(canvas.width(), 0))
+        centers = {group.id: self.__group_pos(members) for group, members in self.__groups if group.collapsed}
+        drawn = set()
+        num_drawn, num_culled = 0, 0
         for connection in self.__connections:
-            painter.drawEdge(connection)
-        for currency in self.__currencies:
-            painter.drawCurrency(currency)
-        for source in self.__sources:
-            painter.drawSource(source)
+            source_group = self.__hidden.get(connection.source.id)
+            target_group = self.__hidden.get(connection.target.id)
+            key = (connection.source.id if source_group is None else source_group.id,
+                   connection.target.id if target_group is None else target_group.id)
+            if source_group is not None or target_group is not None:
+                if source_group is target_group or key in drawn:
+                    continue
+                drawn.add(key)
+            source_pos, target_pos = centers.get(key[0], connection.source.pos), centers.get(key[1], connection.target.pos)
+            if not self.__visible(view, source_pos, target_pos):
+                num_culled += 1
+                continue
+            num_drawn += 1
+            painter.drawEdge(connection, source_pos, target_pos)
+        for group, members in self.__groups:
+            if group.collapsed:
+                lower = upper = centers[group.id]
+            else:
+                lower = Position(min(comp.pos.x for comp in members) - Source.SIZE, min(comp.pos.y for comp in members) - Source.SIZE)
+                upper = Position(max(comp.pos.x for comp in members) + Source.SIZE, max(comp.pos.y for comp in members) + Source.SIZE)
+            if not self.__visible(view, lower, upper):
+                num_culled += 1
+                continue
+            num_drawn += 1
+            if group.collapsed:
+                painter.drawGroup(group, centers[group.id], highlight=self.selected_object is group)
+            else:
+                painter.drawGroupFrame(group, lower, upper)
+        for comp in self.__components():
+            if not self.__visible(view, comp.pos):
+                num_culled += 1
+                continue
+            num_drawn += 1
+            if isinstance(comp, Currency):
+                painter.drawCurrency(comp)
+            else:
+                painter.drawSource(comp)
         if not self.selected_object is None and isinstance(self.selected_object, Currency):
             painter.drawCurrency(self.selected_object, highlight=True)
         elif not self.selected_object is None and isinstance(self.selected_object, Source):
             painter.drawSource(self.selected_object, highlight=True)
+        if self.profiler is not None:
+            painter.drawOverlay(self.profiler.overlay_lines())
         painter.end()
         self.setPixmap(canvas)
+        if self.profiler is not None:
+            self.profiler.record_frame(time.perf_counter() - start, num_drawn, num_culled)
+
+    def __visible(self, view: tuple, first: Position, second: Position = None) -> bool:
+        """Returns whether the box spanned by the positions, including labels, intersects the view"""
+        second = first if second is None else second
+        lower, upper = view
+        margin = self.CULL_MARGIN
+        return (min(first.x, second.x) < upper.x + margin and max(first.x, second.x) > lower.x - margin
+            and min(first.y, second.y) < upper.y + margin and max(first.y, second.y) > lower.y - margin)
 
     def __components(self):
         return self.__currencies + self.__sources
+
+    @staticmethod
+    def __group_pos(members: list) -> Position:
+        return Position(sum(comp.pos.x for comp in members) / len(members), sum(comp.pos.y for comp in members) / len(members))
@@ -0,0 +1,86 @@
+"""Balance Dialog UI"""
+
+from PySide2.QtCore import Qt, QThread, Signal
+from PySide2.QtWidgets import QDialog, QDialogButtonBox, QFormLayout, QDoubleSpinBox, QSpinBox
+
+from gmc.balancing import RateBalancer, Tunable
+from gmc.flow_model import FlowModel
+
+
+class BalanceDialog(QDialog):
+    """Balance Dialog Class"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Balance Rates")
+        self.setWindowModality(Qt.ApplicationModal)
+        self.setMinimumWidth(280)
+
+        layout = QFormLayout()
+        self.setLayout(layout)
+
+        self.goal_edit = QDoubleSpinBox()
+        self.goal_edit.setMinimum(1)
+        self.goal_edit.setMaximum(1000000)
+        self.goal_edit.setValue(100)
+        layout.addRow('Goal Time', self.goal_edit)
+
+        self.tolerance_edit = QDoubleSpinBox()
+        self.tolerance_edit.setSuffix(' %')
+        self.tolerance_edit.setMinimum(0.1)
+        self.tolerance_edit.setMaximum(50)
+        self.tolerance_edit.setValue(5)
+        layout.addRow('Tolerance', self.tolerance_edit)
+
+        self.factor_edit = QDoubleSpinBox()
+        self.factor_edit.setPrefix('x ')
+        self.factor_edit.setMinimum(1.1)
+        self.factor_edit.setMaximum(100)
+        self.factor_edit.setValue(4)
+        layout.addRow('Max. Change', self.factor_edit)
+
+        self.budget_edit = QSpinBox()
+        self.budget_edit.setMinimum(1)
+        self.budget_edit.setMaximum(1000)
+        self.budget_edit.setValue(32)
+        layout.addRow('Simulations', self.budget_edit)
+
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addRow(self.buttons)
+
+    def parameters(self, model: FlowModel):
+        """Returns all connection rates and source time steps as tunable parameters"""
+        factor = self.factor_edit.value()
+        params, parallel = [], {}
+        for conn in model.connections:
+            pair = f"{conn.source.id} -> {conn.target.id}"
+            parallel[pair] = parallel.get(pair, -1) + 1
+            if conn.rate > 0:
+                params.append(Tunable(f"{pair} #{parallel[pair]}", 'rate', conn.rate / factor, conn.rate * factor))
+        params.extend(Tunable(source.id, 'time_step', source.time_step / factor, source.time_step * factor)
+            for source in model.sources if source.time_step > 0)
+        return params
+
+
+class BalanceWorker(QThread):
+    """Balance Worker Class
+
+    Runs a rate balancer outside of the GUI thread and reports the number of finished simulations.
+    """
+
+    progress = Signal(int, int)
+
+    def __init__(self, balancer: RateBalancer, parent=None):
+        super().__init__(parent)
+        self.balancer = balancer
+        self.result = None
+
+    def run(self):
+        self.result = self.balancer.optimize(self.progress.emit)
+
+    def cancel(self):
+        """Stops the balancer at its next surrogate evaluation"""
+        self.balancer.cancel()
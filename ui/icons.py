@@ -0,0 +1,10 @@
+"""UI Icons"""
+
+from functools import lru_cache
+from PySide2.QtGui import QIcon
+
+
+@lru_cache(maxsize=None)
+def load_icon(filename: str) -> QIcon:
+    """Returns the icon of an image file, every file is only loaded once"""
+    return QIcon(filename)
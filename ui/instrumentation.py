@@ -0,0 +1,111 @@
+"""Canvas performance instrumentation"""
+
+import json
+import logging
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from typing import List
+import numpy as np
+
+
+class CanvasProfiler():
+    """Canvas Profiler Class
+
+    Collects the duration of canvas redraws, the number of drawn and culled items, the duration of the model
+    change notifications and the latency from mouse events to the next paint over a window of recent samples.
+    Summaries are written as json lines to a rotating log file every few seconds, together with the model size,
+    such that runs on different releases and models can be compared.
+    """
+
+    WINDOW = 240
+    LOG_INTERVAL = 5.
+    LOG_BYTES = 1 << 20
+    LOG_BACKUPS = 3
+    LOG_FILE = 'gmc-canvas.log'
+
+    def __init__(self, filename: str = LOG_FILE):
+        self.frames = deque(maxlen=self.WINDOW)
+        self.drawn = deque(maxlen=self.WINDOW)
+        self.culled = deque(maxlen=self.WINDOW)
+        self.notifications = deque(maxlen=self.WINDOW)
+        self.latency = {'press': deque(maxlen=self.WINDOW), 'move': deque(maxlen=self.WINDOW),
+                        'wheel': deque(maxlen=self.WINDOW)}
+        self.model_size = (0, 0)
+        self.filename = filename
+        self._logger = None
+        self._handler = None
+        self._last_log = time.perf_counter()
+        if filename is not None:
+            self._handler = RotatingFileHandler(filename, maxBytes=self.LOG_BYTES, backupCount=self.LOG_BACKUPS)
+            self._handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger = logging.getLogger(f"gmc.canvas.{id(self)}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(self._handler)
+
+    def record_frame(self, seconds: float, drawn: int, culled: int):
+        """Adds the duration and item counts of a redraw"""
+        self.frames.append(seconds)
+        self.drawn.append(drawn)
+        self.culled.append(culled)
+        self._maybe_log()
+
+    def record_notify(self, callbacks: int, seconds: float):  # pylint: disable=unused-argument
+        """Adds the duration of a model change notification"""
+        self.notifications.append(seconds)
+
+    def record_latency(self, kind: str, seconds: float):
+        """Adds the time from an input event to the end of the following paint"""
+        self.latency[kind].append(seconds)
+
+    @staticmethod
+    def _stats(samples) -> dict:
+        if len(samples) == 0:
+            return {'count': 0}
+        values = np.fromiter(samples, dtype=float) * 1000
+        return {'count': len(values), 'mean': float(values.mean()), 'p95': float(np.percentile(values, 95)),
+                'max': float(values.max())}
+
+    def summary(self) -> dict:
+        """Returns statistics of the recent samples in milliseconds"""
+        return {
+            'time': time.time(),
+            'components': self.model_size[0],
+            'connections': self.model_size[1],
+            'redraw': self._stats(self.frames),
+            'drawn': float(np.mean(self.drawn)) if self.drawn else 0.,
+            'culled': float(np.mean(self.culled)) if self.culled else 0.,
+            'notify': self._stats(self.notifications),
+            'latency': {kind: self._stats(samples) for kind, samples in self.latency.items()}
+        }
+
+    def overlay_lines(self) -> List[str]:
+        """Returns the text of the on-canvas overlay"""
+        redraw = self._stats(self.frames)
+        lines = [f"redraw {redraw.get('mean', 0):.1f} ms (p95 {redraw.get('p95', 0):.1f})",
+                 f"items {self.drawn[-1] if self.drawn else 0} drawn / {self.culled[-1] if self.culled else 0} culled"]
+        notify = self._stats(self.notifications)
+        if notify['count'] > 0:
+            lines.append(f"model notify {notify['mean']:.1f} ms")
+        for kind, samples in self.latency.items():
+            stats = self._stats(samples)
+            if stats['count'] > 0:
+                lines.append(f"{kind} to paint {stats['mean']:.1f} ms (p95 {stats['p95']:.1f})")
+        return lines
+
+    def _maybe_log(self):
+        now = time.perf_counter()
+        if self._logger is None or now - self._last_log < self.LOG_INTERVAL:
+            return
+        self._last_log = now
+        self._logger.info(json.dumps(self.summary()))
+
+    def close(self):
+        """Writes a last summary and closes the log file"""
+        if self._logger is None:
+            return
+        self._logger.info(json.dumps(self.summary()))
+        self._logger.removeHandler(self._handler)
+        self._handler.close()
+        self._logger = None
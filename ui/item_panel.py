@@ -1,99 +1,217 @@
 """Item Panel UI"""
 
-from PySide2.QtCore import Qt, QSize, Signal
-from PySide2.QtGui import QIcon
-from PySide2.QtWidgets import QWidget, QScrollArea, QHBoxLayout, QVBoxLayout, QLabel, QFrame, QPushButton, QToolButton, QDoubleSpinBox
+from PySide2.QtCore import Qt, QSize, QRect, QEvent, QModelIndex, QAbstractListModel, Signal
+from PySide2.QtGui import QColor
+from PySide2.QtWidgets import QWidget, QScrollArea, QHBoxLayout, QVBoxLayout, QLabel, QFrame, QPushButton, QDoubleSpinBox, \
+    QListView, QStyledItemDelegate, QStyle, QAbstractItemView
 
 from ui.constants import PRIMARY_COLOR, DANGER_COLOR
+from ui.icons import load_icon
 from gmc.components import Component, Connection, Source, Currency
 
 
-class InputWidget(QWidget):
-    """Input Widget Class"""
+RATE_ROLE = Qt.UserRole + 1
+CHANCE_ROLE = Qt.UserRole + 2
+CONNECTION_ROLE = Qt.UserRole + 3
 
-    def __init__(self, connection: Connection):
-        super().__init__()
-        self.connection = connection
 
-        layout = QVBoxLayout()
-        self.setLayout(layout)
+def _spin_box(minimum: float, maximum: float) -> QDoubleSpinBox:
+    edit = QDoubleSpinBox()
+    edit.setMinimum(minimum)
+    edit.setMaximum(maximum)
+    edit.setStyleSheet(f"color: {PRIMARY_COLOR}")
+    edit.wheelEvent = lambda event: None
+    return edit
 
-        title = QLabel(connection.source.name)
-        layout.addWidget(title)
 
-        controls = QHBoxLayout()
-        control_widget = QWidget()
-        control_widget.setLayout(controls)
-        layout.addWidget(control_widget)
-
-        edit = QDoubleSpinBox()
-        edit.setMinimum(0.01)
-        edit.setMaximum(10000)
-        edit.setValue(connection.rate)
-        edit.setStyleSheet(f"color: {PRIMARY_COLOR}")
-        edit.wheelEvent = lambda event: None
-        edit.valueChanged.connect(self.change_value)
-        controls.addWidget(edit)
-
-        delete_button = QToolButton()
-        delete_button.setToolButtonStyle(Qt.ToolButtonIconOnly)
-        delete_button.setIcon(QIcon('img/xmark-solid.png'))
-        delete_button.setIconSize(QSize(18, 18))
-        self.deleted = delete_button.clicked
-        controls.addWidget(delete_button)
+def _set_value(edit: QDoubleSpinBox, value: float):
+    """Sets a spin box value without emitting a change event"""
+    edit.blockSignals(True)
+    edit.setValue(value)
+    edit.blockSignals(False)
 
-    def change_value(self, value):
-        """Resolve change value event"""
-        self.connection.rate = value
 
+class ConnectionListModel(QAbstractListModel):
+    """Connection List Model Class
 
-class OutputWidget(QWidget):
-    """Output Widget Class"""
+    Exposes the input or output connections of a source to a list view. The display role is the name of the
+    connected currency, rate and chance have their own roles and can be edited. Edits are not applied here but
+    reported with value_changed, so they go through the flow model and can be undone.
+    """
 
-    def __init__(self, connection: Connection):
+    value_changed = Signal(object, str, float)
+
+    def __init__(self, outputs: bool):
         super().__init__()
-        self.connection = connection
+        self.outputs = outputs
+        self.connections = []
+
+    def set_connections(self, connections):
+        """Replaces the listed connections"""
+        self.beginResetModel()
+        self.connections = list(connections)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):  # pylint: disable=invalid-name
+        return 0 if parent.isValid() else len(self.connections)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        connection = self.connections[index.row()]
+        if role == Qt.DisplayRole:
+            return connection.target.name if self.outputs else connection.source.name
+        if role == RATE_ROLE:
+            return connection.rate
+        if role == CHANCE_ROLE:
+            return connection.chance
+        if role == CONNECTION_ROLE:
+            return connection
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):  # pylint: disable=invalid-name
+        if not index.isValid():
+            return False
+        connection = self.connections[index.row()]
+        if role == RATE_ROLE:
+            self.value_changed.emit(connection, 'rate', value)
+        elif role == CHANCE_ROLE and self.outputs:
+            self.value_changed.emit(connection, 'chance', value)
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemIsEditable
+
+
+class ConnectionEditor(QWidget):
+    """Connection Editor Class"""
+
+    changed = Signal()
+
+    def __init__(self, parent: QWidget, outputs: bool):
+        super().__init__(parent)
+        controls = QHBoxLayout()
+        controls.setContentsMargins(4, 0, 4, 0)
+        self.setLayout(controls)
 
-        layout = QVBoxLayout()
-        self.setLayout(layout)
+        self.rate = _spin_box(0.01, 10000)
+        self.rate.valueChanged.connect(self.changed.emit)
+        controls.addWidget(self.rate)
 
-        title = QLabel(connection.target.name)
-        layout.addWidget(title)
+        self.chance = None
+        if outputs:
+            self.chance = _spin_box(0.001, 1)
+            self.chance.setPrefix('p ')
+            self.chance.setDecimals(3)
+            self.chance.setSingleStep(0.01)
+            self.chance.valueChanged.connect(self.changed.emit)
+            controls.addWidget(self.chance)
 
-        controls = QHBoxLayout()
-        control_widget = QWidget()
-        control_widget.setLayout(controls)
-        layout.addWidget(control_widget)
-
-        edit = QDoubleSpinBox()
-        edit.setMinimum(0.01)
-        edit.setMaximum(10000)
-        edit.setValue(connection.rate)
-        edit.setStyleSheet(f"color: {PRIMARY_COLOR}")
-        edit.wheelEvent = lambda event: None
-        edit.valueChanged.connect(self.change_value)
-        controls.addWidget(edit)
-
-        delete_button = QToolButton()
-        delete_button.setToolButtonStyle(Qt.ToolButtonIconOnly)
-        delete_button.setIcon(QIcon('img/xmark-solid.png'))
-        delete_button.setIconSize(QSize(18, 18))
-        self.deleted = delete_button.clicked
-        controls.addWidget(delete_button)
 
-    def change_value(self, value):
-        """Resolve change value event"""
-        self.connection.rate = value
+class ConnectionDelegate(QStyledItemDelegate):
+    """Connection Delegate Class
+
+    Paints a connection row with the connected currency, its rate and chance and a delete icon. Spin boxes are
+    only created for the row that is being edited.
+    """
+
+    ROW_HEIGHT = 48
+    ICON_SIZE = 18
+
+    delete_requested = Signal(Connection)
+
+    def __init__(self, outputs: bool):
+        super().__init__()
+        self.outputs = outputs
+
+    def _icon_rect(self, rect: QRect) -> QRect:
+        return QRect(rect.right() - self.ICON_SIZE - 6, rect.center().y() - self.ICON_SIZE // 2, self.ICON_SIZE, self.ICON_SIZE)
+
+    def sizeHint(self, option, index):  # pylint: disable=invalid-name
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        half = self.ROW_HEIGHT // 2
+        text_rect = option.rect.adjusted(6, 0, -self.ICON_SIZE - 12, 0)
+        painter.setPen(option.palette.text().color())
+        painter.drawText(text_rect.adjusted(0, 0, 0, -half), Qt.AlignLeft | Qt.AlignVCenter, index.data(Qt.DisplayRole))
+        values = f"{index.data(RATE_ROLE):.2f}"
+        if self.outputs:
+            values += f"    p {index.data(CHANCE_ROLE):.3f}"
+        painter.setPen(QColor(PRIMARY_COLOR))
+        painter.drawText(text_rect.adjusted(0, half, 0, 0), Qt.AlignLeft | Qt.AlignVCenter, values)
+        load_icon('img/xmark-solid.png').paint(painter, self._icon_rect(option.rect))
+        painter.restore()
+
+    def createEditor(self, parent, option, index):  # pylint: disable=invalid-name
+        editor = ConnectionEditor(parent, self.outputs)
+        editor.changed.connect(lambda: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):  # pylint: disable=invalid-name
+        _set_value(editor.rate, index.data(RATE_ROLE))
+        if editor.chance is not None:
+            _set_value(editor.chance, index.data(CHANCE_ROLE))
+
+    def setModelData(self, editor, model, index):  # pylint: disable=invalid-name
+        model.setData(index, editor.rate.value(), RATE_ROLE)
+        if editor.chance is not None:
+            model.setData(index, editor.chance.value(), CHANCE_ROLE)
+
+    def updateEditorGeometry(self, editor, option, index):  # pylint: disable=invalid-name
+        editor.setGeometry(option.rect.adjusted(0, self.ROW_HEIGHT // 2 - 2, -self.ICON_SIZE - 12, 0))
+
+    def editorEvent(self, event, model, option, index):  # pylint: disable=invalid-name
+        if event.type() == QEvent.MouseButtonRelease and self._icon_rect(option.rect).contains(event.pos()):
+            self.delete_requested.emit(index.data(CONNECTION_ROLE))
+            return True
+        return super().editorEvent(event, model, option, index)
+
+
+class ConnectionList(QListView):
+    """Connection List Class
+
+    List view of the connections of a source. Only the visible rows are painted, so sources with hundreds of
+    connections are displayed as fast as sources with a few.
+    """
+
+    MAX_VISIBLE_ROWS = 6
+
+    def __init__(self, outputs: bool):
+        super().__init__()
+        self.list_model = ConnectionListModel(outputs)
+        self.delegate = ConnectionDelegate(outputs)
+        self.setModel(self.list_model)
+        self.setItemDelegate(self.delegate)
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setEditTriggers(QAbstractItemView.CurrentChanged | QAbstractItemView.SelectedClicked)
+        self.deleted = self.delegate.delete_requested
+        self.value_changed = self.list_model.value_changed
+
+    def set_connections(self, connections):
+        """Shows the given connections"""
+        self.list_model.set_connections(connections)
+        rows = min(max(len(connections), 1), self.MAX_VISIBLE_ROWS)
+        self.setFixedHeight(rows * ConnectionDelegate.ROW_HEIGHT + 2 * self.frameWidth())
 
 
 class SourcePanel(QWidget):
     """Source Panel Class"""
 
     connection_deleted = Signal(Connection)
+    value_changed = Signal(object, str, float)
 
-    def __init__(self, source: Source):
+    def __init__(self):
         super().__init__()
-        self.source = source
+        self.source = None
 
         layout = QVBoxLayout()
         self.setLayout(layout)
@@ -102,9 +220,9 @@ class SourcePanel(QWidget):
         title.setStyleSheet('font-size: 10pt;')
         layout.addWidget(title)
 
-        name = QLabel(source.name)
-        name.setStyleSheet('font-size: 16pt;')
-        layout.addWidget(name)
+        self.name = QLabel()
+        self.name.setStyleSheet('font-size: 16pt;')
+        layout.addWidget(self.name)
 
         sep1 = QFrame()
         sep1.setFrameShape(QFrame.HLine)
@@ -114,14 +232,9 @@ class SourcePanel(QWidget):
         time_label = QLabel('Time Step')
         layout.addWidget(time_label)
 
-        edit = QDoubleSpinBox()
-        edit.setMinimum(0)
-        edit.setMaximum(1000)
-        edit.setValue(source.time_step)
-        edit.setStyleSheet(f"color: {PRIMARY_COLOR}")
-        edit.wheelEvent = lambda event: None
-        edit.valueChanged.connect(self.change_value)
-        layout.addWidget(edit)
+        self.edit = _spin_box(0, 1000)
+        self.edit.valueChanged.connect(self.change_value)
+        layout.addWidget(self.edit)
 
         sep2 = QFrame()
         sep2.setFrameShape(QFrame.HLine)
@@ -132,10 +245,10 @@ class SourcePanel(QWidget):
         text1.setStyleSheet('font-size: 12pt;')
         layout.addWidget(text1)
 
-        for connection in source.inputs:
-            widget = InputWidget(connection)
-            widget.deleted.connect(self._notify_connection_deleted(connection))
-            layout.addWidget(widget)
+        self.inputs = ConnectionList(outputs=False)
+        self.inputs.deleted.connect(self.connection_deleted.emit)
+        self.inputs.value_changed.connect(self.value_changed.emit)
+        layout.addWidget(self.inputs)
 
         input_button = QPushButton('Add Input')
         self.add_input = input_button.clicked
@@ -150,10 +263,10 @@ class SourcePanel(QWidget):
         text2.setStyleSheet('font-size: 12pt;')
         layout.addWidget(text2)
 
-        for connection in source.connections:
-            widget = OutputWidget(connection)
-            widget.deleted.connect(self._notify_connection_deleted(connection))
-            layout.addWidget(widget)
+        self.outputs = ConnectionList(outputs=True)
+        self.outputs.deleted.connect(self.connection_deleted.emit)
+        self.outputs.value_changed.connect(self.value_changed.emit)
+        layout.addWidget(self.outputs)
 
         connection_button = QPushButton('Add Output')
         self.add_connection = connection_button.clicked
@@ -169,20 +282,27 @@ class SourcePanel(QWidget):
         self.deleted = delete_button.clicked
         layout.addWidget(delete_button)
 
+    def bind(self, source: Source):
+        """Shows the properties of a source"""
+        self.source = source
+        self.name.setText(source.name)
+        _set_value(self.edit, source.time_step)
+        self.inputs.set_connections(source.inputs)
+        self.outputs.set_connections(source.connections)
+
     def change_value(self, value):
         """Resolve change time step value event"""
-        self.source.time_step = value
-
-    def _notify_connection_deleted(self, connection: Connection):
-        return lambda: self.connection_deleted.emit(connection)
+        self.value_changed.emit(self.source, 'time_step', value)
 
 
 class CurrencyPanel(QWidget):
     """Curency Panel Class"""
 
-    def __init__(self, currency: Currency):
+    value_changed = Signal(object, str, float)
+
+    def __init__(self):
         super().__init__()
-        self.currency = currency
+        self.currency = None
 
         layout = QVBoxLayout()
         self.setLayout(layout)
@@ -191,9 +311,9 @@ class CurrencyPanel(QWidget):
         title.setStyleSheet('font-size: 10pt;')
         layout.addWidget(title)
 
-        name = QLabel(currency.name)
-        name.setStyleSheet('font-size: 16pt;')
-        layout.addWidget(name)
+        self.name = QLabel()
+        self.name.setStyleSheet('font-size: 16pt;')
+        layout.addWidget(self.name)
 
         sep1 = QFrame()
         sep1.setFrameShape(QFrame.HLine)
@@ -203,14 +323,9 @@ class CurrencyPanel(QWidget):
         target_label = QLabel('Target Value')
         layout.addWidget(target_label)
 
-        edit = QDoubleSpinBox()
-        edit.setMinimum(0)
-        edit.setMaximum(1000000)
-        edit.setValue(currency.target_value)
-        edit.setStyleSheet(f"color: {PRIMARY_COLOR}")
-        edit.wheelEvent = lambda event: None
-        edit.valueChanged.connect(self.change_value)
-        layout.addWidget(edit)
+        self.edit = _spin_box(0, 1000000)
+        self.edit.valueChanged.connect(self.change_value)
+        layout.addWidget(self.edit)
 
         sep2 = QFrame()
         sep2.setFrameShape(QFrame.HLine)
@@ -222,15 +337,25 @@ class CurrencyPanel(QWidget):
         self.deleted = delete_button.clicked
         layout.addWidget(delete_button)
 
+    def bind(self, currency: Currency):
+        """Shows the properties of a currency"""
+        self.currency = currency
+        self.name.setText(currency.name)
+        _set_value(self.edit, currency.target_value)
+
     def change_value(self, value):
         """Resolve change target value event"""
-        self.currency.target_value = value
+        self.value_changed.emit(self.currency, 'target_value', value)
 
 
 class ItemPanel(QScrollArea):
-    """Item Panel Class"""
+    """Item Panel Class
+
+    Both item panels are created once and rebound to the selected item instead of being rebuilt.
+    """
 
     updated = Signal(Connection)
+    value_changed = Signal(object, str, float)
     deleted = Signal()
     add_input = Signal()
     add_connection = Signal()
@@ -249,20 +374,26 @@ class ItemPanel(QScrollArea):
         widget.setLayout(self.content)
         self.setWidget(widget)
 
+        self.currency_panel = CurrencyPanel()
+        self.currency_panel.deleted.connect(self.deleted.emit)
+        self.currency_panel.value_changed.connect(self.value_changed.emit)
+        self.currency_panel.hide()
+        self.content.addWidget(self.currency_panel)
+
+        self.source_panel = SourcePanel()
+        self.source_panel.connection_deleted.connect(self.updated.emit)
+        self.source_panel.deleted.connect(self.deleted.emit)
+        self.source_panel.value_changed.connect(self.value_changed.emit)
+        self.source_panel.add_input.connect(self.add_input.emit)
+        self.source_panel.add_connection.connect(self.add_connection.emit)
+        self.source_panel.hide()
+        self.content.addWidget(self.source_panel)
+
     def set_item(self, item: Component):
         """Set item to be displayed"""
-        prev = self.content.takeAt(0)
-        if prev is not None:
-            prev.widget().deleteLater()
-
         if isinstance(item, Currency):
-            panel = CurrencyPanel(item)
-            panel.deleted.connect(self.deleted.emit)
-            self.content.addWidget(panel)
+            self.currency_panel.bind(item)
         elif isinstance(item, Source):
-            panel = SourcePanel(item)
-            panel.connection_deleted.connect(self.updated.emit)
-            panel.deleted.connect(self.deleted.emit)
-            panel.add_input.connect(self.add_input.emit)
-            panel.add_connection.connect(self.add_connection.emit)
-            self.content.addWidget(panel)
+            self.source_panel.bind(item)
+        self.currency_panel.setVisible(isinstance(item, Currency))
+        self.source_panel.setVisible(isinstance(item, Source))
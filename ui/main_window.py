@@ -1,9 +1,10 @@
 """Main Window UI"""
 
 from PySide2.QtCore import Qt, QSize
-from PySide2.QtGui import QIcon
-from PySide2.QtWidgets import QMainWindow, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QSizePolicy
+from PySide2.QtGui import QKeySequence
+from PySide2.QtWidgets import QMainWindow, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QSizePolicy, QShortcut
 
+from ui.icons import load_icon
 from ui.menu_panel import MenuPanel
 from ui.central_canvas import CentralCanvas
 from ui.item_panel import ItemPanel
@@ -16,7 +17,7 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         self.setWindowTitle('Gacha Monte Carlo')
-        self.setWindowIcon(QIcon('img/gmc-logo.png'))
+        self.setWindowIcon(load_icon('img/gmc-logo.png'))
 
         layout = QHBoxLayout()
 
@@ -33,7 +34,7 @@ class MainWindow(QMainWindow):
         buttons.setAlignment(Qt.AlignCenter)
         play_button = QPushButton()
         play_button.setMinimumWidth(112)
-        play_button.setIcon(QIcon('img/play-solid.png'))
+        play_button.setIcon(load_icon('img/play-solid.png'))
         play_button.setIconSize(QSize(26, 26))
         self.start_simulation = play_button.clicked
         buttons.addWidget(play_button)
@@ -53,3 +54,7 @@ class MainWindow(QMainWindow):
         widget = QWidget()
         widget.setLayout(layout)
         self.setCentralWidget(widget)
+
+        self.undo = QShortcut(QKeySequence.Undo, self).activated
+        self.redo = QShortcut(QKeySequence.Redo, self).activated
+        self.toggle_profiler = QShortcut(QKeySequence(Qt.Key_F12), self).activated
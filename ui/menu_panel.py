@@ -52,3 +52,19 @@ class MenuPanel(QWidget):
         load_button.setStyleSheet(f"color: {SECONDARY_COLOR}; border: 2px solid {SECONDARY_COLOR};")
         self.load_model = load_button.clicked
         layout.addWidget(load_button)
+
+        autosave_button = QPushButton('Autosave')
+        autosave_button.setCheckable(True)
+        autosave_button.setStyleSheet(f"color: {SECONDARY_COLOR}; border: 2px solid {SECONDARY_COLOR};")
+        self.toggle_autosave = autosave_button.toggled
+        layout.addWidget(autosave_button)
+
+        arrange_button = QPushButton('Arrange Graph')
+        arrange_button.setStyleSheet(f"color: {SECONDARY_COLOR}; border: 2px solid {SECONDARY_COLOR};")
+        self.arrange_model = arrange_button.clicked
+        layout.addWidget(arrange_button)
+
+        balance_button = QPushButton('Balance Rates')
+        balance_button.setStyleSheet(f"color: {SECONDARY_COLOR}; border: 2px solid {SECONDARY_COLOR};")
+        self.balance_model = balance_button.clicked
+        layout.addWidget(balance_button)
@@ -3,9 +3,9 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from PySide2.QtCore import Qt, QRectF
-from PySide2.QtGui import QPainter, QPixmap, QPen, QBrush
+from PySide2.QtGui import QPainter, QPixmap, QPen, QBrush, QColor
 
-from gmc.components import Position, Connection, Source, Currency
+from gmc.components import Position, Connection, Source, Currency, Group
 from ui.constants import (PRIMARY_COLOR, PRIMARY_LIGHT_COLOR, PRIMARY_DARK_COLOR,
     SECONDARY_COLOR, SECONDARY_LIGHT_COLOR, SECONDARY_DARK_COLOR)
 
@@ -28,10 +28,10 @@ class Painter(QPainter):
         self.drawLine(x, 0, x, height)
         self.drawLine(0, y, width, y)
 
-    def drawEdge(self, connection: Connection):  # pylint: disable=invalid-name
-        """Draws a line between source and target"""
-        x1, y1 = self.__canvas.world_to_screen(connection.source.pos)
-        x2, y2 = self.__canvas.world_to_screen(connection.target.pos)
+    def drawEdge(self, connection: Connection, source_pos: Position = None, target_pos: Position = None):  # pylint: disable=invalid-name
+        """Draws a line between source and target, or the given positions of collapsed groups"""
+        x1, y1 = self.__canvas.world_to_screen(source_pos if source_pos is not None else connection.source.pos)
+        x2, y2 = self.__canvas.world_to_screen(target_pos if target_pos is not None else connection.target.pos)
         self.setPen(QPen(Qt.gray, 3))
         self.drawLine(x1, y1, x2, y2)
 
@@ -60,3 +60,37 @@ class Painter(QPainter):
             self.setBrush(QBrush(PRIMARY_COLOR, Qt.SolidPattern))
         self.drawRect(x, y, size, size)
         self.drawText(QRectF(x-2*size, y-size/2-10, 5*size, size), Qt.AlignCenter, source.name)
+
+    def drawGroup(self, group: Group, pos: Position, highlight: bool = False):  # pylint: disable=invalid-name
+        """Draws a collapsed group object"""
+        x, y = self.__canvas.world_to_screen(pos)
+        size = self.__canvas.ppu * Group.SIZE
+        x, y = x - size/2, y - size/2
+        self.setPen(QPen(QColor(SECONDARY_DARK_COLOR), 2))
+        if highlight:
+            self.setBrush(QBrush(SECONDARY_LIGHT_COLOR, Qt.SolidPattern))
+        else:
+            self.setBrush(QBrush(SECONDARY_COLOR, Qt.SolidPattern))
+        self.drawRoundedRect(QRectF(x, y, size, size), size/5, size/5)
+        self.drawText(QRectF(x-2*size, y-size/2-10, 5*size, size), Qt.AlignCenter, group.name)
+
+    def drawGroupFrame(self, group: Group, lower: Position, upper: Position):  # pylint: disable=invalid-name
+        """Draws a dashed frame around the components of an expanded group"""
+        x1, y1 = self.__canvas.world_to_screen(lower)
+        x2, y2 = self.__canvas.world_to_screen(upper)
+        self.setPen(QPen(QColor(SECONDARY_DARK_COLOR), 1, Qt.DashLine))
+        self.setBrush(Qt.NoBrush)
+        self.drawRect(QRectF(x1, y2, x2-x1, y1-y2))
+        self.drawText(QRectF(x1, y2-20, x2-x1, 20), Qt.AlignLeft | Qt.AlignBottom, group.name)
+
+    def drawOverlay(self, lines: list):  # pylint: disable=invalid-name
+        """Draws lines of text in a box in the top left corner of the canvas"""
+        metrics = self.fontMetrics()
+        height = metrics.height()
+        width = max((metrics.horizontalAdvance(line) for line in lines), default=0)
+        self.setPen(Qt.NoPen)
+        self.setBrush(QBrush(QColor(0, 0, 0, 160), Qt.SolidPattern))
+        self.drawRect(QRectF(4, 4, width + 12, height * len(lines) + 8))
+        self.setPen(QPen(Qt.white))
+        for idx, line in enumerate(lines):
+            self.drawText(QRectF(10, 8 + idx * height, width + 4, height), Qt.AlignLeft | Qt.AlignVCenter, line)
@@ -29,16 +29,13 @@ class SimulationWindow(QWidget):
 
     def __init__(self, model: FlowModel):
         super().__init__(parent=None)
-        self.simulator = Simulator(model)
+        self.simulator = Simulator(model, reduce=True)
         self.currency_names = {curr_id: prop['name'] for curr_id, prop in self.simulator.currency_properties().items()}
         self.__selected_currency = None
 
         # Simulation
         self.currency_storage = {curr_id: [0] for curr_id in self.simulator.currency_properties()}
-        while self.simulator.stage() < 1 and self.simulator.status == 0:
-            self.simulator.step()
-            for curr_id, properties in self.simulator.currency_properties().items():
-                self.currency_storage[curr_id].append(properties['storage'])
+        self.simulator.run(callback=self._record_storage)
 
         # UI
         layout = QVBoxLayout()
@@ -66,6 +63,18 @@ class SimulationWindow(QWidget):
             opt_panel = QLabel(f"Throughput Time: {round(flow['steps'], 2)} time steps")
             opt_panel.setStyleSheet('font-size: 12pt; margin: 0px 10px 0px 10px;')
             info.addWidget(opt_panel)
+            if self.simulator.num_stages() > 1:
+                lines = [f"{entry['name']}: {entry['duration'] if entry['step'] is not None else '-'} time steps"
+                    for entry in self.simulator.stage_results()]
+                stage_panel = QLabel('Stages\n' + '\n'.join(lines))
+                stage_panel.setStyleSheet('font-size: 10pt; margin: 10px 10px 0px 10px;')
+                info.addWidget(stage_panel)
+            bottlenecks = [entry for entry in self.simulator.sensitivity() if abs(entry['elasticity']) > 1e-6][:3]
+            if len(bottlenecks) > 0:
+                lines = [f"{entry['parameter']} {entry['name']}: {entry['elasticity']:+.2f}" for entry in bottlenecks]
+                bottleneck_panel = QLabel('Bottlenecks\n' + '\n'.join(lines))
+                bottleneck_panel.setStyleSheet('font-size: 10pt; margin: 10px 10px 0px 10px;')
+                info.addWidget(bottleneck_panel)
         else:
             status_panel = QLabel(flow['message'])
             status_panel.setWordWrap(True)
@@ -101,6 +110,10 @@ class SimulationWindow(QWidget):
         # Draw
         self._draw_plots()
 
+    def _record_storage(self, simulator: Simulator):
+        for curr_id, properties in simulator.currency_properties().items():
+            self.currency_storage[curr_id].append(properties['storage'])
+
     def _select_currency(self, index):
         if index == 0:
             self.__selected_currency = None